@@ -0,0 +1,171 @@
+import os
+import sys
+import time
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Конфигурация
+
+load_dotenv()
+
+# QUOTE_AGGREGATES=1 — D1/W1/MN1 для графиков читаются из quote_aggregates
+AGGREGATES_ENABLED = os.getenv("QUOTE_AGGREGATES", "1") == "1"
+AGGREGATE_SOURCE = os.getenv("AGGREGATE_SOURCE_TIMEFRAME", "M30")    # M30 или H1 — то, что грузится постоянно
+AGGREGATE_TIMEFRAMES = {"D1": "day", "W1": "week", "MN1": "month"}   # единица date_trunc (неделя — с понедельника)
+
+_VALUES = ["open", "high", "low", "close", "volume"]
+
+
+# Непрерывные агрегаты старших ТФ
+#
+# quote_aggregates хранит D1/W1/MN1, свёрнутые из AGGREGATE_SOURCE. Каждая запись
+# источника в copy_quotes пересчитывает только задетые ею бакеты — в той же транзакции,
+# по диапазону из quotes_staging, — и отправляет NOTIFY quotes_updated по агрегатам.
+# Чтение (read_aggregated) склеивает агрегаты с нативной серией FXOpen: до первого
+# полного бакета источника берутся загруженные D1/W1, дальше — агрегаты.
+
+AGGREGATES_TABLE_DDL = """
+    CREATE TABLE quote_aggregates (
+        ticker TEXT NOT NULL,
+        timeframe TEXT NOT NULL,
+        datetime TIMESTAMP NOT NULL,
+        open DOUBLE PRECISION,
+        high DOUBLE PRECISION,
+        low DOUBLE PRECISION,
+        close DOUBLE PRECISION,
+        volume DOUBLE PRECISION,
+        bars INTEGER NOT NULL,
+        updated_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (ticker, timeframe, datetime)
+    )
+"""
+
+
+def _refresh_sql(timeframe: str, touched: str, channel: str | None) -> str:
+    """
+    INSERT ... ON CONFLICT для бакетов timeframe; touched — подзапрос (ticker, lo, hi)
+    с границами бакетов, которые нужно пересчитать. С channel — ещё и NOTIFY по сериям.
+    """
+    unit = AGGREGATE_TIMEFRAMES[timeframe]
+    upsert = f"""
+            INSERT INTO quote_aggregates AS a (ticker, timeframe, datetime, {", ".join(_VALUES)}, bars, updated_at)
+            SELECT q.ticker, '{timeframe}', date_trunc('{unit}', q.datetime) AS bucket,
+                   (array_agg(q.open ORDER BY q.datetime))[1],
+                   MAX(q.high), MIN(q.low),
+                   (array_agg(q.close ORDER BY q.datetime DESC))[1],
+                   SUM(q.volume), COUNT(*), timezone('utc', now())
+            FROM touched t
+            JOIN instrument_quotes q
+              ON q.ticker = t.ticker AND q.timeframe = '{AGGREGATE_SOURCE}'
+             AND q.datetime >= t.lo AND q.datetime < t.hi
+            GROUP BY q.ticker, bucket
+            ON CONFLICT (ticker, timeframe, datetime) DO UPDATE
+            SET {", ".join(f"{c} = EXCLUDED.{c}" for c in _VALUES)},
+                bars = EXCLUDED.bars, updated_at = EXCLUDED.updated_at
+    """
+    if not channel:
+        return f"WITH touched AS ({touched}) {upsert}"
+    return f"""
+        WITH touched AS ({touched}),
+        refreshed AS ({upsert} RETURNING a.ticker, a.datetime)
+        SELECT pg_notify('{channel}', json_build_object(
+            'ticker', ticker, 'timeframe', '{timeframe}', 'last_bar', MAX(datetime))::text)
+        FROM refreshed GROUP BY ticker
+    """
+
+
+def _touched_sql(table: str, unit: str, where: str = "") -> str:
+    return f"""
+        SELECT ticker, date_trunc('{unit}', MIN(datetime)) AS lo,
+               date_trunc('{unit}', MAX(datetime)) + interval '1 {unit}' AS hi
+        FROM {table}
+        WHERE timeframe = '{AGGREGATE_SOURCE}' {where}
+        GROUP BY ticker
+    """
+
+
+def refresh_aggregates(cur, channel: str | None = None):
+    """
+    Пересчитывает бакеты D1/W1/MN1, задетые текущей записью (временная quotes_staging).
+    cur — курсор psycopg2 в транзакции copy_quotes, после вставки баров.
+    """
+    for tf, unit in AGGREGATE_TIMEFRAMES.items():
+        cur.execute(_refresh_sql(tf, _touched_sql("quotes_staging", unit), channel))
+
+
+def rebuild_aggregates(conn, tickers=None):
+    """Полный пересчёт агрегатов по истории источника (все тикеры или указанные)."""
+    where, params = "", {}
+    if tickers is not None:
+        where, params = "AND ticker = ANY(:tickers)", {"tickers": list(tickers)}
+    for tf, unit in AGGREGATE_TIMEFRAMES.items():
+        conn.execute(text(_refresh_sql(tf, _touched_sql("instrument_quotes", unit, where), None)), params)
+
+
+def ensure_aggregates_schema(conn):
+    """Создаёт quote_aggregates; при первом создании сворачивает уже накопленную историю."""
+    rebuild = ";\n".join(_refresh_sql(tf, _touched_sql("instrument_quotes", unit), None)
+                         for tf, unit in AGGREGATE_TIMEFRAMES.items())
+    conn.execute(text(f"""
+        DO $$
+        BEGIN
+            IF to_regclass('quote_aggregates') IS NULL THEN
+                {AGGREGATES_TABLE_DDL};
+                {rebuild};
+            END IF;
+        END
+        $$;
+    """))
+
+
+def uses_aggregates(timeframe: str) -> bool:
+    return AGGREGATES_ENABLED and timeframe in AGGREGATE_TIMEFRAMES
+
+
+# Чтение
+
+READ_AGGREGATED_SQL = f"""
+    WITH cutoff AS (
+        SELECT MIN(a.datetime) AS dt
+        FROM quote_aggregates a
+        WHERE a.ticker = :ticker AND a.timeframe = :tf
+          AND a.datetime >= (SELECT MIN(datetime) FROM instrument_quotes
+                             WHERE ticker = :ticker AND timeframe = '{AGGREGATE_SOURCE}')
+    )
+    SELECT a.datetime, {", ".join("a." + c for c in _VALUES)}
+    FROM quote_aggregates a, cutoff
+    WHERE a.ticker = :ticker AND a.timeframe = :tf AND a.datetime >= cutoff.dt
+      AND (CAST(:since AS timestamp) IS NULL OR a.datetime >= :since)
+    UNION ALL
+    SELECT q.datetime, {", ".join("q." + c for c in _VALUES)}
+    FROM instrument_quotes q, cutoff
+    WHERE q.ticker = :ticker AND q.timeframe = :tf AND (cutoff.dt IS NULL OR q.datetime < cutoff.dt)
+      AND (CAST(:since AS timestamp) IS NULL OR q.datetime >= :since)
+    ORDER BY datetime
+"""
+
+
+def read_aggregated(conn, ticker: str, timeframe: str, since=None):
+    """
+    Серия D1/W1/MN1: нативные бары до первого полного бакета источника, дальше — агрегаты.
+    Бакет, начавшийся раньше первого бара источника, неполный — его берём из нативной серии.
+    since — только бары не раньше этой даты (граница склейки считается по всей серии).
+    Архивные месяцы нативной серии (TIER_HOT_MONTHS с D1/W1/MN1) подмешивает вызывающий.
+    """
+    return pd.read_sql(text(READ_AGGREGATED_SQL), conn,
+                       params={"ticker": ticker, "tf": timeframe, "since": since})
+
+
+# Полный пересчёт вручную
+
+if __name__ == "__main__":
+    from core.database import engine, ensure_quotes_schema
+    ensure_quotes_schema()
+    started = time.time()
+    with engine.begin() as conn:
+        rebuild_aggregates(conn, sys.argv[1:] or None)
+    print(f"✅ Агрегаты {', '.join(AGGREGATE_TIMEFRAMES)} из {AGGREGATE_SOURCE} пересчитаны "
+          f"за {time.time() - started:.1f} с")
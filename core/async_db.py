@@ -0,0 +1,185 @@
+import os
+import re
+import sys
+import time
+import asyncio
+import weakref
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.database import (PG_HOST, PG_PORT, PG_DB, PG_USER, PG_PASSWORD, PG_SCHEMA,
+                           PG_POOL_SIZE, PG_MAX_OVERFLOW, PG_STATEMENT_TIMEOUT_MS)
+from core.aggregates import READ_AGGREGATED_SQL, uses_aggregates
+from core.tiering import read_archive_files, merge_tiers
+
+try:
+    import asyncpg
+except ImportError:   # asyncpg не установлен — асинхронный путь недоступен, синхронный работает как раньше
+    asyncpg = None
+
+# Конфигурация
+
+ASYNC_POOL_SIZE = int(os.getenv("PG_ASYNC_POOL_SIZE", str(PG_POOL_SIZE + PG_MAX_OVERFLOW)))
+
+
+# Асинхронный доступ к БД
+#
+# Те же запросы, что и в синхронных сервисах (chart_service, data_ingestion_ws, check_symbols),
+# но на asyncpg: корутины не блокируют поток, а независимые запросы — например, водяные
+# знаки сотни тикеров — идут параллельно по соединениям пула. Пул asyncpg привязан
+# к event loop, поэтому у каждого loop (asyncio.run в загрузчиках) он свой;
+# close_pool() закрывает пул текущего loop.
+
+_pools = weakref.WeakKeyDictionary()
+
+
+def _numbered(sql: str):
+    """:name → $1, $2 … для asyncpg; возвращает (sql, порядок имён). Приведения вида ::text не трогаются."""
+    names = []
+
+    def number(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return re.sub(r"(?<![:\w]):(\w+)", number, sql), names
+
+
+async def get_pool():
+    """Пул соединений текущего event loop (создаётся при первом обращении)."""
+    if asyncpg is None:
+        raise RuntimeError("Для асинхронного доступа к БД установите пакет asyncpg")
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        settings = {"search_path": PG_SCHEMA}
+        if PG_STATEMENT_TIMEOUT_MS:
+            settings["statement_timeout"] = str(PG_STATEMENT_TIMEOUT_MS)
+        pool = await asyncpg.create_pool(
+            host=PG_HOST, port=int(PG_PORT or 5432), database=PG_DB, user=PG_USER, password=PG_PASSWORD,
+            min_size=1, max_size=ASYNC_POOL_SIZE, server_settings=settings,
+        )
+        # Пока создавался пул, его мог создать и другой таск этого loop
+        if loop in _pools:
+            await pool.close()
+        else:
+            _pools[loop] = pool
+    return _pools[loop]
+
+
+async def close_pool():
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
+
+
+# Инструменты
+
+async def load_db_tickers() -> list:
+    pool = await get_pool()
+    rows = await pool.fetch("SELECT ticker FROM instruments")
+    return [r["ticker"].strip() for r in rows if r["ticker"]]
+
+
+# Водяные знаки серий
+
+WATERMARK_SQL = "SELECT last_bar FROM quote_watermarks WHERE ticker = $1 AND timeframe = $2"
+LAST_BAR_SQL = "SELECT MAX(datetime) FROM instrument_quotes WHERE ticker = $1 AND timeframe = $2"
+
+
+async def get_last_datetime(ticker: str, timeframe: str):
+    """Последний бар серии: строка quote_watermarks, для серий без неё — MAX по индексу."""
+    pool = await get_pool()
+    result = await pool.fetchval(WATERMARK_SQL, ticker, timeframe)
+    if result is None:
+        result = await pool.fetchval(LAST_BAR_SQL, ticker, timeframe)
+    return result
+
+
+async def get_last_datetimes(tickers, timeframe: str) -> dict:
+    """
+    {тикер: последний бар или None} для многих серий: водяные знаки — одним запросом,
+    серии без водяного знака досчитываются параллельно по соединениям пула.
+    """
+    tickers = list(tickers)
+    pool = await get_pool()
+    rows = await pool.fetch("""
+        SELECT ticker, last_bar FROM quote_watermarks
+        WHERE timeframe = $1 AND ticker = ANY($2::text[])
+    """, timeframe, tickers)
+    result = {t: None for t in tickers}
+    result.update({r["ticker"]: r["last_bar"] for r in rows})
+    missing = [t for t in tickers if result[t] is None]
+    bars = await asyncio.gather(*(pool.fetchval(LAST_BAR_SQL, t, timeframe) for t in missing))
+    result.update(zip(missing, bars))
+    return result
+
+
+# Свечи
+
+CANDLES_SQL = """
+    SELECT datetime, open, high, low, close, volume
+    FROM instrument_quotes
+    WHERE ticker = $1 AND timeframe = $2 AND ($3::timestamp IS NULL OR datetime >= $3)
+    ORDER BY datetime ASC
+"""
+ARCHIVES_SQL = """
+    SELECT path FROM quote_archives
+    WHERE timeframe = $1 AND $2 = ANY(tickers) AND ($3::timestamp IS NULL OR period_end > $3)
+    ORDER BY period_start
+"""
+_AGGREGATED_SQL, _AGGREGATED_PARAMS = _numbered(READ_AGGREGATED_SQL)
+_CANDLE_COLUMNS = ["datetime", "open", "high", "low", "close", "volume"]
+
+
+async def fetch_candles(symbol: str, timeframe: str, since=None):
+    """
+    Свечи (datetime, open, high, low, close) из БД, как chart_service.read_candles:
+    D1/W1/MN1 — из quote_aggregates, внутридневные — горячие бары; у обоих — вместе с архивом.
+    since — только бары не раньше этой даты, фильтр уходит в SQL. Без догрузки из FXOpen —
+    это дело синхронного fetch_candles и демона ингестии.
+    """
+    pool = await get_pool()
+    aggregated = uses_aggregates(timeframe)
+    if aggregated:
+        params = {"ticker": symbol, "tf": timeframe, "since": since}
+        candles = pool.fetch(_AGGREGATED_SQL, *(params[name] for name in _AGGREGATED_PARAMS))
+    else:
+        candles = pool.fetch(CANDLES_SQL, symbol, timeframe, since)
+    rows, archives = await asyncio.gather(candles, pool.fetch(ARCHIVES_SQL, timeframe, symbol, since))
+    if archives:
+        # У D1/W1/MN1 в архиве только нативные бары старше склеенной серии
+        end = rows[0]["datetime"] if aggregated and rows else None
+        # Архивы декодируются в потоке, чтобы не держать event loop
+        archived = await asyncio.to_thread(read_archive_files, [r["path"] for r in archives], [symbol],
+                                           since, end)
+        hot = pd.DataFrame([tuple(r) for r in rows], columns=_CANDLE_COLUMNS)
+        df = merge_tiers(archived.drop(columns="ticker"), hot, keys=("datetime",))
+        return list(df[_CANDLE_COLUMNS[:5]].itertuples(index=False, name=None))
+    return [(r["datetime"], r["open"], r["high"], r["low"], r["close"]) for r in rows]
+
+
+# Проверка: водяные знаки всей вселенной — последовательно и параллельно
+
+if __name__ == "__main__":
+    timeframe = sys.argv[1] if len(sys.argv) > 1 else "M30"
+
+    async def main():
+        try:
+            tickers = await load_db_tickers()
+            started = time.perf_counter()
+            for ticker in tickers:
+                await get_last_datetime(ticker, timeframe)
+            sequential = time.perf_counter() - started
+
+            started = time.perf_counter()
+            marks = await get_last_datetimes(tickers, timeframe)
+            batched = time.perf_counter() - started
+        finally:
+            await close_pool()
+        print(f"⏱ {len(tickers)} тикеров {timeframe}: по одному {sequential * 1000:.0f} мс | "
+              f"пакетом {batched * 1000:.0f} мс | с данными: {sum(v is not None for v in marks.values())}")
+
+    asyncio.run(main())
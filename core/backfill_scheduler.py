@@ -0,0 +1,46 @@
+import os
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+from core.rate_limit import TokenBucket
+from data_providers.fxopen_session import get_session_pool, POOL_SIZE
+
+# Конфигурация
+
+load_dotenv()
+
+# Лимиты FXOpen Web API: запросы истории в секунду и допустимый всплеск
+FXOPEN_REQUESTS_PER_SEC = float(os.getenv("FXOPEN_REQUESTS_PER_SEC", "5"))
+FXOPEN_BURST = float(os.getenv("FXOPEN_BURST", "10"))
+
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", str(POOL_SIZE)))
+TICKER_TIMEOUT = float(os.getenv("BACKFILL_TICKER_TIMEOUT", "120"))
+
+
+_rate_limiter = None
+
+
+def get_rate_limiter() -> TokenBucket:
+    """Общий для процесса ограничитель запросов к FXOpen (подключается к пулу сессий)."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = TokenBucket(FXOPEN_REQUESTS_PER_SEC, FXOPEN_BURST)
+        get_session_pool().rate_limiter = _rate_limiter
+    return _rate_limiter
+
+
+@dataclass
+class PassSummary:
+    """Итог прохода по вселенной тикеров (у планировщика — за окно между сводками)."""
+    timeframe: str
+    tickers_total: int = 0
+    tickers_done: int = 0
+    tickers_failed: list = field(default_factory=list)
+    tickers_timed_out: list = field(default_factory=list)
+    bars_written: int = 0
+    wall_time: float = 0.0
+
+    def __str__(self):
+        return (f"📈 Проход {self.timeframe}: {self.tickers_done}/{self.tickers_total} тикеров, "
+                f"{self.bars_written} баров записано, "
+                f"ошибок {len(self.tickers_failed)}, таймаутов {len(self.tickers_timed_out)}, "
+                f"{self.wall_time:.1f} с")
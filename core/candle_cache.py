@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import time
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+from urllib.parse import quote
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.database import engine
+from core.tiering import read_quotes_tiered
+
+# Конфигурация
+
+load_dotenv()
+
+CANDLE_CACHE_ENABLED = os.getenv("CANDLE_CACHE", "1") == "1"
+CANDLE_CACHE_DIR = os.getenv("CANDLE_CACHE_DIR", os.path.join("cache", "candles"))
+CANDLE_CACHE_MAX_MB = float(os.getenv("CANDLE_CACHE_MAX_MB", "512"))
+
+FORMAT_VERSION = 1          # меняется при изменении раскладки файлов — старый кэш перечитывается
+VALUE_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+_TS_FILE = "ts.bin"         # int64, нс UTC
+_VALUES_FILE = "ohlcv.bin"  # float64, строки по 5 значений
+_META_FILE = "meta.json"
+_ROW_BYTES = 8 + 8 * len(VALUE_COLUMNS)
+
+
+# Локальный колоночный кэш свечей
+#
+# По каталогу на серию (<dir>/<timeframe>/<ticker>/): два бинарных столбца и meta.json
+# с числом строк, последним баром (водяной знак) и bar_count из quote_watermarks на
+# момент синхронизации. Обновление только дописывает хвост: из БД читаются бары
+# не старше водяного знака (последний бар мог измениться), файлы обрезаются до него
+# и дописываются. Если bar_count в БД вырос больше, чем пришло новых баров, значит
+# историю догрузили в середину/начало (deep_backfill, gap_scanner) — серия
+# перечитывается целиком. Размер кэша ограничен, вытесняются давно не открытые серии;
+# объём ведётся счётчиком в write()/invalidate(), каталог обходится только при превышении.
+
+class CandleCache:
+    def __init__(self, root: str = CANDLE_CACHE_DIR, max_bytes: int = int(CANDLE_CACHE_MAX_MB * 2**20)):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sizes = None   # path -> байт на диске; считается одним обходом при первом обращении
+
+    def _account(self, path: str, size: int | None):
+        """Обновляет счётчик объёма после записи (size) или удаления (None) серии."""
+        if self._sizes is None:
+            return
+        if size is None:
+            self._sizes.pop(path, None)
+        else:
+            self._sizes[path] = size
+
+    @property
+    def total_bytes(self) -> int:
+        if self._sizes is None:
+            self._sizes = {path: size for path, size, _ in self.entries()}
+        return sum(self._sizes.values())
+
+    def _path(self, ticker: str, timeframe: str) -> str:
+        return os.path.join(self.root, timeframe, quote(ticker, safe=""))
+
+    # Чтение и запись файлов
+
+    def load(self, ticker: str, timeframe: str):
+        """(ts_ns, values, meta) из кэша или None, если серии нет или файлы не согласованы."""
+        path = self._path(ticker, timeframe)
+        try:
+            with open(os.path.join(path, _META_FILE), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != FORMAT_VERSION:
+                raise ValueError(f"версия формата {meta.get('version')}")
+            rows = meta["rows"]
+            ts = np.fromfile(os.path.join(path, _TS_FILE), dtype=np.int64, count=rows)
+            values = np.fromfile(os.path.join(path, _VALUES_FILE), dtype=np.float64,
+                                 count=rows * len(VALUE_COLUMNS)).reshape(-1, len(VALUE_COLUMNS))
+            if len(ts) != rows or len(values) != rows:
+                raise ValueError(f"ожидалось {rows} строк, прочитано {len(ts)}")
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[candle_cache] Кэш {ticker} ({timeframe}) повреждён, перечитываем: {e}")
+            self.invalidate(ticker, timeframe)
+            return None
+        # mtime meta.json — время последнего обращения для вытеснения
+        os.utime(os.path.join(path, _META_FILE))
+        return ts, values, meta
+
+    def write(self, ticker: str, timeframe: str, keep: int, ts: np.ndarray, values: np.ndarray,
+              bar_count=None):
+        """Оставляет первые keep строк и дописывает ts/values; meta.json заменяется последним."""
+        path = self._path(ticker, timeframe)
+        os.makedirs(path, exist_ok=True)
+        columns = ((_TS_FILE, ts.astype(np.int64), 8), (_VALUES_FILE, values.astype(np.float64), _ROW_BYTES - 8))
+        for name, data, row_bytes in columns:
+            with open(os.path.join(path, name), "r+b" if keep else "wb") as f:
+                f.seek(keep * row_bytes)
+                f.truncate()
+                f.write(np.ascontiguousarray(data).tobytes())
+        rows = keep + len(ts)
+        meta = {
+            "version": FORMAT_VERSION,
+            "ticker": ticker,
+            "timeframe": timeframe,
+            "rows": rows,
+            "watermark": int(ts[-1]) if len(ts) else None,
+            "bar_count": bar_count,
+            "synced_at": time.time(),
+        }
+        tmp = os.path.join(path, f"{_META_FILE}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(path, _META_FILE))
+        self._account(path, rows * _ROW_BYTES + os.path.getsize(os.path.join(path, _META_FILE)))
+        return meta
+
+    def invalidate(self, ticker: str, timeframe: str):
+        path = self._path(ticker, timeframe)
+        shutil.rmtree(path, ignore_errors=True)
+        self._account(path, None)
+
+    # Вытеснение
+
+    def entries(self):
+        """[(path, bytes, last_access)] по всем сериям в кэше."""
+        result = []
+        for tf in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            tf_dir = os.path.join(self.root, tf)
+            for name in os.listdir(tf_dir):
+                path = os.path.join(tf_dir, name)
+                try:
+                    size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                    result.append((path, size, os.path.getmtime(os.path.join(path, _META_FILE))))
+                except OSError:
+                    continue
+        return result
+
+    def evict(self, keep_path: str | None = None) -> int:
+        """
+        Удаляет давно не открытые серии, пока кэш не уложится в max_bytes.
+        Каталог обходится только при превышении по счётчику; обход заодно сверяет счётчик
+        с диском (кэш могли менять другие процессы).
+        """
+        if self.total_bytes <= self.max_bytes:
+            return 0
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        self._sizes = {path: size for path, size, _ in entries}
+        total = sum(self._sizes.values())
+        removed = 0
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            self._sizes.pop(path)
+            total -= size
+            removed += 1
+        return removed
+
+    # Синхронизация с instrument_quotes
+
+    def sync(self, ticker: str, timeframe: str):
+        """
+        Возвращает всю серию (ts_ns int64, values float64 (n, 5)), дочитывая из БД
+        только бары начиная с водяного знака кэша.
+        """
+        with self._lock:
+            cached = self.load(ticker, timeframe)
+            with engine.connect() as conn:
+                mark = conn.execute(text("""
+                    SELECT bar_count FROM quote_watermarks
+                    WHERE ticker = :ticker AND timeframe = :tf
+                """), {"ticker": ticker, "tf": timeframe}).first()
+                bar_count = mark[0] if mark else None
+
+                if cached is not None:
+                    ts, values, meta = cached
+                    since = meta["watermark"]
+                    new_ts, new_values = _read_bars(conn, ticker, timeframe, since)
+                    keep = int(np.searchsorted(ts, new_ts[0])) if len(new_ts) else len(ts)
+                    added = len(new_ts) - (len(ts) - keep)
+                    if (bar_count is not None and meta.get("bar_count") is not None
+                            and bar_count - meta["bar_count"] != added):
+                        print(f"[candle_cache] История {ticker} ({timeframe}) изменилась, перечитываем серию")
+                        cached = None
+                    elif not len(new_ts) or (added == 0 and np.array_equal(values[keep:], new_values, equal_nan=True)):
+                        return ts, values
+                    else:
+                        self.write(ticker, timeframe, keep, new_ts, new_values, bar_count)
+                        result = (np.concatenate([ts[:keep], new_ts]),
+                                  np.concatenate([values[:keep], new_values]))
+
+                if cached is None:
+                    new_ts, new_values = _read_bars(conn, ticker, timeframe)
+                    if not len(new_ts):
+                        return new_ts, new_values
+                    self.write(ticker, timeframe, 0, new_ts, new_values, bar_count)
+                    result = (new_ts, new_values)
+
+            path = self._path(ticker, timeframe)
+            if self.evict(keep_path=path):
+                print(f"[candle_cache] Кэш превысил {self.max_bytes / 2**20:.0f} МБ — вытеснены старые серии")
+            return result
+
+
+def _read_bars(conn, ticker: str, timeframe: str, since_ns=None):
+    if since_ns is None:
+        # Полная загрузка серии — вместе с месяцами, перенесёнными в архив
+        df = read_quotes_tiered(conn, ticker, timeframe)
+        ts = df["datetime"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        return ts, df[VALUE_COLUMNS].to_numpy(dtype=np.float64, na_value=np.nan)
+    query = f"""
+        SELECT datetime, {", ".join(VALUE_COLUMNS)}
+        FROM instrument_quotes
+        WHERE ticker = :ticker AND timeframe = :tf AND datetime >= :since
+    """
+    params = {"ticker": ticker, "tf": timeframe, "since": pd.Timestamp(since_ns).to_pydatetime()}
+    df = pd.read_sql(text(query + " ORDER BY datetime"), conn, params=params)
+    ts = df["datetime"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    return ts, df[VALUE_COLUMNS].to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def to_tuples(ts: np.ndarray, values: np.ndarray):
+    """Столбцы кэша → [(datetime, open, high, low, close)], как ждут графики."""
+    dts = ts.astype("datetime64[ns]").astype("datetime64[us]").tolist()
+    o, h, l, c = (values[:, i].tolist() for i in range(4))
+    return list(zip(dts, o, h, l, c))
+
+
+_cache = None
+
+
+def get_candle_cache():
+    """Общий кэш процесса; None, если CANDLE_CACHE=0."""
+    global _cache
+    if not CANDLE_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = CandleCache()
+    return _cache
+
+
+# Замер: первое открытие серии против повторного
+
+if __name__ == "__main__":
+    symbol, tf = (sys.argv[1:3] + ["EURUSD", "M30"][len(sys.argv[1:3]):])
+    cache = CandleCache()
+    cache.invalidate(symbol, tf)
+    for label in ("холодный", "тёплый"):
+        started = time.perf_counter()
+        candles = to_tuples(*cache.sync(symbol, tf))
+        print(f"⏱ {label}: {len(candles)} свечей за {(time.perf_counter() - started) * 1000:.1f} мс")
@@ -1,41 +1,28 @@
 import os
+import sys
 import time
-import json
-import base64
-import hmac
-import hashlib
+import asyncio
 import pandas as pd
-from uuid import uuid4
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from websocket import create_connection
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 
-# Конфигурация
-
-load_dotenv()
-
-FXOPEN_API_ID = os.getenv("FXOPEN_API_ID")
-FXOPEN_API_KEY = os.getenv("FXOPEN_API_KEY")
-FXOPEN_API_SECRET = os.getenv("FXOPEN_API_SECRET")
-
-PG_HOST = os.getenv("PG_HOST")
-PG_PORT = os.getenv("PG_PORT")
-PG_DB = os.getenv("PG_DB")
-PG_USER = os.getenv("PG_USER")
-PG_PASSWORD = os.getenv("PG_PASSWORD")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-DB_URL = f"postgresql+psycopg2://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}"
-engine = create_engine(DB_URL)
+from data_providers.fxopen_session import get_session_pool, FXOpenAuthError
+from data_providers.fxopen_async import AsyncFXOpenClient
+from data_providers.fxopen_bars import BarBuffer, parse_bars, bars_frame
+from core.database import engine
+from core.quotes_writer import copy_quotes, read_watermark, touch_watermark
+from core.refresh_scheduler import RefreshScheduler
+from core.timeframes import timeframe_delta
+from core.resampler import (DERIVE_FROM_M1, BASE_TIMEFRAME, DERIVED_TIMEFRAMES, derive_tail,
+                            needs_native_history, source_timeframe)
+from core.metrics import BARS_FETCHED, BARS_PER_SECOND, TICKER_SECONDS, INGEST_ERRORS, start_exporters
 
-WS_URL = "wss://marginalttlivewebapi.fxopen.net/feed"
-
-# Подпись HMAC
+# Конфигурация
 
-def create_signature(timestamp, api_id, api_key, secret):
-    msg = f"{timestamp}{api_id}{api_key}"
-    digest = hmac.new(secret.encode(), msg.encode(), hashlib.sha256).digest()
-    return base64.b64encode(digest).decode()
+load_dotenv()
 
 # Получение тикеров из instruments
 
@@ -48,205 +35,312 @@ def get_tickers_from_db():
 # Проверка последней даты по тикеру
 
 def get_last_datetime(ticker, timeframe):
-    query = text("""
-        SELECT MAX(datetime)
-        FROM instrument_quotes
-        WHERE ticker = :ticker AND timeframe = :tf
-    """)
+    """Последний бар серии: строка quote_watermarks, для серий без неё — MAX по индексу."""
     with engine.connect() as conn:
-        result = conn.execute(query, {"ticker": ticker, "tf": timeframe}).scalar()
+        result = read_watermark(conn, ticker, timeframe)
+        if result is None:
+            result = conn.execute(text("""
+                SELECT MAX(datetime)
+                FROM instrument_quotes
+                WHERE ticker = :ticker AND timeframe = :tf
+            """), {"ticker": ticker, "tf": timeframe}).scalar()
     return result
 
 
 # Получение истории котировок
 
-def fetch_quote_history(symbol: str, timeframe: str = "D1", since: datetime | None = None):
+PAGE_SIZE = 1000
+
+
+def _history_params(next_from: datetime | None) -> dict:
+    if next_from is None:
+        # Первичная загрузка — 1000 баров назад
+        return {"Count": -PAGE_SIZE, "Timestamp": int(time.time() * 1000)}
+    # Догрузка — по 1000 баров вперёд
+    # Время в БД — UTC без tzinfo; datetime.timestamp() трактовал бы его как локальное
+    return {"Count": PAGE_SIZE, "From": int(pd.Timestamp(next_from).value // 1_000_000)}
+
+
+def _bars_to_frame(bars: list, symbol: str, timeframe: str) -> pd.DataFrame:
+    return bars_frame(*parse_bars(bars), symbol, timeframe)
+
+
+def fetch_quote_history(symbol: str, timeframe: str = "D1", since: datetime | None = None,
+                        deadline: float | None = None, until: datetime | None = None):
     """
     Загружает бары из FXOpen.
     - Если since=None → загружает последние 1000 баров (исторические, Count=-1000)
     - Если since задан → догружает новые бары вперёд по 1000 за итерацию (Count=1000)
+    - until (вместе с since) — загрузка только диапазона [since, until)
+    - deadline (time.time()) — после него новые страницы не запрашиваются,
+      возвращается уже загруженное
+    Страницы разбираются сразу в колонки NumPy (BarBuffer), DataFrame создаётся один раз в конце.
     """
-    print(f"⏳ Подключаемся к WebSocket для {symbol} ({timeframe})...")
+    print(f"⏳ Загружаем историю {symbol} ({timeframe})...")
 
-    all_data = []
-    total_bars = 0
+    started = time.time()
+    buffer = BarBuffer()
     iteration = 0
     next_from = since
-    last_max_dt = None
+    last_max_ms = None
+    until_ms = int(pd.Timestamp(until).value // 1_000_000) if until is not None else None
+
+    pool = get_session_pool()
 
     while True:
-        iteration += 1
-        ws = create_connection(WS_URL)
-        timestamp = int(time.time() * 1000)
-        signature = create_signature(timestamp, FXOPEN_API_ID, FXOPEN_API_KEY, FXOPEN_API_SECRET)
-
-        # Авторизация
-        login_msg = {
-            "Id": str(uuid4()),
-            "Request": "Login",
-            "Params": {
-                "AuthType": "HMAC",
-                "WebApiId": FXOPEN_API_ID,
-                "WebApiKey": FXOPEN_API_KEY,
-                "Timestamp": timestamp,
-                "Signature": signature,
-                "DeviceId": "DELTA_PORTFOLIO_APP",
-                "AppSessionId": "AUTO_UPDATE"
-            }
-        }
-        ws.send(json.dumps(login_msg))
-        response = json.loads(ws.recv())
-        if response.get("Response") != "Login" or response.get("Result", {}).get("Info") != "ok":
-            print("❌ Ошибка авторизации:", response)
-            ws.close()
+        if deadline is not None and iteration and time.time() > deadline:
+            print(f"⏱ Время на {symbol} ({timeframe}) истекло, догрузка продолжится в следующем проходе.")
             break
-
+        iteration += 1
         # Формирование запроса
-        req_id = str(uuid4())
         params = {
             "Symbol": symbol,
             "Periodicity": timeframe,
             "PriceType": "bid",
+            **_history_params(next_from)
         }
 
-        if next_from is None:
-            # Первичная загрузка — 1000 баров назад
-            params["Count"] = -1000
-            params["Timestamp"] = int(time.time() * 1000)
-        else:
-            # Догрузка — по 1000 баров вперёд
-            params["Count"] = 1000
-            params["From"] = int(next_from.timestamp() * 1000)
-
-        ws.send(json.dumps({"Id": req_id, "Request": "QuoteHistoryBars", "Params": params}))
-        data = json.loads(ws.recv())
-        ws.close()
+        # Запрос идёт через уже авторизованную сессию из пула
+        try:
+            data = pool.request("QuoteHistoryBars", params)
+        except FXOpenAuthError as e:
+            print("❌", e)
+            break
 
         bars = data.get("Result", {}).get("Bars", [])
         if not bars:
             print(f"⚙️ FXOpen не вернул данных для {symbol}")
             break
 
-        # --- Преобразуем в DataFrame ---
-        df_part = pd.DataFrame(bars)
-        df_part["datetime"] = pd.to_datetime(df_part["Timestamp"], unit="ms")
+        # --- Разбор страницы в колонки ---
+        ts, values = parse_bars(bars)
+        page_size = len(ts)
 
         # --- защита от зацикливания ---
-        current_max_dt = df_part["datetime"].max()
-        if last_max_dt and current_max_dt <= last_max_dt:
-            print(f"⚠️ FXOpen вернул те же бары ({current_max_dt}), прерываем.")
+        current_max_ms = int(ts.max())
+        if last_max_ms is not None and current_max_ms <= last_max_ms:
+            print(f"⚠️ FXOpen вернул те же бары ({_ms_to_datetime(current_max_ms)}), прерываем.")
             break
-        last_max_dt = current_max_dt
+        last_max_ms = current_max_ms
+
+        if until_ms is not None:
+            keep = ts < until_ms
+            ts, values = ts[keep], values[keep]
+        buffer.append(ts, values)
 
-        df_part["ticker"] = symbol
-        df_part["timeframe"] = timeframe
-        df_part.rename(columns={
-            "Open": "open",
-            "High": "high",
-            "Low": "low",
-            "Close": "close",
-            "Volume": "volume"
-        }, inplace=True)
-        df_part = df_part[["ticker", "timeframe", "datetime", "open", "high", "low", "close", "volume"]]
-        all_data.append(df_part)
-
-        total_bars += len(df_part)
-        print(f"✅ [{iteration}] Получено {len(df_part)} баров ({df_part['datetime'].min()} → {df_part['datetime'].max()})")
+        if len(ts):
+            print(f"✅ [{iteration}] Получено {len(ts)} баров "
+                  f"({_ms_to_datetime(ts.min())} → {_ms_to_datetime(ts.max())})")
 
         # --- Если это первичная загрузка (-1000), достаточно 1 итерации ---
         if since is None:
-            print(f"🧩 Первичная загрузка завершена ({len(df_part)} баров).")
+            print(f"🧩 Первичная загрузка завершена ({len(ts)} баров).")
             break
 
         # --- Если меньше 1000, значит достигнут конец истории ---
-        if len(df_part) < 1000:
+        if page_size < PAGE_SIZE:
             print(f"ℹ️ Последняя порция <1000 баров, загрузка завершена.")
             break
 
+        # --- Диапазон [since, until) загружен ---
+        if until_ms is not None and current_max_ms >= until_ms:
+            break
+
         # --- Следующее окно ---
-        next_from = df_part["datetime"].max() + timedelta(milliseconds=1)
-        time.sleep(0.5)
+        next_from = _ms_to_datetime(current_max_ms + 1)
 
-    if not all_data:
+    if not len(buffer):
         print(f"⚠️ Нет данных для {symbol}")
         return pd.DataFrame()
 
-    df = pd.concat(all_data).drop_duplicates(subset="datetime").sort_values("datetime")
-    print(f"🎯 Загружено всего {total_bars} баров ({iteration} запросов) для {symbol} ({timeframe})")
+    df = buffer.to_frame(symbol, timeframe)
+    BARS_FETCHED.inc(len(df), timeframe=timeframe)
+    BARS_PER_SECOND.observe(len(df) / max(time.time() - started, 1e-6), timeframe=timeframe)
+    print(f"🎯 Загружено всего {len(df)} баров ({iteration} запросов) для {symbol} ({timeframe})")
     return df
 
-# Сохранение котировок в instrument_quotes (без дублей)
 
-def save_to_db(df: pd.DataFrame):
+def _ms_to_datetime(ms) -> datetime:
+    return datetime(1970, 1, 1) + timedelta(milliseconds=int(ms))
+
+# Пакетная загрузка истории по многим тикерам
+
+async def _fetch_history_async(client: AsyncFXOpenClient, symbol: str, timeframe: str,
+                               since: datetime | None) -> pd.DataFrame:
+    """То же окно загрузки, что и fetch_quote_history, но по общему асинхронному клиенту."""
+    parts = []
+    next_from = since
+    last_max_dt = None
+
+    while True:
+        bars = await client.quote_history_bars(symbol, timeframe, **_history_params(next_from))
+        if not bars:
+            break
+
+        df_part = _bars_to_frame(bars, symbol, timeframe)
+        current_max_dt = df_part["datetime"].max()
+        if last_max_dt and current_max_dt <= last_max_dt:
+            break
+        last_max_dt = current_max_dt
+        parts.append(df_part)
+
+        if since is None or len(df_part) < PAGE_SIZE:
+            break
+        next_from = current_max_dt + timedelta(milliseconds=1)
+
+    if not parts:
+        return pd.DataFrame()
+    return pd.concat(parts).drop_duplicates(subset="datetime").sort_values("datetime")
+
+
+async def _fetch_history_many(symbols: list, timeframe: str, since: dict) -> dict:
+    async with AsyncFXOpenClient(app_session_id="BATCH_BACKFILL") as client:
+        frames = await asyncio.gather(*[
+            _fetch_history_async(client, sym, timeframe, since.get(sym))
+            for sym in symbols
+        ], return_exceptions=True)
+
+    results = {}
+    for sym, df in zip(symbols, frames):
+        if isinstance(df, Exception):
+            print(f"❌ Ошибка загрузки {sym} ({timeframe}): {df}")
+            continue
+        results[sym] = df
+    return results
+
+
+def fetch_quote_history_many(symbols: list, timeframe: str = "D1",
+                             since: dict | None = None) -> dict:
+    """
+    Загружает историю сразу по многим тикерам через одно соединение.
+    Запросы по всем тикерам находятся в полёте одновременно, поэтому общее
+    время ≈ один RTT + передача данных, а не N последовательных RTT.
+    since — {тикер: datetime} для догрузки; тикеры без записи грузятся с нуля.
+    Возвращает {тикер: DataFrame}.
+    """
+    print(f"⏳ Пакетная загрузка {len(symbols)} тикеров ({timeframe})...")
+    started = time.time()
+    results = asyncio.run(_fetch_history_many(list(symbols), timeframe, since or {}))
+    total_bars = sum(len(df) for df in results.values())
+    print(f"🎯 Загружено {total_bars} баров по {len(results)} тикерам за {time.time() - started:.1f} с")
+    return results
+
+# Сохранение котировок в instrument_quotes (COPY, без дублей)
+
+def save_to_db(df: pd.DataFrame) -> int:
+    """Возвращает число записанных баров."""
     if df.empty:
         print("⚠️ Пустой DataFrame, пропускаем.")
-        return
+        return 0
 
     ticker = df["ticker"].iloc[0]
     timeframe = df["timeframe"].iloc[0]
 
     with engine.begin() as conn:
-        existing_dates = pd.read_sql(
-            text("""
-                SELECT datetime FROM instrument_quotes
-                WHERE ticker = :ticker AND timeframe = :tf
-            """),
-            conn,
-            params={"ticker": ticker, "tf": timeframe}
-        )['datetime'].astype('datetime64[ns]')
+        written = copy_quotes(conn, df)
+        # Производные ТФ пересчитываются только в затронутых хвостовых бакетах
+        if DERIVE_FROM_M1 and timeframe == BASE_TIMEFRAME:
+            derive_tail(conn, ticker, df["datetime"].min())
 
-        df_filtered = df[~df["datetime"].isin(existing_dates)]
+    if written:
+        print(f"📊 Добавлено {written} новых баров для {ticker} ({timeframe})")
+    else:
+        print(f"✅ Нет новых баров для {ticker} ({timeframe}) — пропускаем.")
+    return written
 
-        if not df_filtered.empty:
-            df_filtered.to_sql("instrument_quotes", conn, if_exists="append", index=False)
-            print(f"📊 Добавлено {len(df_filtered)} новых баров для {ticker} ({timeframe})")
-        else:
-            print(f"✅ Нет новых баров для {ticker} ({timeframe}) — пропускаем.")
+def load_native_history(ticker: str, timeframe: str, deadline: float | None = None) -> int:
+    """
+    В режиме DERIVE_FROM_M1: пока M1 не покрывает старую часть производного ТФ,
+    она берётся у FXOpen в самом ТФ. Бары, уже посчитанные из M1, не перезаписываются.
+    """
+    with engine.connect() as conn:
+        if not needs_native_history(conn, ticker, timeframe):
+            return 0
+    print(f"📥 M1 ещё не покрывает {ticker} ({timeframe}) — загружаем нативную историю")
+    df = fetch_quote_history(ticker, timeframe=timeframe, since=None, deadline=deadline)
+    if df.empty:
+        return 0
+    with engine.begin() as conn:
+        return copy_quotes(conn, df, on_conflict="nothing")
 
 # Проверка и обновление котировок
 
-def update_quotes_if_needed(ticker, timeframe):
+def update_quotes_if_needed(ticker, timeframe, deadline: float | None = None) -> int:
+    """Догружает котировки, если пора. Возвращает число записанных баров."""
+    timeframe = source_timeframe(timeframe)
+    started = time.time()
+    try:
+        return _update_series(ticker, timeframe, deadline)
+    except Exception:
+        INGEST_ERRORS.inc(source="fxopen", ticker=ticker)
+        raise
+    finally:
+        TICKER_SECONDS.inc(time.time() - started, ticker=ticker, timeframe=timeframe)
+
+
+def _update_series(ticker, timeframe, deadline: float | None) -> int:
     print(f"🔍 Проверка обновления для {ticker} ({timeframe})")
     last_dt = get_last_datetime(ticker, timeframe)
     now = datetime.utcnow()
 
-    refresh_period = {
-        "M1": timedelta(minutes=1),
-        "M5": timedelta(minutes=5),
-        "M15": timedelta(minutes=15),
-        "M30": timedelta(minutes=30),
-        "H1": timedelta(hours=1),
-        "D1": timedelta(days=1)
-    }.get(timeframe, timedelta(hours=1))
+    refresh_period = timeframe_delta(timeframe)
 
     if last_dt is None:
         print(f"🆕 История отсутствует в БД → первичная загрузка {ticker} ({timeframe})")
-        df = fetch_quote_history(ticker, timeframe=timeframe, since=None)
-        if not df.empty:
-            save_to_db(df)
+        df = fetch_quote_history(ticker, timeframe=timeframe, since=None, deadline=deadline)
+        written = save_to_db(df) if not df.empty else 0
+        if DERIVE_FROM_M1 and timeframe == BASE_TIMEFRAME:
+            # 1000 баров M1 — меньше суток: старшие ТФ дополняются нативной историей
+            for tf in DERIVED_TIMEFRAMES:
+                written += load_native_history(ticker, tf, deadline)
+        return written
     elif now - last_dt >= refresh_period:
         print(f"🕒 Обновляем данные для {ticker} с {last_dt}")
-        df = fetch_quote_history(ticker, timeframe=timeframe, since=last_dt)
-        if not df.empty:
-            save_to_db(df)
+        df = fetch_quote_history(ticker, timeframe=timeframe, since=last_dt, deadline=deadline)
+        if df.empty:
+            with engine.begin() as conn:
+                touch_watermark(conn, ticker, timeframe)
+            return 0
+        return save_to_db(df)
     else:
         print(f"✅ Актуальные данные для {ticker}, обновление не требуется.")
+        return 0
+
+
+# Приоритетные серии (открыты в графиках, входят в портфель)
+
+def get_priority_series(since: datetime):
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            SELECT DISTINCT ticker, timeframe
+            FROM quote_priorities
+            WHERE requested_at >= :since
+        """), {"since": since})
+        return [(row[0], row[1]) for row in result]
 
 
 # Основной цикл автообновления
 
-def run_auto_update(timeframe="M30"):
+def build_refresh_scheduler(timeframes=("M30",)) -> RefreshScheduler:
+    if isinstance(timeframes, str):
+        timeframes = [timeframes]
+    # В режиме DERIVE_FROM_M1 старшие ТФ не грузятся, а считаются из M1
+    timeframes = list(dict.fromkeys(source_timeframe(tf) for tf in timeframes))
+    return RefreshScheduler(
+        update_fn=update_quotes_if_needed,
+        universe_fn=get_tickers_from_db,
+        timeframes=timeframes,
+        priorities_fn=get_priority_series,
+    )
+
+
+def run_auto_update(timeframes=("M30",)):
+    """Обновляет серии по мере закрытия баров каждого таймфрейма."""
     print("🚀 Запуск автообновления котировок...")
-    while True:
-        tickers = get_tickers_from_db()
-        for ticker in tickers:
-            try:
-                update_quotes_if_needed(ticker, timeframe)
-            except Exception as e:
-                print(f"❌ Ошибка обновления для {ticker}: {e}")
-        time.sleep(60)
+    start_exporters()
+    build_refresh_scheduler(timeframes).run_forever()
 
 # Тестовый запуск
 
 if __name__ == "__main__":
-    run_auto_update(timeframe="M30")
+    run_auto_update(os.getenv("AUTO_UPDATE_TIMEFRAMES", "M30").split(","))
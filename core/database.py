@@ -1,7 +1,13 @@
 import os
+import psycopg2
+from contextlib import contextmanager
+from datetime import datetime
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, event, MetaData, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from core.aggregates import ensure_aggregates_schema
+from core.fundamentals_store import ensure_fundamentals_schema
 
 
 # Загрузка переменных окружения
@@ -15,15 +21,81 @@ PG_USER = os.getenv("PG_USER")
 PG_PASSWORD = os.getenv("PG_PASSWORD")
 PG_SCHEMA = os.getenv("PG_SCHEMA", "public")
 
+# Пул соединений (общий для всего процесса)
+PG_POOL_SIZE = int(os.getenv("PG_POOL_SIZE", "5"))
+PG_MAX_OVERFLOW = int(os.getenv("PG_MAX_OVERFLOW", "10"))
+PG_POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", "30"))          # ожидание свободного соединения, с
+PG_POOL_RECYCLE = int(os.getenv("PG_POOL_RECYCLE", "1800"))          # пересоздание старых соединений, с
+PG_POOL_PRE_PING = os.getenv("PG_POOL_PRE_PING", "1") == "1"
+PG_STATEMENT_TIMEOUT_MS = int(os.getenv("PG_STATEMENT_TIMEOUT_MS", "0"))   # 0 — без ограничения
+
 
 # Формирование URL подключения
 
-DATABASE_URL = f"postgresql://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}"
+DATABASE_URL = f"postgresql+psycopg2://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}"
+
+_connect_args = {}
+if PG_STATEMENT_TIMEOUT_MS:
+    _connect_args["options"] = f"-c statement_timeout={PG_STATEMENT_TIMEOUT_MS}"
 
 
 # Инициализация SQLAlchemy
+# Единственный engine приложения: ингестия, сервисы и GUI берут соединения из его пула,
+# поэтому установка соединения не попадает во время отклика интерфейса.
+
+engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    pool_size=PG_POOL_SIZE,
+    max_overflow=PG_MAX_OVERFLOW,
+    pool_timeout=PG_POOL_TIMEOUT,
+    pool_recycle=PG_POOL_RECYCLE,
+    pool_pre_ping=PG_POOL_PRE_PING,
+    connect_args=_connect_args,
+)
+
+
+@contextmanager
+def raw_connection():
+    """
+    Соединение psycopg2 из общего пула (для кода на курсорах).
+    Коммит при успешном выходе, откат при исключении; затем соединение возвращается в пул.
+    """
+    conn = engine.raw_connection()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def connect_direct():
+    """Отдельное соединение вне пула — для долгоживущих LISTEN."""
+    return psycopg2.connect(host=PG_HOST, port=PG_PORT, dbname=PG_DB,
+                            user=PG_USER, password=PG_PASSWORD, **_connect_args)
+
+
+# Метрики пула
+
+def _register_pool_metrics():
+    from core.metrics import counter, gauge
+    connects = counter("db_pool_connects_total", "Новые физические соединения с PostgreSQL")
+    checkouts = counter("db_pool_checkouts_total", "Выдачи соединений из пула")
+    invalidated = counter("db_pool_invalidated_total", "Соединения, отброшенные пулом (pre-ping, ошибки)")
+    pool = engine.pool
+    gauge("db_pool_size", "Размер пула", pool.size)
+    gauge("db_pool_checked_out", "Соединений выдано", pool.checkedout)
+    gauge("db_pool_checked_in", "Свободных соединений в пуле", pool.checkedin)
+    gauge("db_pool_overflow", "Соединений сверх pool_size", pool.overflow)
+    event.listen(engine, "connect", lambda *a: connects.inc())
+    event.listen(engine, "checkout", lambda *a: checkouts.inc())
+    event.listen(engine, "invalidate", lambda *a: invalidated.inc())
 
-engine = create_engine(DATABASE_URL, echo=False)
+
+_register_pool_metrics()
 
 # Устанавливаем схему по умолчанию
 metadata = MetaData(schema=PG_SCHEMA)
@@ -34,7 +106,8 @@ SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 
 # Пример ORM моделей
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, JSON
+from sqlalchemy import Column, Integer, String, Float, DateTime, JSON, Index, PrimaryKeyConstraint, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB
 
 class MarketOHLC(Base):
     __tablename__ = "market_ohlc"
@@ -66,7 +139,15 @@ class FundamentalData(Base):
     gross_margin = Column(Float)
     operating_margin = Column(Float)
     net_margin = Column(Float)
-    raw_json = Column(JSON)
+    raw_json = Column(JSONB)
+    fetched_at = Column(DateTime)
+
+    # Одна строка на отчётный период; последний снимок символа — в fundamental_latest
+    __table_args__ = (
+        UniqueConstraint("symbol", "report_date", name="uq_fundamental_data_symbol_period"),
+        Index("ix_fundamental_data_raw_json", "raw_json", postgresql_using="gin",
+              postgresql_ops={"raw_json": "jsonb_path_ops"}),
+    )
 
 
 class ExperimentRegistry(Base):
@@ -79,12 +160,240 @@ class ExperimentRegistry(Base):
     metrics = Column(JSON)
     tag = Column(String, index=True)
 
+# Котировки instrument_quotes
+# Секционирована: LIST по timeframe, внутри — RANGE по datetime помесячно
+# (для D1 и старше — по годам). Запрос серии отсекает чужие таймфреймы и месяцы,
+# а в каждой секции работает свой небольшой B-tree первичного ключа, поэтому время
+# запроса не растёт с общим объёмом таблицы. BRIN по datetime — для сканов по времени.
+# Секции месяцев создаются по мере записи (ensure_quote_partitions).
+# Таблицы, созданные раньше через to_sql, переносятся командой core/migrate_quotes.py.
+
+class InstrumentQuote(Base):
+    __tablename__ = "instrument_quotes"
+    __table_args__ = (
+        PrimaryKeyConstraint("ticker", "timeframe", "datetime", name="pk_instrument_quotes"),
+        Index("ix_instrument_quotes_datetime_brin", "datetime", postgresql_using="brin"),
+        {"postgresql_partition_by": "LIST (timeframe)"},
+    )
+
+    ticker = Column(String, nullable=False)
+    timeframe = Column(String, nullable=False)
+    datetime = Column(DateTime, nullable=False)
+    open = Column(Float)
+    high = Column(Float)
+    low = Column(Float)
+    close = Column(Float)
+    volume = Column(Float)
+
+
+QUOTE_TIMEFRAMES = ["M1", "M5", "M15", "M30", "H1", "H4", "D1", "W1", "MN1"]
+YEARLY_PARTITION_TIMEFRAMES = {"D1", "W1", "MN1"}
+PARTITION_PREFIX = "instrument_quotes"
+
+
+def _partition_bounds(timeframe: str, dt: datetime):
+    """Имя-суффикс и границы секции, в которую попадает dt."""
+    if timeframe in YEARLY_PARTITION_TIMEFRAMES:
+        start = datetime(dt.year, 1, 1)
+        return f"{dt.year}", start, datetime(dt.year + 1, 1, 1)
+    start = datetime(dt.year, dt.month, 1)
+    end = datetime(dt.year + dt.month // 12, dt.month % 12 + 1, 1)
+    return f"{dt.year}_{dt.month:02d}", start, end
+
+
+def quote_partition_specs(timeframe: str, start: datetime, end: datetime):
+    """Секции [(имя-суффикс, от, до)], покрывающие [start, end]."""
+    specs = []
+    dt = start
+    while True:
+        suffix, lo, hi = _partition_bounds(timeframe, dt)
+        specs.append((suffix, lo, hi))
+        if hi > end:
+            return specs
+        dt = hi
+
+
+def is_partitioned(conn, table: str = "instrument_quotes") -> bool:
+    return conn.execute(text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"
+    ), {"table": table}).scalar() or False
+
+
+def ensure_timeframe_partitions(conn, parent: str = "instrument_quotes"):
+    """Секции таймфреймов (каждая секционирована по datetime) и секция для прочих ТФ."""
+    for tf in QUOTE_TIMEFRAMES:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {quote_partition_name(tf)}
+            PARTITION OF {parent} FOR VALUES IN ('{tf}')
+            PARTITION BY RANGE (datetime)
+        """))
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {PARTITION_PREFIX}_other PARTITION OF {parent} DEFAULT"))
+
+
+def quote_partition_name(timeframe: str, suffix: str = "") -> str:
+    name = f"{PARTITION_PREFIX}_{timeframe.lower()}"
+    return f"{name}_{suffix}" if suffix else name
+
+
+def create_quote_partition(conn, timeframe: str, suffix: str, lo: datetime, hi: datetime):
+    """Секция месяца (года); наследует первичный ключ и BRIN родителя."""
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {quote_partition_name(timeframe, suffix)}
+        PARTITION OF {quote_partition_name(timeframe)}
+        FOR VALUES FROM ('{lo:%Y-%m-%d}') TO ('{hi:%Y-%m-%d}')
+    """))
+
+
+def ensure_quote_partitions(conn, ranges: dict):
+    """Создаёт недостающие секции месяцев (лет). ranges — {timeframe: (min_dt, max_dt)}."""
+    for tf, (start, end) in ranges.items():
+        if tf not in QUOTE_TIMEFRAMES:
+            continue
+        for suffix, lo, hi in quote_partition_specs(tf, start, end):
+            create_quote_partition(conn, tf, suffix, lo, hi)
+
+
+# Уникальный ключ (ticker, timeframe, datetime) нужен для INSERT ... ON CONFLICT.
+# quote_watermarks — по строке на серию (последний бар, время проверки, число баров);
+# writer обновляет её в той же транзакции, что и котировки.
+# quote_priorities — серии, открытые в графиках или входящие в портфель;
+# планировщик обновлений обслуживает их в первую очередь.
+# backfill_windows — окна глубокой догрузки истории (core/deep_backfill.py):
+# next_from — точка продолжения окна после прерывания, done — окно загружено.
+# quote_archives — месяцы, перенесённые в сжатые архивы (core/tiering.py):
+# путь к файлу, тикеры внутри, размер до/после и задержка чтения для отчёта.
+
+QUOTES_KEY_INDEX = "uq_instrument_quotes_key"
+
+QUOTES_DDL = [
+    # Несекционированные таблицы, созданные раньше через to_sql, могли накопить дубли —
+    # до миграции удаляем их один раз перед созданием уникального индекса
+    f"""
+    DO $$
+    BEGIN
+        IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('instrument_quotes')) = 'r'
+           AND NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = '{QUOTES_KEY_INDEX}') THEN
+            DELETE FROM instrument_quotes a
+            USING instrument_quotes b
+            WHERE a.ctid < b.ctid
+              AND a.ticker = b.ticker
+              AND a.timeframe = b.timeframe
+              AND a.datetime = b.datetime;
+            CREATE UNIQUE INDEX {QUOTES_KEY_INDEX}
+                ON instrument_quotes (ticker, timeframe, datetime);
+        END IF;
+    END
+    $$;
+    """,
+    # При первом создании водяные знаки заполняются по уже накопленной истории
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('quote_watermarks') IS NULL THEN
+            CREATE TABLE quote_watermarks (
+                ticker TEXT NOT NULL,
+                timeframe TEXT NOT NULL,
+                last_bar TIMESTAMP,
+                last_checked TIMESTAMP,
+                bar_count BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (ticker, timeframe)
+            );
+            INSERT INTO quote_watermarks (ticker, timeframe, last_bar, last_checked, bar_count)
+            SELECT ticker, timeframe, MAX(datetime), timezone('utc', now()), COUNT(*)
+            FROM instrument_quotes
+            GROUP BY ticker, timeframe;
+        END IF;
+    END
+    $$;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS quote_priorities (
+        ticker TEXT NOT NULL,
+        timeframe TEXT NOT NULL,
+        source TEXT NOT NULL,
+        requested_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (ticker, timeframe, source)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS backfill_windows (
+        ticker TEXT NOT NULL,
+        timeframe TEXT NOT NULL,
+        window_start TIMESTAMP NOT NULL,
+        window_end TIMESTAMP NOT NULL,
+        next_from TIMESTAMP NOT NULL,
+        bars BIGINT NOT NULL DEFAULT 0,
+        done BOOLEAN NOT NULL DEFAULT FALSE,
+        updated_at TIMESTAMP,
+        PRIMARY KEY (ticker, timeframe, window_start)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS quote_archives (
+        timeframe TEXT NOT NULL,
+        period_start TIMESTAMP NOT NULL,
+        period_end TIMESTAMP NOT NULL,
+        path TEXT NOT NULL,
+        tickers TEXT[] NOT NULL,
+        rows BIGINT NOT NULL,
+        hot_bytes BIGINT NOT NULL,
+        archive_bytes BIGINT NOT NULL,
+        float32 BOOLEAN NOT NULL,
+        hot_read_ms DOUBLE PRECISION,
+        archive_read_ms DOUBLE PRECISION,
+        archived_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (timeframe, period_start)
+    )
+    """,
+]
+
+REBUILD_WATERMARKS_SQL = """
+    INSERT INTO quote_watermarks (ticker, timeframe, last_bar, last_checked, bar_count)
+    SELECT ticker, timeframe, MAX(datetime), timezone('utc', now()), COUNT(*)
+    FROM instrument_quotes
+    GROUP BY ticker, timeframe
+    ON CONFLICT (ticker, timeframe) DO UPDATE
+    SET last_bar = EXCLUDED.last_bar,
+        last_checked = EXCLUDED.last_checked,
+        bar_count = EXCLUDED.bar_count
+"""
+
+
+def ensure_quotes_schema(bind=None):
+    """
+    Создаёт instrument_quotes (секционированную) и служебные таблицы, если их нет.
+    Существующая несекционированная таблица остаётся как есть до миграции.
+    bind — Engine или Connection.
+    """
+    if bind is None or isinstance(bind, Engine):
+        with (bind or engine).begin() as conn:
+            ensure_quotes_schema(conn)
+        return
+    InstrumentQuote.__table__.create(bind, checkfirst=True)
+    if is_partitioned(bind):
+        ensure_timeframe_partitions(bind)
+        now = datetime.utcnow()
+        ensure_quote_partitions(bind, {tf: (now, now) for tf in QUOTE_TIMEFRAMES})
+    for ddl in QUOTES_DDL:
+        bind.execute(text(ddl))
+    ensure_aggregates_schema(bind)
+
+
+def rebuild_quote_watermarks():
+    """Пересчитывает quote_watermarks по instrument_quotes (полный проход — для обслуживания)."""
+    with engine.begin() as conn:
+        conn.execute(text(REBUILD_WATERMARKS_SQL))
+
+
 # Функции и инициализация
 
 def init_db():
     """Создаёт все таблицы в PostgreSQL, если их нет."""
     print("⏳ Initializing PostgreSQL database...")
     Base.metadata.create_all(bind=engine)
+    ensure_quotes_schema()
+    with engine.begin() as conn:
+        ensure_fundamentals_schema(conn)
     print(f"✅ Database initialized successfully (schema: {PG_SCHEMA})")
 
 
@@ -1,15 +1,10 @@
 import os
-import psycopg2
 from psycopg2 import sql
-from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+from core.database import engine, PG_SCHEMA
+from core.logo_store import ensure_logo_schema, migrate_inline_logos, store_logo, store_logos
 
-load_dotenv()
-PG_HOST = os.getenv("PG_HOST", "localhost")
-PG_PORT = os.getenv("PG_PORT", "5432")
-PG_DB = os.getenv("PG_DB", "delta_portfolio")
-PG_USER = os.getenv("PG_USER", "postgres")
-PG_PASSWORD = os.getenv("PG_PASSWORD", "1234")
-PG_SCHEMA = os.getenv("PG_SCHEMA", "public")
+UPSERT_BATCH_SIZE = int(os.getenv("INSTRUMENTS_BATCH_SIZE", "500"))
 
 
 # Класс управления базой данных
@@ -17,14 +12,8 @@ PG_SCHEMA = os.getenv("PG_SCHEMA", "public")
 class DatabaseManager:
     def __init__(self):
         try:
-            self.conn = psycopg2.connect(
-                host=PG_HOST,
-                port=PG_PORT,
-                dbname=PG_DB,
-                user=PG_USER,
-                password=PG_PASSWORD
-            )
-            self.conn.autocommit = False
+            # Соединение берётся из общего пула; close() возвращает его обратно
+            self.conn = engine.raw_connection()
             print("✅ Database connection established.")
         except Exception as e:
             print(f"❗ Database connection failed: {e}")
@@ -68,14 +57,26 @@ class DatabaseManager:
                         share_class_shares_outstanding BIGINT,
                         weighted_shares_outstanding BIGINT,
                         round_lot BIGINT,
-                        logo_data BYTEA
+                        logo_sha256 CHAR(64)
                     );
                 """))
+                # Логотипы — в logo_blobs по SHA-256; для старых таблиц добавится logo_sha256
+                ensure_logo_schema(cur)
                 self.conn.commit()
                 print("✅ Table 'instruments' is ready.")
         except Exception as e:
             self.conn.rollback()
             print(f"❗ Failed to create table: {e}")
+            return
+
+        # Логотипы из старого столбца logo_data переносятся в хранилище (продолжает прерванный перенос)
+        try:
+            stats = migrate_inline_logos(self.conn)
+            if stats["rows"]:
+                print(f"🖼 Logos moved to logo_blobs: {stats['rows']}")
+        except Exception as e:
+            self.conn.rollback()
+            print(f"❗ Failed to migrate inline logos: {e}")
 
 
     # Безопасная вставка (UPSERT)
@@ -85,38 +86,100 @@ class DatabaseManager:
             raise RuntimeError("No active database connection.")
 
         try:
-            def safe(val):
-                if val is None:
-                    return None
-                if isinstance(val, str):
-                    return val.strip()[:1000]
-                return val
-
-            columns = [
-                "ticker", "name", "market", "locale", "primary_exchange",
-                "currency_name", "composite_figi", "share_class_figi",
-                "market_cap", "phone_number", "address1", "city", "state",
-                "postal_code", "description", "sic_description",
-                "homepage_url", "total_employees", "list_date",
-                "share_class_shares_outstanding", "weighted_shares_outstanding",
-                "round_lot", "logo_data"
-            ]
-
-            values = [safe(data.get(col)) for col in columns]
-            placeholders = ", ".join(["%s"] * len(columns))
-            update_set = ", ".join([f"{col} = EXCLUDED.{col}" for col in columns if col != "ticker"])
-
-            query = f"""
-                INSERT INTO {PG_SCHEMA}.instruments ({", ".join(columns)})
-                VALUES ({placeholders})
-                ON CONFLICT (ticker) DO UPDATE
-                SET {update_set};
-            """
-
             with self.conn.cursor() as cur:
-                cur.execute(query, values)
+                cur.execute(_upsert_sql("VALUES ({})".format(", ".join(["%s"] * len(INSTRUMENT_COLUMNS)))),
+                            _instrument_row(data, store_logo(cur, data.get("logo_data"))))
             self.conn.commit()
 
         except Exception as e:
             self.conn.rollback()
             print(f"❗ DB insert error for {data.get('ticker')}: {e}")
+
+
+    # Пакетный UPSERT
+
+    def upsert_instruments(self, items, batch_size: int = UPSERT_BATCH_SIZE):
+        """
+        Пишет инструменты пакетами: один многострочный INSERT ... ON CONFLICT и один commit на пакет.
+        Если пакет падает, он повторяется построчно под SAVEPOINT — плохая строка не губит соседей.
+        Возвращает (записано, [тикеры с ошибкой]).
+        """
+        if not self.conn:
+            raise RuntimeError("No active database connection.")
+
+        written, failed = 0, []
+        batch = {}
+        for data in items:
+            # В одном INSERT ... ON CONFLICT тикер может встретиться только раз — побеждает последний
+            batch[data.get("ticker")] = data
+            if len(batch) >= batch_size:
+                written += self._upsert_batch(list(batch.values()), failed)
+                batch = {}
+        if batch:
+            written += self._upsert_batch(list(batch.values()), failed)
+        return written, failed
+
+    def _upsert_batch(self, batch: list, failed: list) -> int:
+        query = _upsert_sql("VALUES %s")
+        try:
+            with self.conn.cursor() as cur:
+                # Логотипы пакета — одним INSERT в logo_blobs, затем сами инструменты
+                digests = store_logos(cur, [data.get("logo_data") for data in batch])
+                rows = [_instrument_row(data, digest) for data, digest in zip(batch, digests)]
+                execute_values(cur, query, rows, page_size=len(rows))
+            self.conn.commit()
+            return len(rows)
+        except Exception as e:
+            self.conn.rollback()
+            print(f"⚠️ Batch of {len(batch)} instruments failed ({e}); retrying row by row")
+
+        written = 0
+        with self.conn.cursor() as cur:
+            for data in batch:
+                cur.execute("SAVEPOINT instrument_row")
+                try:
+                    execute_values(cur, query, [_instrument_row(data, store_logo(cur, data.get("logo_data")))])
+                    cur.execute("RELEASE SAVEPOINT instrument_row")
+                    written += 1
+                except Exception as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT instrument_row")
+                    failed.append(data.get("ticker"))
+                    print(f"❗ DB insert error for {data.get('ticker')}: {e}")
+        self.conn.commit()
+        return written
+
+
+# Строки instruments
+
+INSTRUMENT_COLUMNS = [
+    "ticker", "name", "market", "locale", "primary_exchange",
+    "currency_name", "composite_figi", "share_class_figi",
+    "market_cap", "phone_number", "address1", "city", "state",
+    "postal_code", "description", "sic_description",
+    "homepage_url", "total_employees", "list_date",
+    "share_class_shares_outstanding", "weighted_shares_outstanding",
+    "round_lot", "logo_sha256"
+]
+
+
+def _safe(val):
+    if val is None:
+        return None
+    if isinstance(val, str):
+        return val.strip()[:1000]
+    return val
+
+
+def _instrument_row(data: dict, logo_sha256: str | None) -> list:
+    """Значения INSTRUMENT_COLUMNS; вместо logo_data в строку идёт SHA-256 логотипа из хранилища."""
+    return [_safe(data.get(col)) for col in INSTRUMENT_COLUMNS[:-1]] + [logo_sha256]
+
+
+def _upsert_sql(values: str) -> str:
+    update_set = ", ".join([f"{col} = EXCLUDED.{col}" for col in INSTRUMENT_COLUMNS if col != "ticker"])
+    return f"""
+        INSERT INTO {PG_SCHEMA}.instruments ({", ".join(INSTRUMENT_COLUMNS)})
+        {values}
+        ON CONFLICT (ticker) DO UPDATE
+        SET {update_set};
+    """
@@ -0,0 +1,176 @@
+import os
+import sys
+import time
+import pandas as pd
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.timeframes import timeframe_delta
+from core.quotes_writer import copy_quotes, _ensure_schema
+from core.resampler import DERIVE_FROM_M1, BASE_TIMEFRAME, derive_tail
+from core.backfill_scheduler import get_rate_limiter, BACKFILL_WORKERS
+from core.database import engine
+from core.tiering import first_archived
+from core.data_ingestion_ws import PAGE_SIZE, _history_params, _bars_to_frame
+from data_providers.fxopen_session import get_session_pool
+
+# Конфигурация
+
+load_dotenv()
+
+DEEP_BACKFILL_YEARS = float(os.getenv("DEEP_BACKFILL_YEARS", "10"))
+WINDOW_PAGES = int(os.getenv("DEEP_BACKFILL_WINDOW_PAGES", "20"))   # ширина окна в страницах по 1000 баров
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+# План окон
+
+def plan_windows(ticker: str, timeframe: str, start: datetime, end: datetime) -> list:
+    """
+    Делит [start, end) на независимые окна и регистрирует их в backfill_windows.
+    Уже существующие окна (от прерванного запуска) не пересоздаются.
+    Возвращает незавершённые окна [(window_start, window_end, next_from)], самые свежие — первыми.
+    """
+    span = timeframe_delta(timeframe) * PAGE_SIZE * WINDOW_PAGES
+    # Границы выровнены по сетке от эпохи, чтобы повторный запуск нашёл те же окна
+    w_start = _EPOCH + ((start - _EPOCH) // span) * span
+    bounds = []
+    while w_start < end:
+        bounds.append((w_start, min(w_start + span, end)))
+        w_start += span
+
+    with engine.begin() as conn:
+        _ensure_schema(conn)
+        if bounds:
+            conn.execute(text("""
+                INSERT INTO backfill_windows (ticker, timeframe, window_start, window_end, next_from)
+                VALUES (:ticker, :tf, :start, :end, :start)
+                ON CONFLICT (ticker, timeframe, window_start) DO NOTHING
+            """), [{"ticker": ticker, "tf": timeframe, "start": s, "end": e} for s, e in bounds])
+        rows = conn.execute(text("""
+            SELECT window_start, window_end, next_from
+            FROM backfill_windows
+            WHERE ticker = :ticker AND timeframe = :tf AND NOT done
+            ORDER BY window_start DESC
+        """), {"ticker": ticker, "tf": timeframe}).fetchall()
+    return [tuple(r) for r in rows]
+
+
+def _checkpoint(conn, ticker: str, timeframe: str, window_start: datetime,
+                next_from: datetime, written: int, done: bool):
+    conn.execute(text("""
+        UPDATE backfill_windows
+        SET next_from = :next_from, bars = bars + :written, done = :done,
+            updated_at = timezone('utc', now())
+        WHERE ticker = :ticker AND timeframe = :tf AND window_start = :start
+    """), {"ticker": ticker, "tf": timeframe, "start": window_start,
+           "next_from": next_from, "written": written, "done": done})
+
+
+# Загрузка одного окна
+
+def fetch_window(ticker: str, timeframe: str, window_start: datetime, window_end: datetime,
+                 next_from: datetime) -> int:
+    """
+    Идёт по окну вперёд страницами по 1000 баров на собственной сессии пула.
+    Каждая страница пишется вместе с чекпоинтом окна в одной транзакции,
+    поэтому после прерывания окно продолжается с последней записанной страницы.
+    """
+    pool = get_session_pool()
+    written = 0
+    while True:
+        data = pool.request("QuoteHistoryBars", {
+            "Symbol": ticker,
+            "Periodicity": timeframe,
+            "PriceType": "bid",
+            **_history_params(next_from)
+        })
+        bars = data.get("Result", {}).get("Bars", [])
+        df = _bars_to_frame(bars, ticker, timeframe) if bars else pd.DataFrame()
+        page_max = df["datetime"].max() if not df.empty else None
+        # Окно закончено: дошли до его конца или до конца истории FXOpen
+        done = (page_max is None or page_max >= window_end or page_max < next_from
+                or len(df) < PAGE_SIZE)
+        if not df.empty:
+            df = df[(df["datetime"] >= window_start) & (df["datetime"] < window_end)]
+
+        with engine.begin() as conn:
+            page_written = copy_quotes(conn, df) if not df.empty else 0
+            if page_written and DERIVE_FROM_M1 and timeframe == BASE_TIMEFRAME:
+                derive_tail(conn, ticker, df["datetime"].min(), until=df["datetime"].max())
+            if not done:
+                next_from = page_max.to_pydatetime() + timedelta(milliseconds=1)
+            _checkpoint(conn, ticker, timeframe, window_start, next_from, page_written, done)
+        written += page_written
+        if done:
+            return written
+
+
+# Глубокая догрузка серии
+
+def deep_backfill(ticker: str, timeframe: str, start: datetime | None = None,
+                  end: datetime | None = None, workers: int = BACKFILL_WORKERS) -> int:
+    """
+    Загружает историю серии за [start, end) параллельными окнами.
+    По умолчанию — DEEP_BACKFILL_YEARS лет до первого бара серии в БД (или до текущего момента).
+    Окна грузятся одновременно на разных сессиях пула через общий token bucket;
+    пересечения и повторы на границах окон отсекает уникальный ключ instrument_quotes.
+    Возвращает число добавленных баров.
+    """
+    if end is None:
+        with engine.connect() as conn:
+            first = conn.execute(text("""
+                SELECT MIN(datetime) FROM instrument_quotes
+                WHERE ticker = :ticker AND timeframe = :tf
+            """), {"ticker": ticker, "tf": timeframe}).scalar()
+            # Старые месяцы могли уйти в архив — их не грузим повторно
+            archived = first_archived(conn, ticker, timeframe)
+        end = min(filter(None, (first, archived)), default=None) or datetime.utcnow()
+    start = start or end - timedelta(days=365.25 * DEEP_BACKFILL_YEARS)
+
+    windows = plan_windows(ticker, timeframe, start, end)
+    if not windows:
+        print(f"✅ {ticker} ({timeframe}): все окна глубокой загрузки уже завершены.")
+        return 0
+
+    get_rate_limiter()
+    print(f"🚚 Глубокая загрузка {ticker} ({timeframe}): {start:%Y-%m-%d} → {end:%Y-%m-%d}, "
+          f"{len(windows)} окон, воркеров {workers}")
+    started = time.time()
+    written, failed = 0, []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="deep") as pool:
+        futures = {pool.submit(fetch_window, ticker, timeframe, *w): w for w in windows}
+        for future in as_completed(futures):
+            w_start, w_end, _ = futures[future]
+            try:
+                n = future.result()
+                written += n
+                print(f"✅ Окно {w_start:%Y-%m-%d} → {w_end:%Y-%m-%d}: {n} баров")
+            except Exception as e:
+                failed.append(w_start)
+                print(f"❌ Окно {w_start:%Y-%m-%d} → {w_end:%Y-%m-%d}: {e} (продолжится со своего чекпоинта)")
+
+    # Соседние окна могли писать один производный бар одновременно — пересчитываем стыки
+    if DERIVE_FROM_M1 and timeframe == BASE_TIMEFRAME:
+        with engine.begin() as conn:
+            for w_start, _, _ in windows:
+                derive_tail(conn, ticker, w_start, until=w_start)
+
+    print(f"🎯 {ticker} ({timeframe}): {written} баров за {time.time() - started:.1f} с, "
+          f"незавершённых окон {len(failed)}")
+    return written
+
+
+# Запуск вручную: python core/deep_backfill.py AAPL M1 [лет]
+
+if __name__ == "__main__":
+    symbol = sys.argv[1]
+    tf = sys.argv[2] if len(sys.argv) > 2 else BASE_TIMEFRAME
+    years = float(sys.argv[3]) if len(sys.argv) > 3 else DEEP_BACKFILL_YEARS
+    now = datetime.utcnow()
+    deep_backfill(symbol, tf, start=now - timedelta(days=365.25 * years), end=now)
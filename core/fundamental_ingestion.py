@@ -1,10 +1,23 @@
 import os
+import sys
 import json
+import time
+import asyncio
+import aiohttp
+import async_timeout
 import pandas as pd
-import requests
-from datetime import datetime
-from sqlalchemy import create_engine
+from datetime import datetime, timedelta
+from typing import Optional
 from dotenv import load_dotenv
+from sqlalchemy import text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.database import engine
+from core.fundamentals_store import ensure_fundamentals_schema, upsert_fundamentals
+from core.metrics import (REQUEST_SECONDS, REQUEST_RETRIES, INGEST_ERRORS, DB_WRITE_SECONDS,
+                          DB_ROWS_WRITTEN, start_exporters)
+from core.rate_limit import TokenBucket
 
 # ==============================
 # 🔧 Загрузка переменных окружения
@@ -12,15 +25,19 @@ from dotenv import load_dotenv
 load_dotenv()
 
 API_KEY = os.getenv("ALPHA_VANTAGE_KEY")
-PG_USER = os.getenv("PG_USER")
-PG_PASSWORD = os.getenv("PG_PASSWORD")
-PG_HOST = os.getenv("PG_HOST")
-PG_PORT = os.getenv("PG_PORT")
-PG_DB = os.getenv("PG_DB")
+API_URL = "https://www.alphavantage.co/query"
+FUNCTIONS = ["OVERVIEW", "INCOME_STATEMENT", "BALANCE_SHEET", "CASH_FLOW"]
 
-# Подключение к PostgreSQL
-DB_URL = f"postgresql+psycopg2://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}"
-engine = create_engine(DB_URL)
+# Квоты ключа: бесплатный — 5/мин и 25/сутки; премиум — 75+/мин без суточного лимита (0)
+CALLS_PER_MINUTE = int(os.getenv("ALPHA_VANTAGE_CALLS_PER_MINUTE", "5"))
+CALLS_PER_DAY = int(os.getenv("ALPHA_VANTAGE_CALLS_PER_DAY", "25"))
+CALLS_BURST = int(os.getenv("ALPHA_VANTAGE_BURST", "1"))             # вызовов подряд без паузы
+CONCURRENCY = int(os.getenv("FUNDAMENTALS_CONCURRENCY", "4"))        # символов одновременно
+MAX_AGE_DAYS = float(os.getenv("FUNDAMENTALS_MAX_AGE_DAYS", "7"))    # более свежий снимок не перезагружаем
+
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 4
+RETRY_BACKOFF = 2.0
 
 # ==============================
 # 🧩 Безопасное преобразование чисел
@@ -35,38 +52,237 @@ def safe_float(x):
 
 
 
+# Планировщик квот Alpha Vantage
+
+class QuotaExhausted(Exception):
+    """Суточная квота ключа израсходована — оставшиеся символы ждут следующего запуска."""
+
+
+# api_quota_usage — израсходованные вызовы ключа за сутки UTC: перезапуск загрузчика
+# (или второй процесс с тем же ключом) продолжает счёт, а не начинает с нуля.
+
+QUOTA_DDL = """
+    CREATE TABLE IF NOT EXISTS api_quota_usage (
+        api TEXT NOT NULL,
+        day DATE NOT NULL,
+        calls INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (api, day)
+    )
+"""
+
+
+def ensure_quota_schema(conn):
+    conn.execute(text(QUOTA_DDL))
+
+
+def load_quota_usage(api: str, day) -> int:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT calls FROM api_quota_usage WHERE api = :api AND day = :day"),
+                            {"api": api, "day": day}).scalar() or 0
+
+
+def add_quota_usage(api: str, day, calls: int, at_least: int = 0) -> int:
+    """Прибавляет calls к счётчику суток (не ниже at_least) и возвращает итог с учётом других процессов."""
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            INSERT INTO api_quota_usage (api, day, calls) VALUES (:api, :day, GREATEST(:calls, :at_least))
+            ON CONFLICT (api, day) DO UPDATE
+            SET calls = GREATEST(api_quota_usage.calls + :calls, :at_least)
+            RETURNING calls
+        """), {"api": api, "day": day, "calls": calls, "at_least": at_least}).scalar()
+
+
+class QuotaScheduler:
+    """
+    Выдаёт разрешения на вызовы API в пределах calls/min и calls/day.
+    Минутная квота — TokenBucket с запасом burst и скоростью (per_minute - burst)/60:
+    за любые 60 с уходит не больше per_minute вызовов. Суточная — счётчик до полуночи UTC
+    (так её считает Alpha Vantage), резервируется сразу на все функции символа,
+    чтобы не оставлять полузагруженных снимков. Счётчик хранится в api_quota_usage
+    под именем api (None — только в памяти) и подхватывается при первом резервировании.
+    Обращения к БД идут через asyncio.to_thread под общим замком: event loop не блокируется,
+    а воркеры не резервируют одну и ту же квоту дважды.
+    """
+
+    def __init__(self, per_minute: int = CALLS_PER_MINUTE, per_day: int = CALLS_PER_DAY,
+                 burst: int = CALLS_BURST, api: Optional[str] = "alphavantage"):
+        burst = max(1, min(burst, per_minute - 1))
+        self.minute = TokenBucket(max(per_minute - burst, 1) / 60.0, burst)
+        self.per_day = per_day
+        self.api = api
+        self._day = None
+        self._used = 0
+        self._exhausted = False
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _roll_day(self):
+        today = datetime.utcnow().date()
+        if today != self._day:
+            self._day, self._used, self._exhausted = today, 0, False
+            if self.api:
+                try:
+                    # Расход за сегодня — из api_quota_usage
+                    self._used = await asyncio.to_thread(load_quota_usage, self.api, today)
+                except Exception as e:
+                    print(f"⚠️ Не удалось прочитать расход квоты {self.api}: {e}")
+                self._exhausted = bool(self.per_day) and self._used >= self.per_day
+
+    async def _record(self, calls: int, at_least: int = 0):
+        if not self.api:
+            self._used = max(self._used + calls, at_least)
+            return
+        try:
+            self._used = await asyncio.to_thread(add_quota_usage, self.api, self._day, calls, at_least)
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить расход квоты {self.api}: {e}")
+            self._used = max(self._used + calls, at_least)
+
+    async def reserve(self, calls: int = 1) -> bool:
+        """Резервирует calls из суточной квоты; False — на сегодня её не хватает."""
+        async with self._lock:
+            await self._roll_day()
+            if self._exhausted or (self.per_day and self._used + calls > self.per_day):
+                return False
+            await self._record(calls)
+            return True
+
+    async def exhaust(self):
+        """API сообщил о суточном лимите раньше нашего счётчика (ключ расходуют и другие)."""
+        async with self._lock:
+            await self._roll_day()
+            self._exhausted = True
+            # Следующий запуск в те же сутки сразу увидит, что квота кончилась
+            await self._record(0, at_least=self.per_day)
+
+    def pause(self, seconds: float):
+        """API попросил притормозить — все воркеры ждут, прежде чем брать новые токены."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        """Ждёт минутного токена, не блокируя event loop."""
+        while True:
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            if self.minute.try_acquire():
+                return
+            await asyncio.sleep(min(1.0 / self.minute.rate, 1.0))
+
+    @property
+    def used_today(self) -> int:
+        """Расход за сутки последнего резервирования (без обращения к БД)."""
+        return self._used
+
+
+
 # Загрузка фундаментальных данных
 
-def fetch_fundamentals(symbol: str) -> pd.DataFrame:
-    """Загружает фундаментальные данные из Alpha Vantage."""
-    print(f"⏳ Загружаем фундаментальные данные для {symbol}...")
-    url = f"https://www.alphavantage.co/query?function=OVERVIEW&symbol={symbol}&apikey={API_KEY}"
-    resp = requests.get(url)
-    data = resp.json()
+async def fetch_function(session: aiohttp.ClientSession, scheduler: QuotaScheduler,
+                         function: str, symbol: str) -> Optional[dict]:
+    """Один вызов API в пределах квоты; повторы на 429/5xx и сообщения о лимите."""
+    params = {"function": function, "symbol": symbol, "apikey": API_KEY}
+    for attempt in range(1, MAX_RETRIES + 1):
+        if attempt > 1:
+            # Повтор — это ещё один вызов из суточной квоты
+            if not await scheduler.reserve(1):
+                raise QuotaExhausted("суточная квота Alpha Vantage исчерпана")
+            REQUEST_RETRIES.inc(provider="alphavantage", ticker=symbol)
+        await scheduler.acquire()
+        try:
+            with REQUEST_SECONDS.time(provider="alphavantage", request=function):
+                async with async_timeout.timeout(REQUEST_TIMEOUT):
+                    async with session.get(API_URL, params=params) as resp:
+                        status = resp.status
+                        data = await resp.json(content_type=None) if status == 200 else None
+        except (asyncio.TimeoutError, aiohttp.ClientError, ValueError):
+            await asyncio.sleep(RETRY_BACKOFF ** attempt)
+            continue
+
+        if status != 200:
+            if status in (429, 500, 502, 503, 504):
+                await asyncio.sleep(RETRY_BACKOFF ** attempt)
+                continue
+            return None
+
+        # Превышение лимита Alpha Vantage отдаёт кодом 200 с единственным полем Note/Information
+        message = data.get("Note") or data.get("Information") if isinstance(data, dict) else None
+        if message and len(data) == 1:
+            if "per day" in message or "daily" in message.lower():
+                await scheduler.exhaust()
+                raise QuotaExhausted(message)
+            print(f"⏸ Alpha Vantage просит притормозить: {message[:120]}")
+            scheduler.pause(60)
+            continue
+        if not data or "Error Message" in data:
+            return None
+        return data
+    return None
+
+
+def _fcf_yield(overview: dict, cash_flow: Optional[dict]) -> float:
+    """FCF за четыре последних квартала / капитализация — если OVERVIEW не отдал FCFYieldTTM."""
+    reports = (cash_flow or {}).get("quarterlyReports", [])[:4]
+    market_cap = safe_float(overview.get("MarketCapitalization"))
+    if len(reports) < 4 or not market_cap:
+        return 0.0
+    fcf = sum(safe_float(r.get("operatingCashflow")) - abs(safe_float(r.get("capitalExpenditures")))
+              for r in reports)
+    return fcf / market_cap
+
+
+def _report_period(overview: dict) -> datetime:
+    """Отчётный период снимка — последний закрытый квартал; без него — сегодняшняя дата."""
+    try:
+        return datetime.strptime(overview.get("LatestQuarter") or "", "%Y-%m-%d")
+    except ValueError:
+        return datetime.combine(datetime.utcnow().date(), datetime.min.time())
 
-    if "Symbol" not in data:
-        print(f"⚠️  Нет данных для {symbol} — возможно, превышен лимит API или тикер отсутствует.")
-        return pd.DataFrame()
 
-    record = {
+def build_record(symbol: str, overview: dict, statements: dict) -> dict:
+    """Строка fundamental_data: коэффициенты из OVERVIEW, отчётность — в raw_json["statements"]."""
+    return {
         "symbol": symbol,
-        "report_date": datetime.now(),
-        "pe_ratio": safe_float(data.get("PERatio")),
-        "pb_ratio": safe_float(data.get("PriceToBookRatio")),
-        "ev_ebitda": safe_float(data.get("EVToEBITDA")),
-        "fcf_yield": safe_float(data.get("FCFYieldTTM")),
-        "dividend_yield": safe_float(data.get("DividendYield")),
-        "eps": safe_float(data.get("EPS")),
-        "roe": safe_float(data.get("ReturnOnEquityTTM")),
-        "roa": safe_float(data.get("ReturnOnAssetsTTM")),
-        "gross_margin": safe_float(data.get("GrossProfitMarginTTM")),
-        "operating_margin": safe_float(data.get("OperatingMarginTTM")),
-        "net_margin": safe_float(data.get("NetProfitMarginTTM")),
-        "raw_json": json.dumps(data),
+        "report_date": _report_period(overview),
+        "pe_ratio": safe_float(overview.get("PERatio")),
+        "pb_ratio": safe_float(overview.get("PriceToBookRatio")),
+        "ev_ebitda": safe_float(overview.get("EVToEBITDA")),
+        "fcf_yield": safe_float(overview.get("FCFYieldTTM")) or _fcf_yield(overview, statements.get("CASH_FLOW")),
+        "dividend_yield": safe_float(overview.get("DividendYield")),
+        "eps": safe_float(overview.get("EPS")),
+        "roe": safe_float(overview.get("ReturnOnEquityTTM")),
+        "roa": safe_float(overview.get("ReturnOnAssetsTTM")),
+        "gross_margin": safe_float(overview.get("GrossProfitMarginTTM")),
+        "operating_margin": safe_float(overview.get("OperatingMarginTTM")),
+        "net_margin": safe_float(overview.get("NetProfitMarginTTM")),
+        "raw_json": json.dumps({**overview, "statements": statements}),
+        "fetched_at": datetime.utcnow(),
     }
 
-    print(f"✅ Фундаментальные данные получены для {symbol}")
-    return pd.DataFrame([record])
+
+async def fetch_fundamentals(session: aiohttp.ClientSession, scheduler: QuotaScheduler,
+                             symbol: str) -> pd.DataFrame:
+    """OVERVIEW и три отчёта символа — параллельно, в пределах квоты."""
+    if not await scheduler.reserve(len(FUNCTIONS)):
+        raise QuotaExhausted("суточной квоты Alpha Vantage не хватает на следующий символ")
+    print(f"⏳ Загружаем фундаментальные данные для {symbol}...")
+    results = await asyncio.gather(*(fetch_function(session, scheduler, f, symbol) for f in FUNCTIONS),
+                                   return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    payloads = dict(zip(FUNCTIONS, results))
+
+    overview = payloads.pop("OVERVIEW")
+    if not overview or "Symbol" not in overview:
+        INGEST_ERRORS.inc(source="alphavantage", ticker=symbol)
+        print(f"⚠️  Нет данных для {symbol} — тикер отсутствует в Alpha Vantage.")
+        return pd.DataFrame()
+
+    statements = {function: data for function, data in payloads.items() if data}
+    print(f"✅ Фундаментальные данные получены для {symbol} (отчётов: {len(statements)}/{len(payloads)})")
+    return pd.DataFrame([build_record(symbol, overview, statements)])
 
 
 
@@ -77,19 +293,100 @@ def save_to_db(df: pd.DataFrame):
         return
 
     table_name = "fundamental_data"
-    with engine.begin() as conn:
-        df.to_sql(table_name, conn, if_exists="append", index=False)
+    with DB_WRITE_SECONDS.time(table=table_name), engine.begin() as conn:
+        # Повторная загрузка того же периода обновляет строку; fundamental_latest — там же
+        upsert_fundamentals(conn, df)
+    DB_ROWS_WRITTEN.inc(len(df), table=table_name)
     print(f"📊 Сохранено {len(df)} строк для {df['symbol'].iloc[0]}")
 
 
 
+# Вселенная символов
+
+def load_universe(max_age_days: float = MAX_AGE_DAYS) -> list:
+    """
+    Акции из instruments без свежего снимка (загруженные позже max_age_days назад пропускаются).
+    Самые давно обновлённые и ни разу не загруженные — первыми.
+    """
+    query = text("""
+        SELECT i.ticker
+        FROM instruments i
+        LEFT JOIN fundamental_latest f ON f.symbol = i.ticker
+        WHERE COALESCE(i.market, 'stocks') = 'stocks'
+          AND (f.fetched_at IS NULL OR f.fetched_at < :fresh_after)
+        ORDER BY f.fetched_at NULLS FIRST, i.ticker
+    """)
+    with engine.connect() as conn:
+        rows = conn.execute(query, {"fresh_after": datetime.utcnow() - timedelta(days=max_age_days)})
+        return [r[0] for r in rows]
+
+
+
+# Асинхронная загрузка
+
+async def run_ingestion(symbols, scheduler: Optional[QuotaScheduler] = None,
+                        concurrency: int = CONCURRENCY) -> dict:
+    """
+    Обходит symbols пулом воркеров на одной aiohttp-сессии. Когда суточная квота
+    кончается, воркеры останавливаются; необработанные символы попадут в следующий запуск.
+    """
+    scheduler = scheduler or QuotaScheduler()
+    queue = asyncio.Queue()
+    for symbol in symbols:
+        queue.put_nowait(symbol)
+    stats = {"saved": 0, "empty": 0, "failed": 0, "deferred": 0}
+    stop = asyncio.Event()
+
+    timeout = aiohttp.ClientTimeout(total=None, connect=REQUEST_TIMEOUT, sock_read=REQUEST_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=concurrency * len(FUNCTIONS))
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        async def worker():
+            while not stop.is_set():
+                try:
+                    symbol = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    df = await fetch_fundamentals(session, scheduler, symbol)
+                    if df.empty:
+                        stats["empty"] += 1
+                        continue
+                    await asyncio.to_thread(save_to_db, df)
+                    stats["saved"] += 1
+                except QuotaExhausted as e:
+                    stats["deferred"] += 1
+                    if not stop.is_set():
+                        print(f"🛑 {e}")
+                    stop.set()
+                except Exception as e:
+                    stats["failed"] += 1
+                    INGEST_ERRORS.inc(source="alphavantage", ticker=symbol)
+                    print(f"❌ Ошибка загрузки {symbol}: {e}")
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    stats["deferred"] += queue.qsize()
+    stats["calls"] = scheduler.used_today
+    return stats
+
+
+
 # Основной запуск
 
 if __name__ == "__main__":
-    symbols = ["AAPL", "AMZN", "TSLA"]
+    if not API_KEY:
+        raise RuntimeError("ALPHA_VANTAGE_KEY не найден в .env")
+    start_exporters()
+    with engine.begin() as conn:
+        ensure_fundamentals_schema(conn)
+        ensure_quota_schema(conn)
 
-    for sym in symbols:
-        df = fetch_fundamentals(sym)
-        save_to_db(df)
+    # Явный список символов — без проверки свежести; иначе вся вселенная instruments
+    symbols = sys.argv[1:] or load_universe()
+    print(f"📄 К загрузке: {len(symbols)} символов | квота: {CALLS_PER_MINUTE}/мин, "
+          f"{CALLS_PER_DAY or '∞'}/сутки")
+    stats = asyncio.run(run_ingestion(symbols))
 
-    print("🎯 Загрузка фундаментальных данных завершена успешно.")
+    print(f"🎯 Загрузка фундаментальных данных завершена. Сохранено: {stats['saved']} | "
+          f"Нет данных: {stats['empty']} | Ошибок: {stats['failed']} | "
+          f"Отложено до следующего запуска: {stats['deferred']} | Вызовов API: {stats['calls']}")
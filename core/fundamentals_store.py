@@ -0,0 +1,160 @@
+import os
+import sys
+import json
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from sqlalchemy import text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+METRICS = ["pe_ratio", "pb_ratio", "ev_ebitda", "fcf_yield", "dividend_yield", "eps",
+           "roe", "roa", "gross_margin", "operating_margin", "net_margin"]
+_COLUMNS = ["symbol", "report_date"] + METRICS + ["raw_json", "fetched_at"]
+
+
+# Хранилище фундаментальных данных
+#
+# fundamental_data — по строке на (symbol, отчётный период): report_date — последний
+# закрытый квартал из OVERVIEW (LatestQuarter), fetched_at — когда снимок загружен.
+# Повторная загрузка того же периода обновляет строку, а не добавляет новую.
+# raw_json — JSONB с GIN-индексом (jsonb_path_ops) для запросов вида raw_json @> '{...}'.
+# fundamental_latest — по строке на символ, обновляется в той же транзакции, что и
+# fundamental_data: «текущие фундаментальные» и скринеры читают её без сортировки истории.
+
+LATEST_TABLE_DDL = f"""
+    CREATE TABLE fundamental_latest (
+        symbol TEXT PRIMARY KEY,
+        report_date TIMESTAMP NOT NULL,
+        {", ".join(f"{m} DOUBLE PRECISION" for m in METRICS)},
+        raw_json JSONB,
+        fetched_at TIMESTAMP
+    )
+"""
+
+FUNDAMENTALS_DDL = [
+    "ALTER TABLE fundamental_data ADD COLUMN IF NOT EXISTS fetched_at TIMESTAMP",
+    # Перевод старой таблицы: JSON → JSONB, снимки по дате загрузки → по отчётному периоду,
+    # из дублей периода остаётся самый свежий снимок
+    """
+    DO $$
+    BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'fundamental_data'
+              AND column_name = 'raw_json') = 'json' THEN
+            ALTER TABLE fundamental_data ALTER COLUMN raw_json TYPE JSONB USING raw_json::jsonb;
+        END IF;
+        IF to_regclass('uq_fundamental_data_symbol_period') IS NULL THEN
+            UPDATE fundamental_data
+            SET fetched_at = COALESCE(fetched_at, report_date),
+                report_date = COALESCE(
+                    CASE WHEN raw_json->>'LatestQuarter' ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}$'
+                         THEN (raw_json->>'LatestQuarter')::timestamp END,
+                    date_trunc('day', report_date));
+            DELETE FROM fundamental_data d
+            USING fundamental_data n
+            WHERE d.symbol = n.symbol AND d.report_date = n.report_date
+              AND (d.fetched_at, d.id) < (n.fetched_at, n.id);
+            CREATE UNIQUE INDEX uq_fundamental_data_symbol_period ON fundamental_data (symbol, report_date);
+        END IF;
+    END
+    $$;
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_fundamental_data_raw_json ON fundamental_data USING gin (raw_json jsonb_path_ops)",
+    f"""
+    DO $$
+    BEGIN
+        IF to_regclass('fundamental_latest') IS NULL THEN
+            {LATEST_TABLE_DDL};
+            INSERT INTO fundamental_latest ({", ".join(_COLUMNS)})
+            SELECT DISTINCT ON (symbol) {", ".join(_COLUMNS)}
+            FROM fundamental_data
+            WHERE symbol IS NOT NULL AND report_date IS NOT NULL
+            ORDER BY symbol, report_date DESC, fetched_at DESC NULLS LAST;
+        END IF;
+    END
+    $$;
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_fundamental_latest_raw_json ON fundamental_latest USING gin (raw_json jsonb_path_ops)",
+]
+
+
+def ensure_fundamentals_schema(conn):
+    """Доводит fundamental_data до схемы с уникальным периодом и создаёт fundamental_latest."""
+    for ddl in FUNDAMENTALS_DDL:
+        conn.execute(text(ddl))
+
+
+# Запись
+
+def _set(columns) -> str:
+    return ", ".join(f"{c} = EXCLUDED.{c}" for c in columns)
+
+
+UPSERT_SQL = f"""
+    WITH saved AS (
+        INSERT INTO fundamental_data ({", ".join(_COLUMNS)})
+        VALUES (:symbol, :report_date, {", ".join(":" + m for m in METRICS)},
+                CAST(:raw_json AS jsonb), :fetched_at)
+        ON CONFLICT (symbol, report_date) DO UPDATE
+        SET {_set(METRICS + ["raw_json", "fetched_at"])}
+        RETURNING {", ".join(_COLUMNS)}
+    )
+    INSERT INTO fundamental_latest AS l ({", ".join(_COLUMNS)})
+    SELECT {", ".join(_COLUMNS)} FROM saved
+    ON CONFLICT (symbol) DO UPDATE
+    SET {_set(_COLUMNS[1:])}
+    WHERE EXCLUDED.report_date >= l.report_date
+"""
+
+
+def _record(row: dict) -> dict:
+    record = {}
+    for col in _COLUMNS:
+        value = row.get(col)
+        if isinstance(value, float) and np.isnan(value):
+            value = None
+        record[col] = value
+    if record["raw_json"] is not None and not isinstance(record["raw_json"], str):
+        record["raw_json"] = json.dumps(record["raw_json"])
+    record["report_date"] = pd.Timestamp(record["report_date"]).to_pydatetime()
+    record["fetched_at"] = record["fetched_at"] or datetime.utcnow()
+    return record
+
+
+def upsert_fundamentals(conn, df: pd.DataFrame) -> int:
+    """UPSERT снимков по (symbol, report_date) и обновление fundamental_latest; conn — в транзакции."""
+    if df.empty:
+        return 0
+    records = [_record(row) for row in df.to_dict("records")]
+    conn.execute(text(UPSERT_SQL), records)
+    return len(records)
+
+
+# Чтение
+
+def read_latest(conn, symbols=None) -> pd.DataFrame:
+    """Текущие фундаментальные показатели: по строке на символ (все или указанные)."""
+    query = f"SELECT {', '.join(_COLUMNS)} FROM fundamental_latest"
+    params = {}
+    if symbols is not None:
+        query += " WHERE symbol = ANY(:symbols)"
+        params["symbols"] = list(symbols)
+    return pd.read_sql(text(query + " ORDER BY symbol"), conn, params=params)
+
+
+# Миграция вручную
+
+if __name__ == "__main__":
+    from core.database import engine
+    started = time.time()
+    with engine.begin() as conn:
+        ensure_fundamentals_schema(conn)
+        periods = conn.execute(text("SELECT COUNT(*) FROM fundamental_data")).scalar()
+    print(f"✅ fundamental_data: {periods} снимков по периодам, схема обновлена за {time.time() - started:.1f} с")
+
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        latest = read_latest(conn)
+    print(f"⏱ fundamental_latest: {len(latest)} символов за {(time.perf_counter() - started) * 1000:.1f} мс")
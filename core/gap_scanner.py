@@ -0,0 +1,205 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.timeframes import timeframe_delta
+from core.resampler import bucket_starts, source_timeframe
+from core.backfill_scheduler import get_rate_limiter, BACKFILL_WORKERS
+from core.database import engine
+from core.data_ingestion_ws import fetch_quote_history, save_to_db
+from core.tiering import archived_until
+
+# Конфигурация
+
+load_dotenv()
+
+GAP_MIN_BARS = int(os.getenv("GAP_MIN_BARS", "1"))          # пропуски короче не догружаются
+GAP_HOLIDAYS = [d for d in os.getenv("GAP_HOLIDAYS", "").split(",") if d]   # YYYY-MM-DD, для биржевых сессий
+
+_NS = 1_000_000_000
+
+
+# Торговые календари
+
+@dataclass(frozen=True)
+class SessionCalendar:
+    """
+    Торговая сессия инструмента в локальном времени биржи.
+    open/close — минуты от начала торгового дня, weekmask — торговые дни (пн..вс),
+    offset — сдвиг торгового дня относительно полуночи tz (форекс начинается в 17:00 NY).
+    """
+    name: str
+    weekmask: str = "1111100"
+    open: int = 0
+    close: int = 1440
+    tz: str = "UTC"
+    offset: timedelta = timedelta(0)
+    holidays: tuple = ()
+
+    def expected_bars(self, start: datetime, end: datetime, timeframe: str) -> np.ndarray:
+        """Начала всех баров timeframe в [start, end], попадающих в сессию (int64 нс, UTC)."""
+        lo, hi = bucket_starts(np.array([pd.Timestamp(start).value, pd.Timestamp(end).value]), timeframe)
+        if timeframe == "MN1":
+            months = np.arange(lo.astype("datetime64[ns]").astype("datetime64[M]"),
+                               hi.astype("datetime64[ns]").astype("datetime64[M]") + 1)
+            return months.astype("datetime64[ns]").astype(np.int64)
+        step = int(timeframe_delta(timeframe).total_seconds()) * _NS
+        slots = np.arange(lo, hi + 1, step, dtype=np.int64)
+        if timeframe == "W1":
+            return slots
+        if timeframe == "D1":
+            # Дневные бары датируются полуночью UTC торгового дня
+            days = slots.astype("datetime64[ns]").astype("datetime64[D]")
+            return slots[np.is_busday(days, weekmask=self.weekmask, holidays=list(self.holidays))]
+
+        local = (pd.DatetimeIndex(slots.astype("datetime64[ns]")).tz_localize("UTC")
+                 .tz_convert(self.tz).tz_localize(None) + self.offset).to_numpy()
+        days = local.astype("datetime64[D]")
+        minute = (local - days).astype("timedelta64[m]").astype(np.int64)
+        step_min = step // (60 * _NS)
+        # Бар считается торговым, если его интервал пересекается с сессией
+        in_session = (minute < self.close) & (minute + step_min > self.open)
+        trading_day = np.is_busday(days, weekmask=self.weekmask, holidays=list(self.holidays))
+        return slots[in_session & trading_day]
+
+
+CALENDARS = {
+    "stocks": SessionCalendar("stocks", open=9 * 60 + 30, close=16 * 60,
+                              tz="America/New_York", holidays=tuple(GAP_HOLIDAYS)),
+    "crypto": SessionCalendar("crypto", weekmask="1111111"),
+    "fx": SessionCalendar("fx", tz="America/New_York", offset=timedelta(hours=7)),
+}
+CALENDARS["otc"] = CALENDARS["stocks"]
+DEFAULT_CALENDAR = CALENDARS["fx"]   # форекс, индексы и CFD без записи в instruments
+
+
+def get_calendars() -> dict:
+    """ticker -> SessionCalendar по полю instruments.market."""
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT ticker, market FROM instruments")).fetchall()
+    except Exception as e:
+        print(f"⚠️ Не удалось прочитать рынки инструментов, используется календарь по умолчанию: {e}")
+        return {}
+    return {ticker: CALENDARS.get((market or "").lower(), DEFAULT_CALENDAR) for ticker, market in rows}
+
+
+# Поиск пропусков
+
+def find_gaps(codes: np.ndarray, ts_ns: np.ndarray, expected: np.ndarray,
+              min_bars: int = GAP_MIN_BARS):
+    """
+    Пропуски в отсортированных по (codes, ts_ns) барах за один векторный проход.
+    expected — отсортированные ожидаемые начала баров; число пропущенных между
+    соседними барами серии равно разнице их позиций в expected минус один.
+    Возвращает индексы i (пропуск между ts_ns[i] и ts_ns[i + 1]) и число баров.
+    """
+    pos = np.searchsorted(expected, ts_ns, side="right")
+    missing = pos[1:] - pos[:-1] - 1
+    gap = (codes[1:] == codes[:-1]) & (missing >= min_bars)
+    idx = np.flatnonzero(gap)
+    return idx, missing[idx]
+
+
+def scan_gaps(timeframe: str, tickers=None, since: datetime | None = None,
+              min_bars: int = GAP_MIN_BARS) -> pd.DataFrame:
+    """
+    Находит пропущенные диапазоны баров timeframe по всей вселенной.
+    Возвращает DataFrame (ticker, timeframe, gap_start, gap_end, missing):
+    gap_start/gap_end — последний бар перед пропуском и первый после него.
+    """
+    started = time.time()
+    query = "SELECT ticker, datetime FROM instrument_quotes WHERE timeframe = :tf"
+    params = {"tf": timeframe}
+    if tickers is not None:
+        query += " AND ticker = ANY(:tickers)"
+        params["tickers"] = list(tickers)
+    with engine.connect() as conn:
+        # Месяцы, перенесённые в архив (core/tiering.py), — не пропуски
+        floor = archived_until(conn, timeframe)
+        if floor is not None and (since is None or since < floor):
+            since = floor
+        if since is not None:
+            query += " AND datetime >= :since"
+            params["since"] = since
+        df = pd.read_sql(text(query + " ORDER BY ticker, datetime"), conn, params=params)
+
+    columns = ["ticker", "timeframe", "gap_start", "gap_end", "missing"]
+    if len(df) < 2:
+        return pd.DataFrame(columns=columns)
+
+    codes, names = pd.factorize(df["ticker"], sort=True)
+    ts_ns = df["datetime"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    start, end = df["datetime"].min(), df["datetime"].max()
+
+    # Каждый календарь — одна сетка ожидаемых баров на весь диапазон скана
+    ticker_calendars = get_calendars()
+    row_calendar = np.array([ticker_calendars.get(t, DEFAULT_CALENDAR).name for t in names])[codes]
+    found = []
+    for calendar in {ticker_calendars.get(t, DEFAULT_CALENDAR) for t in names}:
+        rows = np.flatnonzero(row_calendar == calendar.name)
+        expected = calendar.expected_bars(start, end, timeframe)
+        idx, missing = find_gaps(codes[rows], ts_ns[rows], expected, min_bars)
+        found.append(pd.DataFrame({
+            "ticker": names[codes[rows[idx]]],
+            "timeframe": timeframe,
+            "gap_start": ts_ns[rows[idx]].astype("datetime64[ns]"),
+            "gap_end": ts_ns[rows[idx + 1]].astype("datetime64[ns]"),
+            "missing": missing,
+        }))
+
+    gaps = pd.concat(found, ignore_index=True).sort_values(["ticker", "gap_start"], ignore_index=True)
+    print(f"🔎 {timeframe}: {len(df)} баров, {len(names)} тикеров → "
+          f"{len(gaps)} пропусков ({int(gaps['missing'].sum())} баров) за {time.time() - started:.2f} с")
+    return gaps[columns]
+
+
+# Точечная догрузка
+
+def _backfill_one(ticker: str, timeframe: str, gap_start, gap_end) -> int:
+    since = pd.Timestamp(gap_start).to_pydatetime() + timedelta(milliseconds=1)
+    until = pd.Timestamp(gap_end).to_pydatetime()
+    df = fetch_quote_history(ticker, timeframe, since=since, until=until)
+    if df.empty:
+        return 0
+    return save_to_db(df)
+
+
+def backfill_gaps(gaps: pd.DataFrame, workers: int = BACKFILL_WORKERS) -> int:
+    """Загружает из FXOpen только пропущенные диапазоны; возвращает число новых баров."""
+    if gaps.empty:
+        print("✅ Пропусков нет.")
+        return 0
+    get_rate_limiter()
+    written, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gaps") as pool:
+        futures = {
+            pool.submit(_backfill_one, g.ticker, g.timeframe, g.gap_start, g.gap_end): g
+            for g in gaps.itertuples(index=False)
+        }
+        for future in as_completed(futures):
+            g = futures[future]
+            try:
+                written += future.result()
+            except Exception as e:
+                failed += 1
+                print(f"❌ Ошибка догрузки {g.ticker} ({g.timeframe}) {g.gap_start} → {g.gap_end}: {e}")
+    print(f"🧩 Закрыто пропусков: {len(gaps) - failed}/{len(gaps)}, записано {written} баров")
+    return written
+
+
+# Запуск вручную
+
+if __name__ == "__main__":
+    timeframes = sys.argv[1:] or os.getenv("AUTO_UPDATE_TIMEFRAMES", "M30").split(",")
+    for tf in dict.fromkeys(source_timeframe(tf) for tf in timeframes):
+        backfill_gaps(scan_gaps(tf))
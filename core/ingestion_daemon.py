@@ -0,0 +1,76 @@
+import os
+import sys
+import signal
+import threading
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.database import engine, ensure_quotes_schema
+from core.metrics import start_exporters
+from core.quotes_writer import QUOTES_CHANNEL, create_partitions_ahead
+from core.data_ingestion_ws import build_refresh_scheduler
+
+# Конфигурация
+
+load_dotenv()
+
+DAEMON_TIMEFRAMES = os.getenv("AUTO_UPDATE_TIMEFRAMES", "M30").split(",")
+SCAN_GAPS_ON_START = os.getenv("DAEMON_SCAN_GAPS", "0") == "1"
+PARTITIONS_CHECK = float(os.getenv("DAEMON_PARTITIONS_CHECK_SECONDS", "3600"))
+
+
+# Сервис ингестии
+#
+# Единственный процесс, который ходит в FXOpen: обновляет серии по закрытию баров,
+# в первую очередь — открытые в терминале (quote_priorities). Каждая запись котировок
+# коммитится вместе с NOTIFY quotes_updated {ticker, timeframe, last_bar}, поэтому
+# терминал (QUOTES_INGESTION=daemon) только читает БД по уведомлениям.
+
+def _scan_gaps(timeframes):
+    from core.gap_scanner import scan_gaps, backfill_gaps
+    for tf in timeframes:
+        try:
+            backfill_gaps(scan_gaps(tf))
+        except Exception as e:
+            print(f"⚠️ Поиск пропусков {tf} не удался: {e}")
+
+
+def _maintain_partitions(stopped: threading.Event):
+    """Секции следующего месяца создаются заранее, а не писателями в момент смены месяца."""
+    while True:
+        try:
+            create_partitions_ahead(engine)
+        except Exception as e:
+            print(f"⚠️ Не удалось создать секции заранее: {e}")
+        if stopped.wait(PARTITIONS_CHECK):
+            return
+
+
+def run_daemon(timeframes=DAEMON_TIMEFRAMES):
+    ensure_quotes_schema()
+    start_exporters()
+    scheduler = build_refresh_scheduler(timeframes)
+    stopped = threading.Event()
+
+    def shutdown(signum, frame):
+        print(f"🛑 Получен сигнал {signum}, останавливаем планировщик...")
+        stopped.set()
+        scheduler.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    threading.Thread(target=_maintain_partitions, args=(stopped,),
+                     name="partitions", daemon=True).start()
+    if SCAN_GAPS_ON_START:
+        threading.Thread(target=_scan_gaps, args=(scheduler.timeframes,),
+                         name="gap-scan", daemon=True).start()
+
+    print(f"🚀 Демон ингестии: ТФ {', '.join(scheduler.timeframes)}, уведомления в канал {QUOTES_CHANNEL}")
+    scheduler.run_forever()
+    print("✅ Демон ингестии остановлен.")
+
+
+if __name__ == "__main__":
+    run_daemon(sys.argv[1:] or DAEMON_TIMEFRAMES)
@@ -0,0 +1,224 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import pandas as pd
+from datetime import datetime
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.timeframes import bar_open
+from core.database import engine
+from core.quotes_writer import copy_quotes, QUOTE_COLUMNS
+from data_providers.fxopen_async import AsyncFXOpenClient
+
+# Конфигурация
+
+load_dotenv()
+
+LIVE_TIMEFRAMES = ["M1", "M5", "M15", "M30", "H1", "D1"]
+FLUSH_INTERVAL = float(os.getenv("LIVE_FLUSH_SECONDS", "5"))
+RECONNECT_DELAY = float(os.getenv("LIVE_RECONNECT_SECONDS", "5"))
+
+
+# Агрегация тиков в бары
+
+class BarAggregator:
+    """
+    Инкрементально собирает OHLCV-бары из тиков для нескольких таймфреймов.
+
+    Бар хранится как [open_time, open, high, low, close, volume]; объём — число тиков.
+    Первый бар каждой серии после старта неполный (начало бара не наблюдалось),
+    поэтому он публикуется слушателям, но не считается закрытым для записи в БД.
+    """
+
+    def __init__(self, timeframes=LIVE_TIMEFRAMES):
+        self.timeframes = list(timeframes)
+        self._bars = {}        # (symbol, tf) -> текущий бар
+        self._partial = set()  # серии, чей текущий бар начался до подписки
+
+    def on_tick(self, symbol: str, ts: datetime, price: float, volume: float = 1.0):
+        """
+        Применяет тик. Возвращает (updated, closed):
+        updated — [(symbol, tf, bar)] текущие бары после тика,
+        closed  — [(symbol, tf, bar)] полностью наблюдённые закрытые бары.
+        """
+        updated, closed = [], []
+        for tf in self.timeframes:
+            key = (symbol, tf)
+            start = bar_open(ts, tf)
+            bar = self._bars.get(key)
+
+            if bar is None:
+                self._partial.add(key)
+            elif start > bar[0]:
+                if key in self._partial:
+                    self._partial.discard(key)
+                else:
+                    closed.append((symbol, tf, tuple(bar)))
+                bar = None
+            elif start < bar[0]:
+                continue  # запоздавший тик прошлого бара
+
+            if bar is None:
+                bar = [start, price, price, price, price, 0.0]
+                self._bars[key] = bar
+            else:
+                bar[2] = max(bar[2], price)
+                bar[3] = min(bar[3], price)
+                bar[4] = price
+            bar[5] += volume
+            updated.append((symbol, tf, tuple(bar)))
+        return updated, closed
+
+    def current(self, symbol: str, timeframe: str):
+        bar = self._bars.get((symbol, timeframe))
+        return tuple(bar) if bar else None
+
+
+def parse_feed_tick(message: dict):
+    """(symbol, datetime, bid) из FeedTick/снапшота FeedSubscribe, иначе None."""
+    result = message.get("Result") or {}
+    ticks = result.get("Snapshot") if message.get("Response") == "FeedSubscribe" else [result]
+    parsed = []
+    for tick in ticks or []:
+        bid = (tick.get("BestBid") or {}).get("Price")
+        ts = tick.get("Timestamp")
+        if tick.get("Symbol") and bid is not None and ts is not None:
+            parsed.append((tick["Symbol"], datetime.utcfromtimestamp(ts / 1000.0), float(bid)))
+    return parsed
+
+
+# Потоковый фид
+
+class LiveFeed:
+    """
+    Подписка на тики FXOpen в фоновом потоке.
+
+    Текущие бары публикуются слушателям add_listener(fn(symbol, tf, bar)) на каждом тике,
+    закрытые бары раз в FLUSH_INTERVAL пишутся в instrument_quotes (если persist=True).
+    Слушатели вызываются из потока фида.
+    """
+
+    def __init__(self, timeframes=LIVE_TIMEFRAMES, persist: bool = True):
+        self.aggregator = BarAggregator(timeframes)
+        self.persist = persist
+        self._symbols = set()
+        self._listeners = []
+        self._closed = []
+        self._lock = threading.Lock()
+        self._loop = None
+        self._client = None
+        self._thread = None
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def subscribe(self, symbols):
+        new = [s for s in symbols if s not in self._symbols]
+        if not new:
+            return
+        self._symbols.update(new)
+        if self._loop is not None and self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._subscribe(new), self._loop)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="live-feed", daemon=True)
+            self._thread.start()
+
+    # ---------- поток фида ----------
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._main())
+
+    async def _main(self):
+        flusher = asyncio.create_task(self._flush_loop())
+        try:
+            while True:
+                try:
+                    async with AsyncFXOpenClient(app_session_id="LIVE_FEED") as client:
+                        client.add_handler(self._on_message)
+                        self._client = client
+                        await self._subscribe(sorted(self._symbols))
+                        print(f"📡 Live-фид: подписка на {len(self._symbols)} символов")
+                        await client.wait_closed()
+                except Exception as e:
+                    print(f"[live_bars] Соединение потеряно: {e}")
+                finally:
+                    self._client = None
+                await asyncio.sleep(RECONNECT_DELAY)
+        finally:
+            flusher.cancel()
+
+    async def _subscribe(self, symbols):
+        if not symbols or self._client is None:
+            return
+        response = await self._client.request("FeedSubscribe", {
+            "Subscribe": [{"Symbol": s, "BookDepth": 1} for s in symbols]
+        })
+        self._on_message(response)
+
+    def _on_message(self, message: dict):
+        for symbol, ts, price in parse_feed_tick(message):
+            updated, closed = self.aggregator.on_tick(symbol, ts, price)
+            if closed:
+                with self._lock:
+                    self._closed.extend(closed)
+            for sym, tf, bar in updated:
+                for listener in self._listeners:
+                    try:
+                        listener(sym, tf, bar)
+                    except Exception as e:
+                        print(f"[live_bars] Ошибка слушателя: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            with self._lock:
+                closed, self._closed = self._closed, []
+            if closed and self.persist:
+                try:
+                    await asyncio.to_thread(save_closed_bars, closed)
+                except Exception as e:
+                    print(f"[live_bars] Ошибка записи баров: {e}")
+
+
+def save_closed_bars(closed) -> int:
+    """
+    Пишет закрытые бары; исторические бары FXOpen, если уже есть, не перезаписываются.
+    Водяной знак не сдвигается: объём здесь — число тиков, а переподключение могло оставить
+    дыру, поэтому опрос истории FXOpen всё равно перезагрузит эти бары с last_bar.
+    """
+    df = pd.DataFrame([(sym, tf, *bar) for sym, tf, bar in closed], columns=QUOTE_COLUMNS)
+    with engine.begin() as conn:
+        return copy_quotes(conn, df, on_conflict="nothing", advance_watermark=False)
+
+
+_feed = None
+_feed_lock = threading.Lock()
+
+
+def get_live_feed(persist: bool = True) -> LiveFeed:
+    """
+    Общий для процесса live-фид (запускается при первом обращении).
+    persist=False — закрытые бары только публикуются слушателям, в БД их пишет другой процесс.
+    """
+    global _feed
+    with _feed_lock:
+        if _feed is None:
+            _feed = LiveFeed(persist=persist)
+            _feed.start()
+        return _feed
+
+
+# Потоковый режим ингестии
+
+if __name__ == "__main__":
+    feed = get_live_feed()
+    feed.subscribe(sys.argv[1:] or ["AAPL", "AMZN", "TSLA"])
+    while True:
+        time.sleep(60)
@@ -0,0 +1,241 @@
+import os
+import sys
+import hashlib
+import argparse
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.database import PG_SCHEMA
+
+# Конфигурация
+
+load_dotenv()
+
+# Размеры миниатюр (px), которые рисует интерфейс: 60 — шапка InstrumentsPage
+LOGO_THUMB_SIZES = [int(s) for s in os.getenv("LOGO_THUMB_SIZES", "60").split(",") if s.strip()]
+MIGRATE_BATCH_SIZE = int(os.getenv("LOGO_MIGRATE_BATCH_SIZE", "200"))
+
+
+# Хранилище логотипов по содержимому
+#
+# Исходный файл лежит один раз в logo_blobs под своим SHA-256 — одинаковые логотипы
+# разных классов акций одной компании не дублируются. instruments хранит только
+# logo_sha256, а logo_thumbnails — готовые PNG нужных интерфейсу размеров,
+# так что при клике по инструменту читается несколько килобайт, а не исходник.
+
+LOGO_DDL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {PG_SCHEMA}.logo_blobs (
+        sha256 CHAR(64) PRIMARY KEY,
+        data BYTEA NOT NULL,
+        size_bytes INTEGER NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT timezone('utc', now())
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {PG_SCHEMA}.logo_thumbnails (
+        sha256 CHAR(64) NOT NULL REFERENCES {PG_SCHEMA}.logo_blobs (sha256) ON DELETE CASCADE,
+        size SMALLINT NOT NULL,
+        png BYTEA NOT NULL,
+        PRIMARY KEY (sha256, size)
+    )
+    """,
+    f"ALTER TABLE {PG_SCHEMA}.instruments ADD COLUMN IF NOT EXISTS logo_sha256 CHAR(64)",
+    f"CREATE INDEX IF NOT EXISTS ix_instruments_logo_sha256 ON {PG_SCHEMA}.instruments (logo_sha256)",
+]
+
+
+def ensure_logo_schema(cur):
+    """Создаёт таблицы хранилища и столбец instruments.logo_sha256 (instruments уже должна быть)."""
+    for ddl in LOGO_DDL:
+        cur.execute(ddl)
+
+
+def logo_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def render_thumbnail(data: bytes, size: int) -> bytes | None:
+    """
+    PNG не больше size×size с сохранением пропорций. Рендер через QImage (без QApplication);
+    None — PyQt6 нет в процессе или формат не распознан: миниатюру тогда дорисует GUI.
+    """
+    try:
+        from PyQt6.QtCore import QBuffer, QByteArray, QIODevice, Qt
+        from PyQt6.QtGui import QImage
+    except ImportError:
+        return None
+    image = QImage.fromData(data)
+    if image.isNull():
+        return None
+    if image.width() > size or image.height() > size:
+        image = image.scaled(size, size, Qt.AspectRatioMode.KeepAspectRatio,
+                             Qt.TransformationMode.SmoothTransformation)
+    png = QByteArray()
+    buffer = QBuffer(png)
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buffer, "PNG")
+    buffer.close()
+    return bytes(png)
+
+
+def save_thumbnails(cur, digest: str, thumbnails: dict):
+    """thumbnails: {размер: png}."""
+    _insert_thumbnails(cur, [(digest, size, png) for size, png in thumbnails.items()])
+
+
+def _insert_thumbnails(cur, rows: list):
+    if rows:
+        execute_values(cur, f"""
+            INSERT INTO {PG_SCHEMA}.logo_thumbnails (sha256, size, png) VALUES %s
+            ON CONFLICT (sha256, size) DO NOTHING
+        """, rows, page_size=len(rows))
+
+
+def store_logos(cur, logos) -> list:
+    """
+    Кладёт пачку логотипов в хранилище и возвращает их SHA-256 (None для пустых) в том же порядке.
+    Уникальное содержимое вставляется одним INSERT ... RETURNING; миниатюры рендерятся
+    только для реально новых логотипов — повторная загрузка тикеров их не трогает.
+    """
+    digests, blobs = [], {}
+    for data in logos:
+        if not data:
+            digests.append(None)
+            continue
+        data = bytes(data)
+        digest = logo_digest(data)
+        blobs.setdefault(digest, data)
+        digests.append(digest)
+    if not blobs:
+        return digests
+
+    inserted = execute_values(cur, f"""
+        INSERT INTO {PG_SCHEMA}.logo_blobs (sha256, data, size_bytes) VALUES %s
+        ON CONFLICT (sha256) DO NOTHING
+        RETURNING sha256
+    """, [(digest, data, len(data)) for digest, data in blobs.items()], page_size=len(blobs), fetch=True)
+
+    thumbnails = []
+    for (digest,) in inserted:
+        for size in LOGO_THUMB_SIZES:
+            png = render_thumbnail(blobs[digest], size)
+            if png:
+                thumbnails.append((digest, size, png))
+    _insert_thumbnails(cur, thumbnails)
+    return digests
+
+
+def store_logo(cur, data: bytes | None) -> str | None:
+    """Кладёт один логотип в хранилище и возвращает SHA-256 для instruments.logo_sha256."""
+    return store_logos(cur, [data])[0]
+
+
+def load_logo(cur, digest: str, size: int | None = None):
+    """
+    (байты, миниатюра ли это) для логотипа; (None, False), если его нет.
+    Без готовой миниатюры нужного размера возвращается исходник.
+    """
+    cur.execute(f"""
+        SELECT COALESCE(t.png, b.data), t.png IS NOT NULL
+        FROM {PG_SCHEMA}.logo_blobs b
+        LEFT JOIN {PG_SCHEMA}.logo_thumbnails t ON t.sha256 = b.sha256 AND t.size = %s
+        WHERE b.sha256 = %s
+    """, (size, digest))
+    row = cur.fetchone()
+    if row is None:
+        return None, False
+    return bytes(row[0]), row[1]
+
+
+# Перенос логотипов из instruments.logo_data
+
+def _has_inline_column(cur) -> bool:
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = 'instruments' AND column_name = 'logo_data'
+    """, (PG_SCHEMA,))
+    return cur.fetchone() is not None
+
+
+def adopt_inline_logo(cur, ticker: str) -> str | None:
+    """
+    Переносит в хранилище logo_data одного инструмента, если перенос его ещё не коснулся
+    (интерфейс вызывает это для строк с пустым logo_sha256). Возвращает SHA-256 или None.
+    """
+    if not _has_inline_column(cur):
+        return None
+    cur.execute(f"SELECT logo_data FROM {PG_SCHEMA}.instruments WHERE ticker = %s AND logo_data IS NOT NULL",
+                (ticker,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    digest = store_logo(cur, row[0])
+    cur.execute(f"UPDATE {PG_SCHEMA}.instruments SET logo_sha256 = %s, logo_data = NULL WHERE ticker = %s",
+                (digest, ticker))
+    return digest
+
+
+def migrate_inline_logos(conn, batch_size: int = MIGRATE_BATCH_SIZE, drop_column: bool = False) -> dict:
+    """
+    Переносит logo_data из строк instruments в хранилище пакетами (транзакция на пакет,
+    прерванный перенос продолжается с места) и обнуляет logo_data.
+    drop_column — после переноса удалить сам столбец logo_data.
+    """
+    stats = {"rows": 0, "bytes": 0, "unique": set()}
+    with conn.cursor() as cur:
+        ensure_logo_schema(cur)
+        has_inline = _has_inline_column(cur)
+    conn.commit()
+
+    while has_inline:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT id, logo_data FROM {PG_SCHEMA}.instruments
+                WHERE logo_data IS NOT NULL
+                ORDER BY id LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (batch_size,))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            digests = store_logos(cur, [data for _, data in rows])
+            updates = [(instrument_id, digest) for (instrument_id, _), digest in zip(rows, digests)]
+            stats["rows"] += len(rows)
+            stats["bytes"] += sum(len(data) for _, data in rows)
+            stats["unique"].update(digests)
+            execute_values(cur, f"""
+                UPDATE {PG_SCHEMA}.instruments AS i
+                SET logo_sha256 = u.sha256, logo_data = NULL
+                FROM (VALUES %s) AS u (id, sha256)
+                WHERE i.id = u.id
+            """, updates)
+        conn.commit()
+        print(f"🖼 Перенесено логотипов: {stats['rows']}")
+
+    if has_inline and drop_column:
+        with conn.cursor() as cur:
+            cur.execute(f"ALTER TABLE {PG_SCHEMA}.instruments DROP COLUMN IF EXISTS logo_data")
+        conn.commit()
+        print("🗑 Столбец instruments.logo_data удалён")
+    stats["unique"] = len(stats["unique"])
+    return stats
+
+
+if __name__ == "__main__":
+    from core.database import raw_connection
+
+    parser = argparse.ArgumentParser(description="Перенос логотипов instruments в хранилище по SHA-256")
+    parser.add_argument("--batch-size", type=int, default=MIGRATE_BATCH_SIZE)
+    parser.add_argument("--drop-column", action="store_true", help="после переноса удалить instruments.logo_data")
+    args = parser.parse_args()
+
+    with raw_connection() as conn:
+        stats = migrate_inline_logos(conn, args.batch_size, args.drop_column)
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM {PG_SCHEMA}.logo_blobs")
+            blobs, stored = cur.fetchone()
+    print(f"✅ Строк перенесено: {stats['rows']} ({stats['bytes'] / 1e6:.1f} МБ), уникальных логотипов "
+          f"в переносе: {stats['unique']}; в хранилище {blobs} файлов, {stored / 1e6:.1f} МБ")
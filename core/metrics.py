@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import atexit
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+# Конфигурация
+
+load_dotenv()
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))              # 0 — HTTP-эндпоинт выключен
+METRICS_JSON_PATH = os.getenv("METRICS_JSON_PATH", "")          # пусто — снапшоты не пишутся
+METRICS_JSON_INTERVAL = float(os.getenv("METRICS_JSON_INTERVAL", "30"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATE_BUCKETS = (10, 100, 1_000, 5_000, 10_000, 50_000, 100_000, 500_000)
+
+
+# Метрики
+
+class Counter:
+    """Монотонный счётчик с метками."""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(zip(self.labels, key)), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин (как в Prometheus)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}   # key -> [counts по корзинам..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, state in self._values.items():
+                labels = dict(zip(self.labels, key))
+                for bound, count in zip(self.buckets, state):
+                    result.append((f"{self.name}_bucket", {**labels, "le": f"{bound:g}"}, count))
+                result.append((f"{self.name}_bucket", {**labels, "le": "+Inf"}, state[-1]))
+                result.append((f"{self.name}_sum", labels, state[-2]))
+                result.append((f"{self.name}_count", labels, state[-1]))
+        return result
+
+    def summary(self):
+        """Сводка для JSON: count, sum, среднее по каждому набору меток."""
+        with self._lock:
+            return [{**dict(zip(self.labels, key)), "count": s[-1], "sum": round(s[-2], 6),
+                     "avg": round(s[-2] / s[-1], 6) if s[-1] else 0.0}
+                    for key, s in self._values.items()]
+
+
+class Gauge:
+    """Текущее значение, которое читается функцией в момент экспорта (размер пула и т.п.)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.fn = fn
+
+    def samples(self):
+        try:
+            return [(self.name, {}, float(self.fn()))] if self.fn else []
+        except Exception:
+            return []
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labels, **kwargs)
+            return metric
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def gauge(self, name: str, help: str, fn) -> Gauge:
+        return self._get(Gauge, name, help, (), fn=fn)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+gauge = REGISTRY.gauge
+
+
+# Метрики ингестии (общие для всех загрузчиков)
+
+REQUEST_SECONDS = histogram("ingest_request_seconds", "Задержка запроса к внешнему API",
+                            ("provider", "request"))
+REQUEST_RETRIES = counter("ingest_request_retries_total", "Повторы запросов к внешнему API",
+                          ("provider", "ticker"))
+INGEST_ERRORS = counter("ingest_errors_total", "Ошибки загрузки по тикерам",
+                        ("source", "ticker"))
+BARS_FETCHED = counter("ingest_bars_fetched_total", "Загружено баров из FXOpen", ("timeframe",))
+BARS_PER_SECOND = histogram("ingest_bars_per_second", "Скорость загрузки серии, баров/с",
+                            ("timeframe",), buckets=RATE_BUCKETS)
+TICKER_SECONDS = counter("ingest_ticker_seconds_total", "Время обновления серии (медленные символы)",
+                         ("ticker", "timeframe"))
+DB_WRITE_SECONDS = histogram("db_write_seconds", "Задержка записи в БД", ("table",))
+DB_ROWS_WRITTEN = counter("db_rows_written_total", "Добавлено строк", ("table",))
+DB_ROWS_DEDUPLICATED = counter("db_rows_deduplicated_total", "Строк отброшено как дубли", ("table",))
+
+
+# Экспорт
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def render_prometheus(registry: Registry = REGISTRY) -> str:
+    """Текстовый формат экспозиции Prometheus 0.0.4."""
+    lines = []
+    for metric in registry.metrics():
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot(registry: Registry = REGISTRY) -> dict:
+    """Снимок всех метрик в виде словаря для JSON."""
+    data = {"timestamp": time.time(), "counters": {}, "gauges": {}, "histograms": {}}
+    for metric in registry.metrics():
+        if metric.kind == "histogram":
+            data["histograms"][metric.name] = metric.summary()
+        else:
+            data[f"{metric.kind}s"][metric.name] = [{**labels, "value": value}
+                                                   for _, labels, value in metric.samples()]
+    return data
+
+
+class Exporter(ABC):
+    """Базовый экспортёр: start() запускает фоновую публикацию, stop() — останавливает."""
+
+    def __init__(self, registry: Registry = REGISTRY):
+        self.registry = registry
+
+    @abstractmethod
+    def start(self):
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+
+class PrometheusExporter(Exporter):
+    """HTTP-эндпоинт /metrics в текстовом формате Prometheus."""
+
+    def __init__(self, port: int, host: str = "0.0.0.0", registry: Registry = REGISTRY):
+        super().__init__(registry)
+        self.address = (host, port)
+        self._server = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render_prometheus(registry).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(self.address, Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"📈 Метрики Prometheus: http://{self.address[0]}:{self._server.server_port}/metrics")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+
+class JsonSnapshotExporter(Exporter):
+    """Периодически (и при выходе) записывает снапшот метрик в JSON-файл."""
+
+    def __init__(self, path: str, interval: float = METRICS_JSON_INTERVAL, registry: Registry = REGISTRY):
+        super().__init__(registry)
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def write(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot(self.registry), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"[metrics] Не удалось записать снапшот: {e}")
+
+    def start(self):
+        threading.Thread(target=self._loop, name="metrics-json", daemon=True).start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if not self._stop.is_set():
+            self._stop.set()
+            self.write()
+
+
+_exporters = []
+
+
+def add_exporter(exporter: Exporter):
+    """Подключает и запускает экспортёр (свой формат — наследник Exporter)."""
+    exporter.start()
+    _exporters.append(exporter)
+
+
+def start_exporters():
+    """Запускает экспортёры, включённые в .env (METRICS_PORT, METRICS_JSON_PATH). Повторный вызов — no-op."""
+    if _exporters:
+        return
+    if METRICS_PORT:
+        add_exporter(PrometheusExporter(METRICS_PORT))
+    if METRICS_JSON_PATH:
+        add_exporter(JsonSnapshotExporter(METRICS_JSON_PATH))
@@ -0,0 +1,196 @@
+import os
+import sys
+import time
+import argparse
+from datetime import datetime
+from sqlalchemy import MetaData, text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.database import (engine, PG_SCHEMA, InstrumentQuote, QUOTE_TIMEFRAMES, is_partitioned,
+                           ensure_quotes_schema, ensure_timeframe_partitions, ensure_quote_partitions)
+from core.quotes_writer import QUOTE_COLUMNS, UNPARTITIONED_RECHECK
+
+# Онлайн-перенос instrument_quotes в секционированную схему
+#
+# 1. Рядом создаётся instrument_quotes_part с той же структурой, PK и BRIN и секциями
+#    под весь диапазон истории. Писатели (copy_quotes) в течение минуты замечают
+#    секции таймфреймов и начинают сами создавать недостающие месяцы.
+# 2. Триггер на старой таблице зеркалирует все новые записи в instrument_quotes_part.
+# 3. История копируется пакетами по каждой серии (keyset по уникальному индексу),
+#    прогресс — в quotes_migration, поэтому прерванный перенос продолжается с места.
+# 4. Короткая транзакция меняет таблицы местами; старая остаётся как instrument_quotes_legacy.
+
+NEW_TABLE = "instrument_quotes_part"
+LEGACY_TABLE = "instrument_quotes_legacy"
+BATCH_SIZE = int(os.getenv("MIGRATE_BATCH_SIZE", "50000"))
+SWAP_LOCK_TIMEOUT = os.getenv("MIGRATE_LOCK_TIMEOUT", "10s")
+
+_values = ["open", "high", "low", "close", "volume"]
+
+MIRROR_DDL = [
+    f"""
+    CREATE OR REPLACE FUNCTION instrument_quotes_mirror() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            DELETE FROM {NEW_TABLE}
+            WHERE ticker = OLD.ticker AND timeframe = OLD.timeframe AND datetime = OLD.datetime;
+            RETURN NULL;
+        END IF;
+        INSERT INTO {NEW_TABLE} ({", ".join(QUOTE_COLUMNS)})
+        VALUES ({", ".join("NEW." + c for c in QUOTE_COLUMNS)})
+        ON CONFLICT (ticker, timeframe, datetime) DO UPDATE
+        SET {", ".join(f"{c} = EXCLUDED.{c}" for c in _values)};
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS instrument_quotes_mirror ON instrument_quotes",
+    """
+    CREATE TRIGGER instrument_quotes_mirror
+    AFTER INSERT OR UPDATE OR DELETE ON instrument_quotes
+    FOR EACH ROW EXECUTE FUNCTION instrument_quotes_mirror()
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS quotes_migration (
+        ticker TEXT NOT NULL,
+        timeframe TEXT NOT NULL,
+        copied_until TIMESTAMP,
+        rows BIGINT NOT NULL DEFAULT 0,
+        done BOOLEAN NOT NULL DEFAULT FALSE,
+        PRIMARY KEY (ticker, timeframe)
+    )
+    """,
+]
+
+
+# Шаги миграции
+
+def create_target():
+    """Создаёт instrument_quotes_part и секции под весь диапазон существующей истории."""
+    with engine.begin() as conn:
+        target = InstrumentQuote.__table__.to_metadata(MetaData(schema=PG_SCHEMA), name=NEW_TABLE)
+        target.create(conn, checkfirst=True)
+        ensure_timeframe_partitions(conn, parent=NEW_TABLE)
+        ranges = {tf: (lo, hi) for tf, lo, hi in conn.execute(text("""
+            SELECT timeframe, MIN(datetime), MAX(datetime) FROM instrument_quotes GROUP BY timeframe
+        """))}
+        now = datetime.utcnow()
+        for tf in QUOTE_TIMEFRAMES:
+            lo, hi = ranges.get(tf, (now, now))
+            ranges[tf] = (lo, max(hi, now))
+        ensure_quote_partitions(conn, ranges)
+    print(f"🧱 Создана {NEW_TABLE}: {len(ranges)} таймфреймов")
+
+
+def install_mirror():
+    with engine.begin() as conn:
+        for ddl in MIRROR_DDL:
+            conn.execute(text(ddl))
+        conn.execute(text("""
+            INSERT INTO quotes_migration (ticker, timeframe)
+            SELECT ticker, timeframe FROM quote_watermarks
+            ON CONFLICT (ticker, timeframe) DO NOTHING
+        """))
+    print("🪞 Триггер зеркалирования установлен")
+
+
+def copy_series(ticker: str, timeframe: str, after, batch_size: int = BATCH_SIZE) -> int:
+    """Копирует серию пакетами по batch_size строк, каждый пакет — отдельная транзакция."""
+    cols = ", ".join(QUOTE_COLUMNS)
+    copied = 0
+    while True:
+        with engine.begin() as conn:
+            # Пакеты переноса не ограничиваются PG_STATEMENT_TIMEOUT_MS пула
+            conn.execute(text("SET LOCAL statement_timeout = 0"))
+            last, n = conn.execute(text(f"""
+                WITH batch AS (
+                    SELECT {cols} FROM instrument_quotes
+                    WHERE ticker = :ticker AND timeframe = :tf
+                      AND (CAST(:after AS timestamp) IS NULL OR datetime > :after)
+                    ORDER BY datetime
+                    LIMIT :limit
+                ),
+                copied AS (
+                    INSERT INTO {NEW_TABLE} ({cols})
+                    SELECT {cols} FROM batch
+                    ON CONFLICT (ticker, timeframe, datetime) DO NOTHING
+                )
+                SELECT MAX(datetime), COUNT(*) FROM batch
+            """), {"ticker": ticker, "tf": timeframe, "after": after, "limit": batch_size}).one()
+            done = n < batch_size
+            conn.execute(text("""
+                UPDATE quotes_migration
+                SET copied_until = COALESCE(:last, copied_until), rows = rows + :n, done = :done
+                WHERE ticker = :ticker AND timeframe = :tf
+            """), {"ticker": ticker, "tf": timeframe, "last": last, "n": n, "done": done})
+        copied += n
+        if done:
+            return copied
+        after = last
+
+
+def copy_history(batch_size: int = BATCH_SIZE):
+    with engine.connect() as conn:
+        pending = conn.execute(text("""
+            SELECT ticker, timeframe, copied_until FROM quotes_migration
+            WHERE NOT done ORDER BY ticker, timeframe
+        """)).fetchall()
+    started = time.time()
+    total = 0
+    for i, (ticker, tf, after) in enumerate(pending, 1):
+        total += copy_series(ticker, tf, after, batch_size)
+        if i % 50 == 0 or i == len(pending):
+            elapsed = time.time() - started
+            print(f"⏳ {i}/{len(pending)} серий, {total} строк ({total / max(elapsed, 1e-6):,.0f} строк/с)")
+
+
+def swap_tables():
+    """Короткая транзакция: старая таблица → instrument_quotes_legacy, новая → instrument_quotes."""
+    with engine.begin() as conn:
+        conn.execute(text(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'"))
+        conn.execute(text("LOCK TABLE instrument_quotes IN ACCESS EXCLUSIVE MODE"))
+        # Серии, появившиеся после начала миграции, уже перенесены триггером
+        left = conn.execute(text("SELECT COUNT(*) FROM quotes_migration WHERE NOT done")).scalar()
+        if left:
+            raise RuntimeError(f"Не перенесено серий: {left} — запустите копирование повторно")
+        conn.execute(text("DROP TRIGGER instrument_quotes_mirror ON instrument_quotes"))
+        conn.execute(text(f"ALTER TABLE instrument_quotes RENAME TO {LEGACY_TABLE}"))
+        conn.execute(text(f"ALTER TABLE {NEW_TABLE} RENAME TO instrument_quotes"))
+        conn.execute(text("DROP FUNCTION instrument_quotes_mirror()"))
+    print(f"🔁 instrument_quotes секционирована; старые данные — в {LEGACY_TABLE}")
+
+
+def migrate(batch_size: int = BATCH_SIZE):
+    ensure_quotes_schema()
+    with engine.connect() as conn:
+        if is_partitioned(conn):
+            print("✅ instrument_quotes уже секционирована.")
+            return
+        resumed = conn.execute(text("SELECT to_regclass(:t) IS NOT NULL"), {"t": NEW_TABLE}).scalar()
+    create_target()
+    if not resumed:
+        # Писатели перепроверяют схему раз в UNPARTITIONED_RECHECK секунд
+        print(f"⏱ Ждём {UNPARTITIONED_RECHECK:.0f} с, пока писатели увидят новые секции...")
+        time.sleep(UNPARTITIONED_RECHECK)
+    install_mirror()
+    copy_history(batch_size)
+    swap_tables()
+
+
+def drop_legacy():
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {LEGACY_TABLE}"))
+        conn.execute(text("DROP TABLE IF EXISTS quotes_migration"))
+    print(f"🗑 {LEGACY_TABLE} удалена")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Перенос instrument_quotes в секционированную схему")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--drop-legacy", action="store_true", help="удалить instrument_quotes_legacy")
+    args = parser.parse_args()
+    if args.drop_legacy:
+        drop_legacy()
+    else:
+        migrate(args.batch_size)
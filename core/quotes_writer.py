@@ -0,0 +1,301 @@
+import io
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from core.database import (ensure_quotes_schema, quote_partition_specs, quote_partition_name,
+                           create_quote_partition, is_partitioned, QUOTE_TIMEFRAMES)
+from core.aggregates import AGGREGATES_ENABLED, AGGREGATE_SOURCE, refresh_aggregates
+from core.metrics import DB_WRITE_SECONDS, DB_ROWS_WRITTEN, DB_ROWS_DEDUPLICATED
+
+QUOTE_COLUMNS = ["ticker", "timeframe", "datetime", "open", "high", "low", "close", "volume"]
+
+# Канал NOTIFY: payload — JSON {ticker, timeframe, last_bar} по каждой изменённой серии
+QUOTES_CHANNEL = "quotes_updated"
+
+
+# Потоковая запись через COPY
+
+def _to_csv_buffer(df: pd.DataFrame) -> io.StringIO:
+    buf = io.StringIO()
+    df[QUOTE_COLUMNS].to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    return buf
+
+
+_schema_ready = False
+
+
+def _ensure_schema(conn):
+    # DDL идёт отдельной транзакцией, чтобы откат записи не откатил и схему
+    global _schema_ready
+    if not _schema_ready:
+        ensure_quotes_schema(conn.engine)
+        _schema_ready = True
+
+
+# Секции месяцев создаются перед записью; подтверждённые в каталоге запоминаются
+_known_partitions = set()
+_unpartitioned_until = 0.0
+UNPARTITIONED_RECHECK = 60.0   # до миграции таблица не секционирована — перепроверяем раз в минуту
+PARTITION_LOCK_KEY = 720_311_501   # pg_advisory_xact_lock: создание секций instrument_quotes
+PARTITION_LOCK_TIMEOUT = "5s"
+
+
+def _create_partitions(engine, specs) -> bool:
+    """
+    Создаёт секции отдельной короткой транзакцией: AccessExclusive на родителе держится
+    только на время DDL, а не всю запись, и параллельные писатели сериализуются
+    advisory-локом. False — не дождались блокировок за PARTITION_LOCK_TIMEOUT.
+    """
+    try:
+        with engine.begin() as ddl:
+            ddl.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+            ddl.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+            for spec in specs:
+                create_quote_partition(ddl, *spec)
+        return True
+    except OperationalError as e:
+        print(f"[quotes_writer] Секции не созданы заранее: {e}")
+        return False
+
+
+def _ensure_partitions(conn, df: pd.DataFrame):
+    global _unpartitioned_until
+    if time.time() < _unpartitioned_until:
+        return
+    needed = {}
+    for tf, lo, hi in df.groupby("timeframe")["datetime"].agg(["min", "max"]).itertuples():
+        if tf not in QUOTE_TIMEFRAMES:
+            continue
+        for suffix, start, end in quote_partition_specs(tf, lo, hi):
+            name = quote_partition_name(tf, suffix)
+            if name not in _known_partitions:
+                needed[name] = (tf, suffix, start, end)
+    if not needed:
+        return
+
+    parents = {quote_partition_name(tf) for tf, *_ in needed.values()}
+    existing = {row[0] for row in conn.execute(text("""
+        SELECT n FROM unnest(CAST(:names AS text[])) AS n WHERE to_regclass(n) IS NOT NULL
+    """), {"names": list(needed) + list(parents)})}
+    if not parents & existing:
+        # instrument_quotes ещё не перенесена в секционированную схему (core/migrate_quotes.py)
+        _unpartitioned_until = time.time() + UNPARTITIONED_RECHECK
+        return
+    _known_partitions.update(existing - parents)
+    missing = [spec for name, spec in needed.items() if name not in existing]
+    if not missing:
+        return
+    if _create_partitions(conn.engine, missing):
+        _known_partitions.update(needed)
+        return
+    # Родителя блокирует сама транзакция записи (например, прочитала его раньше) —
+    # создаём секции в ней; при откате они исчезнут вместе с барами
+    for spec in missing:
+        create_quote_partition(conn, *spec)
+
+
+def create_partitions_ahead(engine, timeframes=QUOTE_TIMEFRAMES, now: datetime | None = None) -> int:
+    """
+    Секции текущего и следующего месяца (года) для timeframes — чтобы на смене месяца
+    их не пришлось создавать писателям. Возвращает число проверенных секций.
+    """
+    now = now or datetime.utcnow()
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            return 0
+    specs = []
+    for tf in timeframes:
+        if tf not in QUOTE_TIMEFRAMES:
+            continue
+        _, _, current_end = quote_partition_specs(tf, now, now)[0]
+        specs += [(tf, *spec) for spec in quote_partition_specs(tf, now, current_end)]
+    if specs and _create_partitions(engine, specs):
+        _known_partitions.update(quote_partition_name(tf, suffix) for tf, suffix, *_ in specs)
+    return len(specs)
+
+
+def copy_quotes(conn, df: pd.DataFrame, on_conflict: str = "update", advance_watermark: bool = True) -> int:
+    """
+    Пишет бары в instrument_quotes через COPY FROM STDIN.
+    Бары сначала попадают во временную staging-таблицу, затем одним
+    INSERT ... ON CONFLICT (ticker, timeframe, datetime) переносятся в instrument_quotes.
+    on_conflict:
+    - "update"  — существующие бары перезаписываются, если значения изменились
+                  (так исправляется последний, ещё формировавшийся бар)
+    - "nothing" — существующие бары не трогаются
+    Стоимость — O(новых баров): дубли отсекает уникальный индекс, а не чтение истории.
+    conn — SQLAlchemy Connection внутри открытой транзакции.
+    По каждой серии с добавленными или исправленными барами отправляется
+    NOTIFY quotes_updated — слушатели получат его после коммита транзакции.
+    advance_watermark=False — бары не из истории FXOpen (live-фид): last_bar не сдвигается,
+    чтобы опрос истории перезагрузил их и не пропустил дыру; растёт только bar_count.
+    Возвращает число добавленных баров (перезаписанные не считаются).
+    """
+    if df.empty:
+        return 0
+    if on_conflict not in ("update", "nothing"):
+        raise ValueError(f"on_conflict: ожидается 'update' или 'nothing', получено {on_conflict!r}")
+
+    _ensure_schema(conn)
+    _ensure_partitions(conn, df)
+
+    cols = ", ".join(QUOTE_COLUMNS)
+    values = ["open", "high", "low", "close", "volume"]
+    if on_conflict == "update":
+        conflict_action = f"""
+            DO UPDATE SET {", ".join(f"{c} = EXCLUDED.{c}" for c in values)}
+            WHERE ({", ".join("q." + c for c in values)})
+                IS DISTINCT FROM ({", ".join("EXCLUDED." + c for c in values)})
+        """
+    else:
+        conflict_action = "DO NOTHING"
+
+    with DB_WRITE_SECONDS.time(table="instrument_quotes"), conn.connection.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE quotes_staging
+            (LIKE instrument_quotes INCLUDING DEFAULTS) ON COMMIT DROP
+        """)
+        cur.copy_expert(f"COPY quotes_staging ({cols}) FROM STDIN WITH (FORMAT csv)", _to_csv_buffer(df))
+        if advance_watermark:
+            marks = """
+                INSERT INTO quote_watermarks AS w (ticker, timeframe, last_bar, last_checked, bar_count)
+                SELECT s.ticker, s.timeframe, MAX(s.datetime), timezone('utc', now()),
+                       (SELECT COUNT(*) FROM written x
+                        WHERE x.inserted AND x.ticker = s.ticker AND x.timeframe = s.timeframe)
+                FROM quotes_staging s
+                GROUP BY s.ticker, s.timeframe
+                ON CONFLICT (ticker, timeframe) DO UPDATE
+                SET last_bar = GREATEST(w.last_bar, EXCLUDED.last_bar),
+                    last_checked = EXCLUDED.last_checked,
+                    bar_count = w.bar_count + EXCLUDED.bar_count
+            """
+        else:
+            marks = """
+                UPDATE quote_watermarks AS w
+                SET bar_count = w.bar_count + c.n
+                FROM (SELECT ticker, timeframe, COUNT(*) AS n FROM written
+                      WHERE inserted GROUP BY ticker, timeframe) c
+                WHERE w.ticker = c.ticker AND w.timeframe = c.timeframe
+            """
+        # xmax = 0 только у вставленных строк, у обновлённых — id транзакции.
+        # Водяные знаки серий обновляются тем же оператором, т.е. в той же транзакции.
+        cur.execute(f"""
+            WITH written AS (
+                INSERT INTO instrument_quotes AS q ({cols})
+                SELECT DISTINCT ON (ticker, timeframe, datetime) {cols}
+                FROM quotes_staging
+                ON CONFLICT (ticker, timeframe, datetime) {conflict_action}
+                RETURNING q.ticker, q.timeframe, q.datetime, (q.xmax = 0) AS inserted
+            ),
+            marks AS ({marks}),
+            notified AS (
+                SELECT pg_notify('{QUOTES_CHANNEL}', json_build_object(
+                    'ticker', ticker, 'timeframe', timeframe, 'last_bar', MAX(datetime))::text)
+                FROM written
+                GROUP BY ticker, timeframe
+            )
+            SELECT (SELECT COUNT(*) FILTER (WHERE inserted) FROM written),
+                   (SELECT COUNT(*) FROM notified)
+        """)
+        inserted = cur.fetchone()[0]
+        if AGGREGATES_ENABLED and (df["timeframe"] == AGGREGATE_SOURCE).any():
+            # Старшие ТФ пересчитываются только по задетым бакетам — в той же транзакции
+            refresh_aggregates(cur, QUOTES_CHANNEL)
+        cur.execute("DROP TABLE quotes_staging")
+    DB_ROWS_WRITTEN.inc(inserted, table="instrument_quotes")
+    DB_ROWS_DEDUPLICATED.inc(len(df) - inserted, table="instrument_quotes")
+    return inserted
+
+
+def touch_watermark(conn, ticker: str, timeframe: str):
+    """Отмечает проверку серии, по которой FXOpen не вернул новых баров."""
+    _ensure_schema(conn)
+    conn.execute(text("""
+        UPDATE quote_watermarks
+        SET last_checked = timezone('utc', now())
+        WHERE ticker = :ticker AND timeframe = :tf
+    """), {"ticker": ticker, "tf": timeframe})
+
+
+def read_watermark(conn, ticker: str, timeframe: str):
+    """Последний бар серии по quote_watermarks — одна строка по первичному ключу."""
+    _ensure_schema(conn)
+    return conn.execute(text("""
+        SELECT last_bar FROM quote_watermarks
+        WHERE ticker = :ticker AND timeframe = :tf
+    """), {"ticker": ticker, "tf": timeframe}).scalar()
+
+
+def mark_priority(conn, tickers, timeframe: str, source: str):
+    """
+    Сообщает планировщику обновлений, что серии сейчас нужны пользователю.
+    timeframe="*" — все таймфреймы, которые обслуживает планировщик.
+    """
+    _ensure_schema(conn)
+    conn.execute(text("""
+        INSERT INTO quote_priorities (ticker, timeframe, source, requested_at)
+        VALUES (:ticker, :tf, :source, timezone('utc', now()))
+        ON CONFLICT (ticker, timeframe, source) DO UPDATE
+        SET requested_at = EXCLUDED.requested_at
+    """), [{"ticker": t, "tf": timeframe, "source": source} for t in tickers])
+
+
+# Прежний путь записи (для сравнения)
+
+def to_sql_quotes(conn, df: pd.DataFrame) -> int:
+    """Запись через DataFrame.to_sql с предварительным чтением существующих дат — O(всей истории)."""
+    written = 0
+    for ticker, tf in df[["ticker", "timeframe"]].drop_duplicates().itertuples(index=False):
+        existing_dates = pd.read_sql(
+            text("""
+                SELECT datetime FROM instrument_quotes
+                WHERE ticker = :ticker AND timeframe = :tf
+            """),
+            conn,
+            params={"ticker": ticker, "tf": tf}
+        )["datetime"].astype("datetime64[ns]")
+        part = df[(df["ticker"] == ticker) & (df["timeframe"] == tf) & (~df["datetime"].isin(existing_dates))]
+        if not part.empty:
+            part.to_sql("instrument_quotes", conn, if_exists="append", index=False)
+            written += len(part)
+    return written
+
+
+# Бенчмарк
+
+def _synthetic_bars(n_bars: int, ticker: str = "__BENCH__", timeframe: str = "M1") -> pd.DataFrame:
+    rng = np.random.default_rng(42)
+    close = 100 + rng.standard_normal(n_bars).cumsum()
+    return pd.DataFrame({
+        "ticker": ticker,
+        "timeframe": timeframe,
+        "datetime": pd.date_range("2000-01-03", periods=n_bars, freq="min"),
+        "open": close + rng.standard_normal(n_bars) * 0.1,
+        "high": close + 0.5,
+        "low": close - 0.5,
+        "close": close,
+        "volume": rng.integers(1, 1000, n_bars).astype(float),
+    })
+
+
+def benchmark_writers(engine, n_bars: int = 200_000):
+    """Сравнивает to_sql и COPY на синтетических барах. Транзакции откатываются."""
+    df = _synthetic_bars(n_bars)
+    ensure_quotes_schema(engine)
+    for name, writer in (("to_sql", to_sql_quotes), ("COPY", copy_quotes)):
+        with engine.connect() as conn:
+            trans = conn.begin()
+            started = time.perf_counter()
+            written = writer(conn, df)
+            elapsed = time.perf_counter() - started
+            trans.rollback()
+        print(f"⏱ {name:>6}: {written} баров за {elapsed:.2f} с ({written / elapsed:,.0f} баров/с)")
+
+
+if __name__ == "__main__":
+    from core.database import engine
+    benchmark_writers(engine)
@@ -0,0 +1,219 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from core.timeframes import next_bar_close
+from core.backfill_scheduler import get_rate_limiter, PassSummary, BACKFILL_WORKERS, TICKER_TIMEOUT
+
+# Конфигурация
+
+load_dotenv()
+
+SETTLE_DELAY = timedelta(seconds=float(os.getenv("REFRESH_SETTLE_SECONDS", "5")))   # FXOpen отдаёт закрытый бар не мгновенно
+RETRY_DELAY = timedelta(seconds=float(os.getenv("REFRESH_RETRY_SECONDS", "60")))
+UNIVERSE_REFRESH = float(os.getenv("REFRESH_UNIVERSE_SECONDS", "600"))
+PRIORITY_POLL = float(os.getenv("REFRESH_PRIORITY_POLL_SECONDS", "5"))
+PRIORITY_TTL = timedelta(minutes=float(os.getenv("REFRESH_PRIORITY_TTL_MINUTES", "15")))
+SUMMARY_INTERVAL = float(os.getenv("REFRESH_SUMMARY_SECONDS", "600"))   # как часто печатать сводку
+
+PRIORITY_HIGH = 0     # открыто в графике / есть в портфеле
+PRIORITY_NORMAL = 1
+
+
+class RefreshScheduler:
+    """
+    Планировщик обновления котировок по дедлайнам.
+
+    Для каждой пары (ticker, timeframe) вычисляется момент закрытия следующего бара;
+    поток спит до ближайшего дедлайна, а не опрашивает всю вселенную по таймеру.
+    Созревшие задачи раздаются воркерам в порядке приоритета: серии из
+    quote_priorities (графики, портфель) идут раньше остальных.
+
+    update_fn(ticker, timeframe, deadline=...) -> int — обновление одной серии,
+    universe_fn() -> list — список тикеров,
+    priorities_fn(since) -> [(ticker, timeframe)] — серии с повышенным приоритетом
+    (timeframe "*" — все таймфреймы планировщика).
+    """
+
+    def __init__(self, update_fn, universe_fn, timeframes, priorities_fn=None,
+                 workers: int = BACKFILL_WORKERS, ticker_timeout: float = TICKER_TIMEOUT):
+        self.update_fn = update_fn
+        self.universe_fn = universe_fn
+        self.priorities_fn = priorities_fn
+        self.timeframes = list(timeframes)
+        self.workers = workers
+        self.ticker_timeout = ticker_timeout
+
+        self._timers = []          # (due, seq, key) — ждут своего дедлайна
+        self._ready = []           # (priority, due, seq, key) — созрели, ждут воркера
+        self._due = {}             # key -> актуальный дедлайн (устаревшие записи кучи пропускаются)
+        self._in_flight = set()
+        self._boosted = {}         # key -> время запроса приоритета
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._universe_synced = 0.0
+        self._priorities_polled = 0.0
+        self.stats = {"runs": 0, "bars_written": 0, "errors": 0, "timed_out": 0}
+        self._summary_at = time.time()
+        self._window = {"done": set(), "failed": set(), "timed_out": set(), "bars": 0}
+
+    # ---------- планирование ----------
+    def schedule(self, ticker: str, timeframe: str, due: datetime):
+        key = (ticker, timeframe)
+        with self._cond:
+            self._due[key] = due
+            heapq.heappush(self._timers, (due, next(self._seq), key))
+            self._cond.notify()
+
+    def boost(self, ticker: str, timeframe: str):
+        """Поднимает приоритет серии и ставит её проверку на сейчас."""
+        key = (ticker, timeframe)
+        with self._cond:
+            fresh = key not in self._boosted
+            self._boosted[key] = datetime.utcnow()
+            if fresh and key not in self._in_flight:
+                self._due[key] = datetime.utcnow()
+                heapq.heappush(self._timers, (self._due[key], next(self._seq), key))
+            self._cond.notify()
+
+    def _priority(self, key) -> int:
+        return PRIORITY_HIGH if key in self._boosted else PRIORITY_NORMAL
+
+    def _sync_universe(self, tickers):
+        now = datetime.utcnow()
+        for ticker in tickers:
+            for tf in self.timeframes:
+                key = (ticker, tf)
+                if key not in self._due and key not in self._in_flight:
+                    # Новые серии проверяем сразу: возможно, нужна первичная загрузка
+                    self._due[key] = now
+                    heapq.heappush(self._timers, (now, next(self._seq), key))
+        known = set(tickers)
+        for key in [k for k in self._due if k[0] not in known]:
+            del self._due[key]
+        self._universe_synced = time.time()
+        print(f"🗂 Планировщик: {len(self._due)} серий ({len(tickers)} тикеров × {len(self.timeframes)} ТФ)")
+
+    def _poll_priorities(self):
+        self._priorities_polled = time.time()
+        if self.priorities_fn is None:
+            return
+        try:
+            active = self.priorities_fn(datetime.utcnow() - PRIORITY_TTL)
+        except Exception as e:
+            print(f"⚠️ Не удалось прочитать приоритеты: {e}")
+            return
+        for ticker, tf in active:
+            for timeframe in (self.timeframes if tf == "*" else [tf]):
+                if timeframe in self.timeframes:
+                    self.boost(ticker, timeframe)
+        # Истёкшие приоритеты снимаем
+        expired = datetime.utcnow() - PRIORITY_TTL
+        with self._cond:
+            for key in [k for k, at in self._boosted.items() if at < expired]:
+                del self._boosted[key]
+
+    def _promote_due(self, now: datetime):
+        while self._timers and self._timers[0][0] <= now:
+            due, _, key = heapq.heappop(self._timers)
+            if self._due.get(key) != due or key in self._in_flight:
+                continue
+            heapq.heappush(self._ready, (self._priority(key), due, next(self._seq), key))
+
+    def _next_wakeup(self, now: datetime) -> float:
+        waits = [UNIVERSE_REFRESH - (time.time() - self._universe_synced),
+                 PRIORITY_POLL - (time.time() - self._priorities_polled),
+                 SUMMARY_INTERVAL - (time.time() - self._summary_at)]
+        if self._timers:
+            waits.append((self._timers[0][0] - now).total_seconds())
+        return max(0.0, min(waits))
+
+    # ---------- выполнение ----------
+    def _run(self, key):
+        ticker, tf = key
+        started = time.time()
+        written, retry = 0, False
+        try:
+            written = self.update_fn(ticker, tf, deadline=started + self.ticker_timeout) or 0
+        except Exception as e:
+            print(f"❌ Ошибка обновления для {ticker} ({tf}): {e}")
+            retry = True
+
+        timed_out = not retry and time.time() - started > self.ticker_timeout
+        if timed_out:
+            print(f"⏱ {ticker} ({tf}) не уложился в {self.ticker_timeout:.0f} с")
+
+        now = datetime.utcnow()
+        due = next_bar_close(now, tf) + SETTLE_DELAY
+        if retry:
+            due = min(due, now + RETRY_DELAY)
+        with self._cond:
+            self.stats["runs"] += 1
+            self.stats["bars_written"] += written
+            self.stats["errors"] += int(retry)
+            self.stats["timed_out"] += int(timed_out)
+            self._window["bars"] += written
+            self._window["failed" if retry else "timed_out" if timed_out else "done"].add(ticker)
+            self._in_flight.discard(key)
+            if key in self._due:
+                self._due[key] = due
+                heapq.heappush(self._timers, (due, next(self._seq), key))
+            self._cond.notify()
+
+    def summary(self) -> PassSummary:
+        """Сводка с прошлого вызова: тикеры обновлены / с ошибкой / по таймауту, записано баров, время окна."""
+        with self._cond:
+            now = time.time()
+            window, self._window = self._window, {"done": set(), "failed": set(), "timed_out": set(), "bars": 0}
+            summary = PassSummary(
+                timeframe=", ".join(self.timeframes),
+                tickers_total=len({ticker for ticker, _ in self._due}),
+                tickers_done=len(window["done"]),
+                tickers_failed=sorted(window["failed"]),
+                tickers_timed_out=sorted(window["timed_out"]),
+                bars_written=window["bars"],
+                wall_time=now - self._summary_at,
+            )
+            self._summary_at = now
+        return summary
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def run_forever(self):
+        get_rate_limiter()
+        print(f"🚀 Планировщик обновлений: ТФ {', '.join(self.timeframes)}, воркеров {self.workers}")
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="refresh") as pool:
+            while True:
+                if time.time() - self._universe_synced >= UNIVERSE_REFRESH:
+                    try:
+                        tickers = self.universe_fn()
+                        with self._cond:
+                            self._sync_universe(tickers)
+                    except Exception as e:
+                        print(f"⚠️ Не удалось обновить список тикеров: {e}")
+                        self._universe_synced = time.time()
+                if time.time() - self._priorities_polled >= PRIORITY_POLL:
+                    self._poll_priorities()
+                if time.time() - self._summary_at >= SUMMARY_INTERVAL:
+                    print(self.summary())
+
+                with self._cond:
+                    if self._stopped:
+                        break
+                    now = datetime.utcnow()
+                    self._promote_due(now)
+                    while self._ready and len(self._in_flight) < self.workers:
+                        _, due, _, key = heapq.heappop(self._ready)
+                        if key in self._in_flight or self._due.get(key) != due:
+                            continue
+                        self._in_flight.add(key)
+                        pool.submit(self._run, key)
+                    self._cond.wait(timeout=self._next_wakeup(datetime.utcnow()))
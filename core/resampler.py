@@ -0,0 +1,138 @@
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from dotenv import load_dotenv
+from sqlalchemy import text
+from core.timeframes import bar_open, next_bar_close, timeframe_delta
+from core.quotes_writer import copy_quotes, QUOTE_COLUMNS
+
+# Конфигурация
+
+load_dotenv()
+
+# DERIVE_FROM_M1=1 — из FXOpen грузится только M1, остальные ТФ считаются локально
+DERIVE_FROM_M1 = os.getenv("DERIVE_FROM_M1", "0") == "1"
+BASE_TIMEFRAME = "M1"
+DERIVED_TIMEFRAMES = os.getenv("DERIVED_TIMEFRAMES", "M5,M15,M30,H1,D1").split(",")
+
+_NS = 1_000_000_000
+_WEEK_ORIGIN_NS = 4 * 86400 * _NS   # 1970-01-05, понедельник
+
+
+def source_timeframe(timeframe: str) -> str:
+    """Таймфрейм, который реально грузится из FXOpen для серии timeframe."""
+    if DERIVE_FROM_M1 and timeframe in DERIVED_TIMEFRAMES:
+        return BASE_TIMEFRAME
+    return timeframe
+
+
+def needs_native_history(conn, ticker: str, timeframe: str) -> bool:
+    """
+    True, если у производного ТФ нет баров раньше начала истории M1: M1 его ещё
+    не покрывает, и старую часть серии нужно взять у FXOpen в нативном ТФ.
+    """
+    return conn.execute(text("""
+        SELECT NOT EXISTS (
+            SELECT 1 FROM instrument_quotes
+            WHERE ticker = :ticker AND timeframe = :tf
+              AND datetime < (SELECT MIN(datetime) FROM instrument_quotes
+                              WHERE ticker = :ticker AND timeframe = :base)
+        )
+    """), {"ticker": ticker, "tf": timeframe, "base": BASE_TIMEFRAME}).scalar()
+
+
+# Векторная агрегация
+
+def bucket_starts(ts_ns: np.ndarray, timeframe: str) -> np.ndarray:
+    """Начало бара timeframe для каждой метки (int64 нс от эпохи, UTC)."""
+    if timeframe == "MN1":
+        months = ts_ns.astype("datetime64[ns]").astype("datetime64[M]")
+        return months.astype("datetime64[ns]").astype(np.int64)
+    step = int(timeframe_delta(timeframe).total_seconds()) * _NS
+    origin = _WEEK_ORIGIN_NS if timeframe == "W1" else 0
+    return (ts_ns - origin) // step * step + origin
+
+
+def resample_arrays(ts_ns, open_, high, low, close, volume, timeframe: str):
+    """
+    Агрегирует отсортированные по времени бары в timeframe без циклов Python.
+    Возвращает (ts_ns, open, high, low, close, volume) для получившихся баров.
+    """
+    if len(ts_ns) == 0:
+        empty = np.empty(0)
+        return np.empty(0, dtype=np.int64), empty, empty, empty, empty, empty
+    buckets = bucket_starts(ts_ns, timeframe)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+    return (
+        buckets[starts],
+        open_[starts],
+        np.maximum.reduceat(high, starts),
+        np.minimum.reduceat(low, starts),
+        close[ends],
+        np.add.reduceat(volume, starts),
+    )
+
+
+def resample_frame(df: pd.DataFrame, timeframe: str) -> pd.DataFrame:
+    """Агрегирует DataFrame баров (ticker, timeframe, datetime, OHLCV) одной серии."""
+    df = df.sort_values("datetime")
+    ts, o, h, l, c, v = resample_arrays(
+        df["datetime"].to_numpy(dtype="datetime64[ns]").astype(np.int64),
+        df["open"].to_numpy(dtype=float), df["high"].to_numpy(dtype=float),
+        df["low"].to_numpy(dtype=float), df["close"].to_numpy(dtype=float),
+        df["volume"].to_numpy(dtype=float), timeframe,
+    )
+    return pd.DataFrame({
+        "ticker": df["ticker"].iloc[0] if len(df) else None,
+        "timeframe": timeframe,
+        "datetime": ts.astype("datetime64[ns]"),
+        "open": o, "high": h, "low": l, "close": c, "volume": v,
+    })[QUOTE_COLUMNS]
+
+
+# Инкрементальное обновление производных ТФ
+
+def derive_tail(conn, ticker: str, since: datetime, timeframes=None,
+                until: datetime | None = None) -> int:
+    """
+    Пересчитывает производные таймфреймы из M1 начиная с бара, содержащего since.
+    Читаются только M1 хвостового бакета самого крупного ТФ, поэтому стоимость
+    не зависит от длины истории. Вызывается в транзакции записи M1.
+    until — пересчёт только баров, содержащих [since, until] (глубокая догрузка истории).
+    Бар, внутри которого начинается история M1 серии, не пишется — M1 покрывает его
+    не целиком (первичная загрузка — 1000 M1, около 16 ч). Более раннюю часть серии
+    даёт нативная история FXOpen (data_ingestion_ws.load_native_history), пока
+    глубокая догрузка (core/deep_backfill.py) не дотянет M1 до неё.
+    Возвращает число добавленных производных баров.
+    """
+    timeframes = timeframes or DERIVED_TIMEFRAMES
+    since = pd.Timestamp(since).to_pydatetime()
+    tail_starts = {tf: bar_open(since, tf) for tf in timeframes}
+
+    query = """
+        SELECT ticker, timeframe, datetime, open, high, low, close, volume
+        FROM instrument_quotes
+        WHERE ticker = :ticker AND timeframe = :tf AND datetime >= :start
+    """
+    params = {"ticker": ticker, "tf": BASE_TIMEFRAME, "start": min(tail_starts.values())}
+    if until is not None:
+        until = pd.Timestamp(until).to_pydatetime()
+        query += " AND datetime < :end"
+        params["end"] = max(next_bar_close(until, tf) for tf in timeframes)
+    base = pd.read_sql(text(query + " ORDER BY datetime"), conn, params=params)
+    if base.empty:
+        return 0
+
+    first_m1 = pd.Timestamp(conn.execute(text("""
+        SELECT MIN(datetime) FROM instrument_quotes WHERE ticker = :ticker AND timeframe = :tf
+    """), {"ticker": ticker, "tf": BASE_TIMEFRAME}).scalar())
+    frames = []
+    for tf in timeframes:
+        tail = base[base["datetime"] >= tail_starts[tf]]
+        if not tail.empty:
+            frame = resample_frame(tail, tf)
+            frames.append(frame[frame["datetime"] >= first_m1])
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=QUOTE_COLUMNS)
+    return copy_quotes(conn, df, on_conflict="update")
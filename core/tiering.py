@@ -0,0 +1,595 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import quote, unquote
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.database import engine, is_partitioned, quote_partition_specs, quote_partition_name
+from core.quotes_writer import copy_quotes, _ensure_schema, QUOTE_COLUMNS
+from core.resampler import resample_frame
+
+# Конфигурация
+
+load_dotenv()
+
+
+def _parse_policy(value: str) -> dict:
+    """"M1=6,M5=12" → {"M1": 6, "M5": 12} — сколько месяцев таймфрейм остаётся в Postgres."""
+    return {tf.strip(): int(months) for tf, months in
+            (item.split("=") for item in value.split(",") if item.strip())}
+
+
+TIER_HOT_MONTHS = _parse_policy(os.getenv("TIER_HOT_MONTHS", "M1=6,M5=12,M15=24"))
+TIER_ROLLUP_M1_MONTHS = int(os.getenv("TIER_ROLLUP_M1_MONTHS", "0"))   # 0 — M1 не сворачивается в M5
+TIER_ARCHIVE_DIR = os.getenv("TIER_ARCHIVE_DIR", os.path.join("archive", "quotes"))
+TIER_FLOAT32 = os.getenv("TIER_FLOAT32", "1") == "1"
+TIER_CACHE_MB = float(os.getenv("TIER_CACHE_MB", "64"))   # декодированные архивы серий в памяти
+
+ARCHIVE_VERSION = 1
+VALUE_COLUMNS = ["open", "high", "low", "close", "volume"]
+_MAX_DECIMALS = 8
+_NS = 1_000_000_000
+TIERING_LOCK_KEY = 720_311_502   # pg_try_advisory_lock: один перенос в архив за раз
+
+
+# Многоуровневое хранение котировок
+#
+# Свежие бары — в Postgres (горячий уровень). Месяцы старше TIER_HOT_MONTHS[tf]
+# переносятся в сжатые колоночные архивы <TIER_ARCHIVE_DIR>/<tf>/<YYYY_MM>/<ticker>.npz —
+# по файлу на серию, так что график одного тикера читает только свой файл:
+#   - время — первая метка + дельты в секундах (int32, почти константы — сжимаются в ноль);
+#   - цены — float32, если они восстанавливаются точно после округления
+#     до собственной точности котировки (decimals), иначе float64;
+#   - deflate (np.savez_compressed).
+# Декодированные файлы держит LRU, ограниченный TIER_CACHE_MB, а не числом месяцев.
+# Перенос идёт в одной транзакции с очисткой месяца: архив пишется в <месяц>.tmp и проверяется
+# чтением до удаления строк, регистрация в quote_archives коммитится вместе с очисткой,
+# а каталог месяца подменяется staging-каталогом только после коммита. Прерванную подмену
+# доводит следующий запуск (_recover_archives). Секции месяцев
+# не удаляются (TRUNCATE), поэтому кэш секций у писателей остаётся верным, а догрузка
+# в архивный месяц просто попадает в горячий уровень и сливается при следующем переносе.
+# Чтение (read_archived, read_quotes_tiered) прозрачно дополняет горячие бары архивными.
+
+
+# Формат архива
+
+def _decimals(values: np.ndarray) -> np.ndarray:
+    """Точность котировки по каждому столбцу: минимум знаков, при котором округление ничего не меняет."""
+    result = np.full(values.shape[1], _MAX_DECIMALS, dtype=np.int8)
+    finite = np.nan_to_num(values)
+    for col in range(values.shape[1]):
+        for d in range(_MAX_DECIMALS + 1):
+            if np.allclose(np.round(finite[:, col], d), finite[:, col], rtol=1e-12, atol=0):
+                result[col] = d
+                break
+    return result
+
+
+def _float32_lossless(values: np.ndarray, decimals: np.ndarray) -> bool:
+    restored = values.astype(np.float32).astype(np.float64)
+    for col, d in enumerate(decimals):
+        a, b = np.round(restored[:, col], d), np.round(values[:, col], d)
+        if not np.array_equal(a, b, equal_nan=True):
+            return False
+    return True
+
+
+def encode_archive(df: pd.DataFrame, allow_float32: bool = TIER_FLOAT32) -> dict:
+    """Бары (QUOTE_COLUMNS одного ТФ) → массивы архива."""
+    df = df.sort_values(["ticker", "datetime"], kind="stable")
+    codes, tickers = pd.factorize(df["ticker"], sort=True)
+    counts = np.bincount(codes, minlength=len(tickers)).astype(np.int64)
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+    ts = df["datetime"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    values = df[VALUE_COLUMNS].to_numpy(dtype=np.float64, na_value=np.nan)
+
+    deltas = np.diff(ts, prepend=0) // _NS
+    deltas[starts] = 0   # первая метка каждой серии — в ts_first
+    decimals = np.stack([_decimals(values[s:s + n]) for s, n in zip(starts, counts)])
+    use_float32 = allow_float32 and all(
+        _float32_lossless(values[s:s + n], decimals[i]) for i, (s, n) in enumerate(zip(starts, counts))
+    )
+    return {
+        "version": np.array(ARCHIVE_VERSION),
+        "tickers": np.array(tickers, dtype=str),
+        "counts": counts,
+        "ts_first": ts[starts],
+        "ts_delta": deltas.astype(np.int32),
+        # По столбцам: у соседних баров близкие значения, deflate сжимает столбец лучше строк
+        "values": np.ascontiguousarray(values.T.astype(np.float32 if use_float32 else np.float64)),
+        "decimals": decimals,
+    }
+
+
+def decode_archive(data, ticker: str | None = None) -> pd.DataFrame:
+    """Массивы архива → DataFrame (QUOTE_COLUMNS без timeframe), все серии или одна."""
+    tickers, counts = data["tickers"], data["counts"]
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+    if ticker is not None:
+        i = int(np.searchsorted(tickers, ticker))
+        if i == len(tickers) or tickers[i] != ticker:
+            return pd.DataFrame(columns=["ticker", "datetime"] + VALUE_COLUMNS)
+        selected = [i]
+    else:
+        selected = range(len(tickers))
+
+    frames = []
+    values_all, deltas_all = data["values"], data["ts_delta"]
+    for i in selected:
+        s, n = starts[i], counts[i]
+        deltas = deltas_all[s:s + n].astype(np.int64) * _NS
+        deltas[0] = 0
+        values = values_all[:, s:s + n].T.astype(np.float64)
+        for col, d in enumerate(data["decimals"][i]):
+            values[:, col] = np.round(values[:, col], d)
+        frame = pd.DataFrame(values, columns=VALUE_COLUMNS)
+        frame.insert(0, "datetime", (data["ts_first"][i] + np.cumsum(deltas)).astype("datetime64[ns]"))
+        frame.insert(0, "ticker", tickers[i])
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=["ticker", "datetime"] + VALUE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _archive_name(timeframe: str, suffix: str) -> str:
+    """Каталог месяца относительно TIER_ARCHIVE_DIR (quote_archives.path)."""
+    return os.path.join(timeframe, suffix)
+
+
+def _ticker_file(ticker: str) -> str:
+    return f"{quote(ticker, safe='')}.npz"
+
+
+def _is_legacy(name: str) -> bool:
+    # Архивы прежнего формата: все серии месяца в одном <YYYY_MM>.npz
+    return name.endswith(".npz")
+
+
+def _read_npz(path: str) -> dict:
+    with np.load(os.path.join(TIER_ARCHIVE_DIR, path)) as f:
+        return {key: f[key] for key in f.files}
+
+
+def _write_archive(name: str, df: pd.DataFrame) -> tuple:
+    """Пишет месяц в каталог name по файлу на серию; возвращает (байт на диске, все ли серии в float32)."""
+    path = os.path.join(TIER_ARCHIVE_DIR, name)
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    size, float32 = 0, True
+    for ticker, series in df.groupby("ticker", sort=True):
+        data = encode_archive(series)
+        file = os.path.join(path, _ticker_file(ticker))
+        with open(file, "wb") as f:
+            np.savez_compressed(f, **data)
+        size += os.path.getsize(file)
+        float32 &= data["values"].dtype == np.float32
+    return size, float32
+
+
+def _publish_archive(staging: str, name: str):
+    """Подменяет каталог месяца проверенным staging-каталогом."""
+    final = os.path.join(TIER_ARCHIVE_DIR, name)
+    old = f"{final}.old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(final):
+        os.replace(final, old)
+    os.replace(os.path.join(TIER_ARCHIVE_DIR, staging), final)
+    shutil.rmtree(old, ignore_errors=True)
+    _cache.drop(name)
+
+
+class _ArchiveCache:
+    """LRU декодированных файлов архива, ограниченный суммарным объёмом массивов, а не числом файлов."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()   # путь -> (массивы, байт)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> dict:
+        with self._lock:
+            if path in self._items:
+                self._items.move_to_end(path)
+                return self._items[path][0]
+        data = _read_npz(path)
+        size = sum(a.nbytes for a in data.values())
+        with self._lock:
+            if path not in self._items and size <= self.max_bytes:
+                self._items[path] = (data, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (_, dropped) = self._items.popitem(last=False)
+                    self._bytes -= dropped
+        return data
+
+    def drop(self, name: str):
+        """Забывает файлы месяца name (после перезаписи архива)."""
+        prefix = os.path.join(name, "")
+        with self._lock:
+            for path in [p for p in self._items if p == name or p.startswith(prefix)]:
+                self._bytes -= self._items.pop(path)[1]
+
+
+_cache = _ArchiveCache(int(TIER_CACHE_MB * 2**20))
+
+
+def _load_archive(name: str, ticker: str) -> dict | None:
+    """Массивы архива серии за месяц name; None — серии в этом месяце нет."""
+    if _is_legacy(name):
+        return _cache.get(name)
+    path = os.path.join(name, _ticker_file(ticker))
+    if not os.path.exists(os.path.join(TIER_ARCHIVE_DIR, path)):
+        return None
+    return _cache.get(path)
+
+
+def _archive_tickers(name: str) -> list:
+    if _is_legacy(name):
+        return list(_cache.get(name)["tickers"])
+    return sorted(unquote(f[:-len(".npz")]) for f in os.listdir(os.path.join(TIER_ARCHIVE_DIR, name))
+                  if f.endswith(".npz"))
+
+
+def _read_month(name: str) -> pd.DataFrame:
+    """Все серии месяца прямо с диска, минуя кэш (проверка свежезаписанного архива)."""
+    path = os.path.join(TIER_ARCHIVE_DIR, name)
+    frames = [decode_archive(_read_npz(os.path.join(name, f))) for f in sorted(os.listdir(path))
+              if f.endswith(".npz")]
+    if not frames:
+        return pd.DataFrame(columns=["ticker", "datetime"] + VALUE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _same_bars(restored: pd.DataFrame, df: pd.DataFrame) -> bool:
+    """Совпадают ли бары архива с исходными: тикеры, метки времени и значения по строкам."""
+    if len(restored) != len(df):
+        return False
+    restored = restored.sort_values(["ticker", "datetime"], ignore_index=True)
+    df = df.sort_values(["ticker", "datetime"], ignore_index=True)
+    return (np.array_equal(restored["ticker"].to_numpy(str), df["ticker"].to_numpy(str))
+            and np.array_equal(restored["datetime"].to_numpy("datetime64[ns]"),
+                               df["datetime"].to_numpy("datetime64[ns]"))
+            and np.allclose(restored[VALUE_COLUMNS].to_numpy(float), df[VALUE_COLUMNS].to_numpy(float),
+                            rtol=1e-6, equal_nan=True))
+
+
+# Прозрачное чтение
+
+def read_archived(conn, timeframe: str, tickers=None, start=None, end=None) -> pd.DataFrame:
+    """
+    Бары из архивов за [start, end): QUOTE_COLUMNS без timeframe, по (ticker, datetime).
+    Открываются только файлы нужных тикеров за месяцы, пересекающие диапазон.
+    """
+    query = "SELECT path FROM quote_archives WHERE timeframe = :tf"
+    params = {"tf": timeframe}
+    if start is not None:
+        query += " AND period_end > :start"
+        params["start"] = pd.Timestamp(start).to_pydatetime()
+    if end is not None:
+        query += " AND period_start < :end"
+        params["end"] = pd.Timestamp(end).to_pydatetime()
+    if tickers is not None:
+        tickers = list(tickers)
+        query += " AND tickers && CAST(:tickers AS text[])"
+        params["tickers"] = tickers
+    names = [r[0] for r in conn.execute(text(query + " ORDER BY period_start"), params)]
+    return read_archive_files(names, tickers, start, end)
+
+
+def read_archive_files(names, tickers=None, start=None, end=None) -> pd.DataFrame:
+    """Декодирует перечисленные архивы (из quote_archives.path) и режет по тикерам и [start, end)."""
+    if tickers is not None:
+        tickers = list(tickers)
+    frames = []
+    for name in names:
+        try:
+            for ticker in (tickers if tickers is not None else _archive_tickers(name)):
+                data = _load_archive(name, ticker)
+                if data is not None:
+                    frames.append(decode_archive(data, ticker))
+        except OSError as e:
+            print(f"[tiering] Архив {name} недоступен: {e}")
+    columns = ["ticker", "datetime"] + VALUE_COLUMNS
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(frames, ignore_index=True)
+    if start is not None:
+        df = df[df["datetime"] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df["datetime"] < pd.Timestamp(end)]
+    return df.sort_values(["ticker", "datetime"], ignore_index=True)[columns]
+
+
+def merge_tiers(archived: pd.DataFrame, hot: pd.DataFrame, keys=("ticker", "datetime")) -> pd.DataFrame:
+    """Склеивает архивные и горячие бары; при совпадении ключа побеждает горячий бар."""
+    if archived.empty:
+        return hot
+    if hot.empty:
+        return archived.reset_index(drop=True)
+    df = pd.concat([archived, hot], ignore_index=True)
+    return df.drop_duplicates(list(keys), keep="last").sort_values(list(keys), ignore_index=True)
+
+
+def read_quotes_tiered(conn, ticker: str, timeframe: str, start=None, end=None) -> pd.DataFrame:
+    """Серия (datetime + VALUE_COLUMNS) из обоих уровней."""
+    query = f"""
+        SELECT datetime, {", ".join(VALUE_COLUMNS)} FROM instrument_quotes
+        WHERE ticker = :ticker AND timeframe = :tf
+    """
+    params = {"ticker": ticker, "tf": timeframe}
+    if start is not None:
+        query += " AND datetime >= :start"
+        params["start"] = pd.Timestamp(start).to_pydatetime()
+    if end is not None:
+        query += " AND datetime < :end"
+        params["end"] = pd.Timestamp(end).to_pydatetime()
+    hot = pd.read_sql(text(query + " ORDER BY datetime"), conn, params=params)
+    archived = read_archived(conn, timeframe, [ticker], start, end).drop(columns="ticker")
+    return merge_tiers(archived, hot, keys=("datetime",))
+
+
+def archived_until(conn, timeframe: str):
+    """Конец последнего архивного месяца ТФ: раньше него бары живут в архиве, а не в Postgres."""
+    return conn.execute(text("SELECT MAX(period_end) FROM quote_archives WHERE timeframe = :tf"),
+                        {"tf": timeframe}).scalar()
+
+
+def first_archived(conn, ticker: str, timeframe: str):
+    """Начало самого раннего архивного месяца, где есть серия (None — серия не архивировалась)."""
+    return conn.execute(text("""
+        SELECT MIN(period_start) FROM quote_archives
+        WHERE timeframe = :tf AND :ticker = ANY(tickers)
+    """), {"tf": timeframe, "ticker": ticker}).scalar()
+
+
+# Перенос месяцев в архив
+
+def _cutoff(months: int, now: datetime) -> datetime:
+    total = now.year * 12 + now.month - 1 - months
+    return datetime(total // 12, total % 12 + 1, 1)
+
+
+def _lock_period(conn, timeframe: str, suffix: str) -> str | None:
+    """Блокирует запись в месяц (чтение остаётся доступным); имя секции или None без секционирования."""
+    if is_partitioned(conn):
+        partition = quote_partition_name(timeframe, suffix)
+        if conn.execute(text("SELECT to_regclass(:p) IS NOT NULL"), {"p": partition}).scalar():
+            conn.execute(text(f"LOCK TABLE {partition} IN EXCLUSIVE MODE"))
+            return partition
+    conn.execute(text("LOCK TABLE instrument_quotes IN SHARE ROW EXCLUSIVE MODE"))
+    return None
+
+
+def _clear_period(conn, partition: str | None, timeframe: str, lo: datetime, hi: datetime):
+    if partition:
+        conn.execute(text(f"TRUNCATE {partition}"))
+    else:
+        conn.execute(text("""
+            DELETE FROM instrument_quotes WHERE timeframe = :tf AND datetime >= :lo AND datetime < :hi
+        """), {"tf": timeframe, "lo": lo, "hi": hi})
+
+
+def _hot_bytes(conn, partition: str | None, timeframe: str, lo: datetime, hi: datetime) -> int:
+    if partition:
+        return conn.execute(text("SELECT pg_total_relation_size(:p)"), {"p": partition}).scalar()
+    return conn.execute(text("""
+        SELECT COALESCE(SUM(pg_column_size(q.*)), 0) FROM instrument_quotes q
+        WHERE timeframe = :tf AND datetime >= :lo AND datetime < :hi
+    """), {"tf": timeframe, "lo": lo, "hi": hi}).scalar()
+
+
+def rollup_period(timeframe: str, suffix: str, lo: datetime, hi: datetime, target: str = "M5") -> int:
+    """Сворачивает месяц M1 в M5 (существующие бары M5 не трогаются) и удаляет M1 за месяц."""
+    with engine.begin() as conn:
+        partition = _lock_period(conn, timeframe, suffix)
+        df = pd.read_sql(text(f"""
+            SELECT {", ".join(QUOTE_COLUMNS)} FROM instrument_quotes
+            WHERE timeframe = :tf AND datetime >= :lo AND datetime < :hi
+        """), conn, params={"tf": timeframe, "lo": lo, "hi": hi})
+        if df.empty:
+            return 0
+        frames = [resample_frame(series, target) for _, series in df.groupby("ticker")]
+        written = copy_quotes(conn, pd.concat(frames, ignore_index=True), on_conflict="nothing")
+        _clear_period(conn, partition, timeframe, lo, hi)
+    print(f"🗜 {timeframe} {suffix}: {len(df)} баров свёрнуто в {target} (+{written})")
+    return len(df)
+
+
+def archive_period(timeframe: str, suffix: str, lo: datetime, hi: datetime) -> dict | None:
+    """Переносит месяц ТФ в архив; если архив месяца уже есть — сливает с ним догруженные бары."""
+    name = _archive_name(timeframe, suffix)
+    staging = f"{name}.tmp"
+    try:
+        with engine.begin() as conn:
+            partition = _lock_period(conn, timeframe, suffix)
+            hot_bytes = _hot_bytes(conn, partition, timeframe, lo, hi)
+            started = time.perf_counter()
+            hot = pd.read_sql(text(f"""
+                SELECT ticker, datetime, {", ".join(VALUE_COLUMNS)} FROM instrument_quotes
+                WHERE timeframe = :tf AND datetime >= :lo AND datetime < :hi
+                ORDER BY ticker, datetime
+            """), conn, params={"tf": timeframe, "lo": lo, "hi": hi})
+            hot_ms = (time.perf_counter() - started) * 1000
+            if hot.empty:
+                return None
+
+            previous = conn.execute(text("""
+                SELECT path FROM quote_archives WHERE timeframe = :tf AND period_start = :lo
+            """), {"tf": timeframe, "lo": lo}).scalar()
+            df = merge_tiers(read_archive_files([previous]), hot) if previous else hot
+            archive_bytes, float32 = _write_archive(staging, df)
+
+            # Проверка до удаления строк: архив читается обратно и сравнивается с источником
+            started = time.perf_counter()
+            restored = _read_month(staging)
+            archive_ms = (time.perf_counter() - started) * 1000
+            if not _same_bars(restored, df):
+                raise RuntimeError(f"Архив {name} не совпал с исходными барами — месяц оставлен в Postgres")
+
+            # При повторном переносе hot_bytes — весь слитый месяц по объёму строки первого замера:
+            # сумма замеров с накладными расходами почти пустой секции завышала бы коэффициент сжатия
+            conn.execute(text("""
+                INSERT INTO quote_archives (timeframe, period_start, period_end, path, tickers, rows,
+                                            hot_bytes, archive_bytes, float32, hot_read_ms, archive_read_ms,
+                                            archived_at)
+                VALUES (:tf, :lo, :hi, :path, :tickers, :rows, :hot_bytes, :archive_bytes, :float32,
+                        :hot_ms, :archive_ms, timezone('utc', now()))
+                ON CONFLICT (timeframe, period_start) DO UPDATE
+                SET path = EXCLUDED.path, tickers = EXCLUDED.tickers, rows = EXCLUDED.rows,
+                    hot_bytes = quote_archives.hot_bytes * EXCLUDED.rows / GREATEST(quote_archives.rows, 1),
+                    archive_bytes = EXCLUDED.archive_bytes, float32 = EXCLUDED.float32,
+                    hot_read_ms = EXCLUDED.hot_read_ms, archive_read_ms = EXCLUDED.archive_read_ms,
+                    archived_at = EXCLUDED.archived_at
+            """), {"tf": timeframe, "lo": lo, "hi": hi, "path": name,
+                   "tickers": sorted(df["ticker"].unique()), "rows": len(df), "hot_bytes": hot_bytes,
+                   "archive_bytes": archive_bytes, "float32": bool(float32),
+                   "hot_ms": hot_ms, "archive_ms": archive_ms})
+            _clear_period(conn, partition, timeframe, lo, hi)
+    except Exception:
+        # Транзакция откатилась — прежний каталог месяца и строки Postgres остаются как были
+        shutil.rmtree(os.path.join(TIER_ARCHIVE_DIR, staging), ignore_errors=True)
+        raise
+
+    # Строки месяца удалены и архив зарегистрирован — теперь подменяем каталог
+    _publish_archive(staging, name)
+    if previous and previous != name:
+        # Месяц переписан в новый формат — старый общий файл больше не нужен
+        os.remove(os.path.join(TIER_ARCHIVE_DIR, previous))
+        _cache.drop(previous)
+
+    print(f"📦 {timeframe} {suffix}: {len(df)} баров, {hot_bytes / 2**20:.1f} МБ → "
+          f"{archive_bytes / 2**20:.2f} МБ ({'float32' if float32 else 'float64'}), "
+          f"чтение {hot_ms:.0f} → {archive_ms:.0f} мс")
+    return {"rows": len(df), "hot_bytes": hot_bytes, "archive_bytes": archive_bytes}
+
+
+def _recover_archives():
+    """
+    Доводит подмены каталогов, прерванные падением процесса: <месяц>.old возвращается
+    на место, если каталог месяца пропал; <месяц>.tmp публикуется, если его перенос
+    закоммичен (в quote_archives столько же баров), иначе удаляется.
+    """
+    if not os.path.isdir(TIER_ARCHIVE_DIR):
+        return
+    with engine.connect() as conn:
+        registered = dict(conn.execute(text("SELECT path, rows FROM quote_archives")).all())
+    for tf in sorted(os.listdir(TIER_ARCHIVE_DIR)):
+        if not os.path.isdir(os.path.join(TIER_ARCHIVE_DIR, tf)):
+            continue
+        entries = sorted(os.listdir(os.path.join(TIER_ARCHIVE_DIR, tf)))
+        for entry in (e for e in entries if e.endswith(".old")):
+            old, final = os.path.join(TIER_ARCHIVE_DIR, tf, entry), os.path.join(TIER_ARCHIVE_DIR, tf, entry[:-4])
+            if os.path.exists(final):
+                shutil.rmtree(old, ignore_errors=True)
+            else:
+                os.replace(old, final)
+        for entry in (e for e in entries if e.endswith(".tmp")):
+            staging, name = os.path.join(tf, entry), os.path.join(tf, entry[:-4])
+            try:
+                committed = registered.get(name) == len(_read_month(staging))
+            except Exception:
+                committed = False   # staging не дописан — транзакция до коммита не дошла
+            if committed:
+                _publish_archive(staging, name)
+                print(f"♻️ {name}: завершена прерванная публикация архива")
+            else:
+                shutil.rmtree(os.path.join(TIER_ARCHIVE_DIR, staging), ignore_errors=True)
+                print(f"🧹 {name}: удалён незакоммиченный staging-каталог")
+
+
+def _hot_periods(timeframe: str, before: datetime):
+    """Месяцы ТФ раньше before, в которых ещё есть строки в Postgres."""
+    with engine.connect() as conn:
+        first = conn.execute(text("SELECT MIN(datetime) FROM instrument_quotes WHERE timeframe = :tf"),
+                             {"tf": timeframe}).scalar()
+        if first is None or first >= before:
+            return []
+        periods = []
+        for suffix, lo, hi in quote_partition_specs(timeframe, first, before):
+            if hi > before:
+                break
+            if conn.execute(text("""
+                SELECT EXISTS (SELECT 1 FROM instrument_quotes
+                               WHERE timeframe = :tf AND datetime >= :lo AND datetime < :hi)
+            """), {"tf": timeframe, "lo": lo, "hi": hi}).scalar():
+                periods.append((suffix, lo, hi))
+        return periods
+
+
+def apply_policy(policy: dict = TIER_HOT_MONTHS, rollup_months: int = TIER_ROLLUP_M1_MONTHS,
+                 dry_run: bool = False):
+    """Сворачивает очень старый M1 в M5 и переносит в архив месяцы старше горячего окна."""
+    with engine.begin() as conn:
+        _ensure_schema(conn)
+    with engine.connect() as guard:
+        # Второй перенос параллельно принял бы чужой staging-каталог за брошенный
+        if not guard.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": TIERING_LOCK_KEY}).scalar():
+            print("⏳ Перенос в архив уже выполняется другим процессом")
+            return
+        try:
+            if not dry_run:
+                _recover_archives()
+            now = datetime.utcnow()
+            if rollup_months:
+                for suffix, lo, hi in _hot_periods("M1", _cutoff(rollup_months, now)):
+                    print(f"🗜 M1 {suffix} → M5" + (" (dry-run)" if dry_run else ""))
+                    if not dry_run:
+                        rollup_period("M1", suffix, lo, hi)
+            for tf, months in policy.items():
+                for suffix, lo, hi in _hot_periods(tf, _cutoff(months, now)):
+                    if dry_run:
+                        print(f"📦 {tf} {suffix} → архив (dry-run)")
+                        continue
+                    try:
+                        archive_period(tf, suffix, lo, hi)
+                    except Exception as e:
+                        print(f"❌ {tf} {suffix}: {e}")
+        finally:
+            guard.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": TIERING_LOCK_KEY})
+
+
+# Отчёт
+
+def report() -> pd.DataFrame:
+    """Экономия места и задержка чтения месяца: Postgres против архива, по таймфреймам."""
+    with engine.connect() as conn:
+        df = pd.read_sql(text("""
+            SELECT timeframe, COUNT(*) AS months, SUM(rows) AS rows,
+                   SUM(hot_bytes) AS hot_bytes, SUM(archive_bytes) AS archive_bytes,
+                   SUM(CASE WHEN float32 THEN 1 ELSE 0 END) AS float32_months,
+                   AVG(hot_read_ms) AS hot_read_ms, AVG(archive_read_ms) AS archive_read_ms
+            FROM quote_archives GROUP BY timeframe ORDER BY timeframe
+        """), conn)
+    if df.empty:
+        print("ℹ️ Архивов пока нет.")
+        return df
+    df["ratio"] = df["hot_bytes"] / df["archive_bytes"].clip(lower=1)
+    for r in df.itertuples():
+        print(f"📊 {r.timeframe}: {r.months} мес., {int(r.rows):,} баров | "
+              f"{r.hot_bytes / 2**20:,.1f} МБ → {r.archive_bytes / 2**20:,.1f} МБ (×{r.ratio:.1f}, "
+              f"float32 {r.float32_months}/{r.months}) | "
+              f"чтение месяца {r.hot_read_ms:.0f} мс → {r.archive_read_ms:.0f} мс")
+    saved = df["hot_bytes"].sum() - df["archive_bytes"].sum()
+    print(f"💾 Освобождено в Postgres: {saved / 2**20:,.1f} МБ")
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Перенос старых баров в сжатый архив")
+    parser.add_argument("--dry-run", action="store_true", help="только показать, что будет перенесено")
+    parser.add_argument("--report", action="store_true", help="только отчёт по архивам")
+    args = parser.parse_args()
+    if not args.report:
+        apply_policy(dry_run=args.dry_run)
+    report()
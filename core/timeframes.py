@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+# Длительность бара по таймфрейму FXOpen
+
+TIMEFRAME_DELTAS = {
+    "M1": timedelta(minutes=1),
+    "M5": timedelta(minutes=5),
+    "M15": timedelta(minutes=15),
+    "M30": timedelta(minutes=30),
+    "H1": timedelta(hours=1),
+    "H4": timedelta(hours=4),
+    "D1": timedelta(days=1),
+    "W1": timedelta(weeks=1),
+}
+
+DEFAULT_DELTA = timedelta(hours=1)
+
+_EPOCH = datetime(1970, 1, 1)
+# Недельные бары FXOpen начинаются с понедельника, а 1970-01-01 — четверг
+_WEEK_ORIGIN = datetime(1970, 1, 5)
+
+
+def timeframe_delta(timeframe: str) -> timedelta:
+    return TIMEFRAME_DELTAS.get(timeframe, DEFAULT_DELTA)
+
+
+def bar_open(dt: datetime, timeframe: str) -> datetime:
+    """Время открытия бара, в который попадает dt (UTC, без tzinfo)."""
+    if timeframe == "MN1":
+        return datetime(dt.year, dt.month, 1)
+    origin = _WEEK_ORIGIN if timeframe == "W1" else _EPOCH
+    delta = timeframe_delta(timeframe)
+    return origin + ((dt - origin) // delta) * delta
+
+
+def next_bar_close(dt: datetime, timeframe: str) -> datetime:
+    """Момент закрытия бара, в который попадает dt, — когда у серии появится новый бар."""
+    if timeframe == "MN1":
+        start = bar_open(dt, timeframe)
+        return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return bar_open(dt, timeframe) + timeframe_delta(timeframe)
@@ -0,0 +1,143 @@
+import json
+import time
+import asyncio
+import websockets
+from uuid import uuid4
+from data_providers.fxopen_session import (
+    FXOPEN_API_ID, FXOPEN_API_KEY, FXOPEN_API_SECRET, FXOPEN_AUTH_TYPE, WS_URL,
+    RECV_TIMEOUT, create_signature, FXOpenAuthError, FXOpenRequestError
+)
+from data_providers.fxopen_bars import loads
+from core.metrics import REQUEST_SECONDS
+
+MAX_IN_FLIGHT = 32   # одновременных запросов на одно соединение
+
+
+class AsyncFXOpenClient:
+    """Асинхронный клиент фида FXOpen с конвейеризацией запросов.
+
+    Все запросы идут по одному сокету без ожидания друг друга, а фоновая
+    задача-читатель раздаёт ответы ожидающим futures по полю Id.
+    Сообщения без ожидающего запроса передаются в обработчики add_handler().
+    """
+
+    def __init__(self, url: str = WS_URL, max_in_flight: int = MAX_IN_FLIGHT,
+                 device_id: str = "DELTA_PORTFOLIO_APP", app_session_id: str = "ASYNC_CLIENT"):
+        self.url = url
+        self.device_id = device_id
+        self.app_session_id = app_session_id
+        self.ws = None
+        self._reader = None
+        self._pending: dict[str, asyncio.Future] = {}
+        self._handlers = []
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._connect_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def connected(self) -> bool:
+        return self.ws is not None and self._reader is not None and not self._reader.done()
+
+    def add_handler(self, handler):
+        """Подписка на сообщения сервера, не являющиеся ответом на запрос."""
+        self._handlers.append(handler)
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self.connected:
+                return
+            self.ws = await websockets.connect(self.url, ping_interval=None, max_size=None)
+            self._reader = asyncio.create_task(self._read_loop())
+            await self._login()
+
+    async def _login(self):
+        timestamp = int(time.time() * 1000)
+        signature = create_signature(timestamp, FXOPEN_API_ID, FXOPEN_API_KEY, FXOPEN_API_SECRET)
+        response = await self._send("Login", {
+            "AuthType": FXOPEN_AUTH_TYPE,
+            "WebApiId": FXOPEN_API_ID,
+            "WebApiKey": FXOPEN_API_KEY,
+            "Timestamp": timestamp,
+            "Signature": signature,
+            "DeviceId": self.device_id,
+            "AppSessionId": self.app_session_id
+        }, RECV_TIMEOUT)
+        if response.get("Response") != "Login" or response.get("Result", {}).get("Info") != "ok":
+            await self.close()
+            raise FXOpenAuthError(f"Ошибка авторизации: {response}")
+
+    async def _read_loop(self):
+        error = ConnectionError("Соединение с FXOpen закрыто")
+        try:
+            async for raw in self.ws:
+                message = loads(raw)
+                future = self._pending.pop(message.get("Id"), None)
+                if future is not None:
+                    if not future.done():
+                        future.set_result(message)
+                    continue
+                for handler in self._handlers:
+                    try:
+                        handler(message)
+                    except Exception as e:
+                        print(f"[fxopen_async] Ошибка обработчика: {e}")
+        except Exception as e:
+            error = ConnectionError(f"Соединение с FXOpen потеряно: {e}")
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+
+    async def _send(self, name: str, params: dict, timeout: float) -> dict:
+        req_id = str(uuid4())
+        future = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = future
+        try:
+            await self.ws.send(json.dumps({"Id": req_id, "Request": name, "Params": params}))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(req_id, None)
+
+    async def request(self, name: str, params: dict, timeout: float = RECV_TIMEOUT) -> dict:
+        """Отправляет запрос, не дожидаясь ответов на предыдущие."""
+        if not self.connected:
+            await self.connect()
+        async with self._in_flight:
+            with REQUEST_SECONDS.time(provider="fxopen", request=name):
+                response = await self._send(name, params, timeout)
+        if response.get("Response") == "Error":
+            raise FXOpenRequestError(f"{name}: {response.get('Error')}")
+        return response
+
+    async def quote_history_bars(self, symbol: str, timeframe: str, **params) -> list:
+        """Бары QuoteHistoryBars (bid); params — Count и Timestamp/From."""
+        response = await self.request("QuoteHistoryBars", {
+            "Symbol": symbol,
+            "Periodicity": timeframe,
+            "PriceType": "bid",
+            **params
+        })
+        return response.get("Result", {}).get("Bars", [])
+
+    async def wait_closed(self):
+        """Ждёт разрыва соединения (для долгоживущих подписок)."""
+        if self._reader is not None:
+            await asyncio.shield(self._reader)
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self._reader is not None:
+            try:
+                await self._reader
+            except Exception:
+                pass
+        self.ws = None
+        self._reader = None
@@ -0,0 +1,150 @@
+import json
+import time
+import numpy as np
+import pandas as pd
+from operator import itemgetter
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:   # orjson не установлен — стандартный декодер
+    orjson = None
+    loads = json.loads
+
+BAR_FIELDS = ("Timestamp", "Open", "High", "Low", "Close", "Volume")
+_get_fields = itemgetter(*BAR_FIELDS)
+
+
+# Разбор страницы QuoteHistoryBars
+
+def parse_bars(bars: list):
+    """
+    Бары FXOpen → колонки NumPy без промежуточных DataFrame.
+    Возвращает (ts_ms int64, values float64 формы (n, 5): open, high, low, close, volume).
+    Метки в миллисекундах точно представимы в float64, поэтому страница
+    собирается одним проходом в общий массив.
+    """
+    try:
+        rows = np.array(list(map(_get_fields, bars)), dtype=np.float64).reshape(len(bars), len(BAR_FIELDS))
+    except KeyError:
+        # Сервер опустил поле (например, Volume у пустых баров)
+        rows = np.array([[bar.get(f, 0.0) for f in BAR_FIELDS] for bar in bars],
+                        dtype=np.float64).reshape(len(bars), len(BAR_FIELDS))
+    return rows[:, 0].astype(np.int64), rows[:, 1:]
+
+
+# Буфер страниц
+
+class BarBuffer:
+    """
+    Растущий буфер баров одной серии: страницы дописываются в заранее выделенные
+    колонки (ёмкость удваивается), DataFrame создаётся один раз в to_frame().
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.ts = np.empty(capacity, dtype=np.int64)
+        self.values = np.empty((capacity, 5), dtype=np.float64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, ts: np.ndarray, values: np.ndarray):
+        end = self.size + len(ts)
+        if end > len(self.ts):
+            capacity = max(end, 2 * len(self.ts))
+            self.ts = np.resize(self.ts, capacity)
+            self.values = np.resize(self.values, (capacity, 5))
+        self.ts[self.size:end] = ts
+        self.values[self.size:end] = values
+        self.size = end
+
+    def arrays(self):
+        """(ts_ms, values), отсортированные по времени, без повторов меток (первый бар остаётся)."""
+        ts, values = self.ts[:self.size], self.values[:self.size]
+        if self.size > 1 and not (ts[1:] > ts[:-1]).all():
+            order = np.argsort(ts, kind="stable")
+            ts, values = ts[order], values[order]
+            keep = np.r_[True, ts[1:] != ts[:-1]]
+            ts, values = ts[keep], values[keep]
+        return ts, values
+
+    def to_frame(self, symbol: str, timeframe: str) -> pd.DataFrame:
+        ts, values = self.arrays()
+        return bars_frame(ts, values, symbol, timeframe)
+
+
+def bars_frame(ts: np.ndarray, values: np.ndarray, symbol: str, timeframe: str) -> pd.DataFrame:
+    """Колонки → DataFrame в формате instrument_quotes."""
+    return pd.DataFrame({
+        "ticker": symbol,
+        "timeframe": timeframe,
+        "datetime": ts.astype("datetime64[ms]").astype("datetime64[ns]"),
+        "open": values[:, 0],
+        "high": values[:, 1],
+        "low": values[:, 2],
+        "close": values[:, 3],
+        "volume": values[:, 4],
+    })
+
+
+# Микробенчмарк
+
+def _synthetic_pages(n_pages: int, page_size: int = 1000) -> list:
+    rng = np.random.default_rng(7)
+    start = 1_600_000_000_000
+    pages = []
+    for p in range(n_pages):
+        close = 100 + rng.standard_normal(page_size).cumsum()
+        bars = [{
+            "Volume": float(rng.integers(1, 1000)),
+            "Close": float(c), "Low": float(c - 0.5), "High": float(c + 0.5), "Open": float(c + 0.1),
+            "Timestamp": start + (p * page_size + i) * 60_000,
+        } for i, c in enumerate(close)]
+        pages.append(json.dumps({"Id": "1", "Response": "QuoteHistoryBars", "Result": {"Bars": bars}}))
+    return pages
+
+
+def _pandas_path(pages: list) -> pd.DataFrame:
+    parts = []
+    for raw in pages:
+        df = pd.DataFrame(json.loads(raw)["Result"]["Bars"])
+        df["datetime"] = pd.to_datetime(df["Timestamp"], unit="ms")
+        df["ticker"] = "BENCH"
+        df["timeframe"] = "M1"
+        df.rename(columns={"Open": "open", "High": "high", "Low": "low",
+                           "Close": "close", "Volume": "volume"}, inplace=True)
+        parts.append(df[["ticker", "timeframe", "datetime", "open", "high", "low", "close", "volume"]])
+    return pd.concat(parts).drop_duplicates(subset="datetime").sort_values("datetime")
+
+
+def _columnar_path(pages: list) -> pd.DataFrame:
+    buffer = BarBuffer()
+    for raw in pages:
+        buffer.append(*parse_bars(loads(raw)["Result"]["Bars"]))
+    return buffer.to_frame("BENCH", "M1")
+
+
+def benchmark_parsers(n_pages: int = 100, repeat: int = 3):
+    """Сравнивает разбор через pandas и колоночный путь на n_pages страницах по 1000 баров."""
+    pages = _synthetic_pages(n_pages)
+    print(f"⏱ {n_pages} страниц × 1000 баров, JSON-декодер: {'orjson' if orjson else 'json'}")
+    results = {}
+    for name, parse in (("pandas", _pandas_path), ("numpy", _columnar_path)):
+        best = min(_timed(parse, pages) for _ in range(repeat))
+        results[name] = parse(pages)
+        print(f"⏱ {name:>6}: {best * 1000:.1f} мс ({n_pages * 1000 / best:,.0f} баров/с)")
+    a, b = (results[k].reset_index(drop=True) for k in ("pandas", "numpy"))
+    assert (a["datetime"].to_numpy() == b["datetime"].to_numpy()).all()
+    assert np.allclose(a[["open", "high", "low", "close", "volume"]].to_numpy(float),
+                       b[["open", "high", "low", "close", "volume"]].to_numpy())
+
+
+def _timed(fn, *args) -> float:
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    benchmark_parsers()
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import hmac
+import base64
+import hashlib
+import queue
+import threading
+from uuid import uuid4
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from websocket import create_connection, WebSocketException
+from data_providers.fxopen_bars import loads
+from core.metrics import REQUEST_SECONDS, REQUEST_RETRIES
+
+# Конфигурация
+
+load_dotenv()
+
+FXOPEN_API_ID = os.getenv("FXOPEN_API_ID")
+FXOPEN_API_KEY = os.getenv("FXOPEN_API_KEY")
+FXOPEN_API_SECRET = os.getenv("FXOPEN_API_SECRET")
+FXOPEN_AUTH_TYPE = os.getenv("FXOPEN_AUTH_TYPE", "HMAC")
+
+WS_URL = "wss://marginalttlivewebapi.fxopen.net/feed"
+
+POOL_SIZE = int(os.getenv("FXOPEN_POOL_SIZE", "4"))
+RECV_TIMEOUT = 30                 # секунд на ответ сервера
+SESSION_MAX_AGE = 30 * 60         # после этого срока сессия логинится заново
+SESSION_IDLE_TIMEOUT = 5 * 60     # простаивающее соединение сервер может закрыть
+
+# Подпись HMAC
+
+def create_signature(timestamp, api_id, api_key, secret):
+    msg = f"{timestamp}{api_id}{api_key}"
+    digest = hmac.new(secret.encode(), msg.encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+class FXOpenAuthError(Exception):
+    """Сервер отклонил Login."""
+
+
+class FXOpenRequestError(Exception):
+    """Сервер ответил на запрос сообщением Error."""
+
+
+def _is_auth_error(response: dict) -> bool:
+    text = json.dumps(response.get("Error", "")).lower()
+    return any(word in text for word in ("login", "logged", "auth", "session"))
+
+
+# Одно авторизованное соединение
+
+class FXOpenSession:
+    """Авторизованное WebSocket-соединение с фидом FXOpen."""
+
+    def __init__(self, url: str = WS_URL, device_id: str = "DELTA_PORTFOLIO_APP",
+                 app_session_id: str = "AUTO_UPDATE", rate_limiter=None):
+        self.url = url
+        self.device_id = device_id
+        self.app_session_id = app_session_id
+        self.rate_limiter = rate_limiter
+        self.ws = None
+        self.logged_in_at = 0.0
+        self.last_used = 0.0
+
+    @property
+    def is_expired(self) -> bool:
+        if self.ws is None or not self.ws.connected:
+            return True
+        now = time.time()
+        return (now - self.logged_in_at > SESSION_MAX_AGE
+                or now - self.last_used > SESSION_IDLE_TIMEOUT)
+
+    def connect(self):
+        self.close()
+        self.ws = create_connection(self.url, timeout=RECV_TIMEOUT)
+        self._login()
+
+    def _login(self):
+        timestamp = int(time.time() * 1000)
+        signature = create_signature(timestamp, FXOPEN_API_ID, FXOPEN_API_KEY, FXOPEN_API_SECRET)
+        login_id = str(uuid4())
+        login_msg = {
+            "Id": login_id,
+            "Request": "Login",
+            "Params": {
+                "AuthType": FXOPEN_AUTH_TYPE,
+                "WebApiId": FXOPEN_API_ID,
+                "WebApiKey": FXOPEN_API_KEY,
+                "Timestamp": timestamp,
+                "Signature": signature,
+                "DeviceId": self.device_id,
+                "AppSessionId": self.app_session_id
+            }
+        }
+        self.ws.send(json.dumps(login_msg))
+        response = self._recv_reply(login_id)
+        if response.get("Response") != "Login" or response.get("Result", {}).get("Info") != "ok":
+            self.close()
+            raise FXOpenAuthError(f"Ошибка авторизации: {response}")
+        self.logged_in_at = self.last_used = time.time()
+
+    def _recv_reply(self, req_id: str) -> dict:
+        # Сообщения без нашего Id (уведомления сервера) пропускаем
+        while True:
+            response = loads(self.ws.recv())
+            if response.get("Id") == req_id:
+                return response
+
+    def request(self, name: str, params: dict) -> dict:
+        """Отправляет запрос и возвращает ответ с тем же Id.
+
+        При разрыве соединения или истёкшей сессии переподключается один раз.
+        """
+        for attempt in range(2):
+            if self.is_expired:
+                self.connect()
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            req_id = str(uuid4())
+            try:
+                with REQUEST_SECONDS.time(provider="fxopen", request=name):
+                    self.ws.send(json.dumps({"Id": req_id, "Request": name, "Params": params}))
+                    response = self._recv_reply(req_id)
+            except (WebSocketException, OSError):
+                self.close()
+                if attempt:
+                    raise
+                REQUEST_RETRIES.inc(provider="fxopen", ticker=params.get("Symbol", ""))
+                continue
+
+            self.last_used = time.time()
+            if response.get("Response") == "Error":
+                if attempt == 0 and _is_auth_error(response):
+                    self.close()
+                    REQUEST_RETRIES.inc(provider="fxopen", ticker=params.get("Symbol", ""))
+                    continue
+                raise FXOpenRequestError(f"{name}: {response.get('Error')}")
+            return response
+
+    def close(self):
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except Exception:
+                pass
+        self.ws = None
+        self.logged_in_at = 0.0
+
+
+# Пул сессий
+
+class FXOpenSessionPool:
+    """Потокобезопасный пул авторизованных сессий FXOpen.
+
+    Соединения переиспользуются между запросами, так что страница истории
+    стоит одного обмена сообщениями вместо TLS-рукопожатия и Login.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, rate_limiter=None, **session_kwargs):
+        self.size = size
+        self.rate_limiter = rate_limiter
+        self.session_kwargs = session_kwargs
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def session(self, timeout: float | None = None):
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("Нет свободных сессий FXOpen")
+        try:
+            try:
+                sess = self._idle.get_nowait()
+            except queue.Empty:
+                sess = FXOpenSession(**self.session_kwargs)
+            sess.rate_limiter = self.rate_limiter
+            try:
+                yield sess
+            except FXOpenRequestError:
+                # Ошибка уровня протокола — само соединение исправно
+                self._idle.put(sess)
+                raise
+            except BaseException:
+                # Состояние соединения после ошибки неизвестно — не возвращаем его в пул
+                sess.close()
+                raise
+            self._idle.put(sess)
+        finally:
+            self._slots.release()
+
+    def request(self, name: str, params: dict) -> dict:
+        with self.session() as sess:
+            return sess.request(name, params)
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_session_pool() -> FXOpenSessionPool:
+    """Общий пул сессий процесса."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = FXOpenSessionPool()
+        return _pool
@@ -1,65 +1,140 @@
 # services/chart_service.py
 import os
 import pandas as pd
-from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
-from core.data_ingestion_ws import fetch_quote_history
+from core.database import engine
+from core.aggregates import AGGREGATE_SOURCE, uses_aggregates, read_aggregated
+from core.candle_cache import get_candle_cache, to_tuples
+from core.data_ingestion_ws import fetch_quote_history, get_last_datetime, load_native_history
+from core.quotes_writer import copy_quotes, mark_priority
+from core.resampler import DERIVE_FROM_M1, BASE_TIMEFRAME, derive_tail, source_timeframe
+from core.tiering import read_quotes_tiered, read_archived, merge_tiers
+from storage.base import STORAGE_BACKEND, default_storage
 
 load_dotenv()
 
-PG_HOST = os.getenv("PG_HOST")
-PG_PORT = os.getenv("PG_PORT")
-PG_DB = os.getenv("PG_DB")
-PG_USER = os.getenv("PG_USER")
-PG_PASSWORD = os.getenv("PG_PASSWORD")
-
-DB_URL = f"postgresql+psycopg2://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}"
-engine = create_engine(DB_URL)
-
 # === Обновление каждые 15 минут, независимо от ТФ ===
 REFRESH_PERIOD = timedelta(minutes=15)
 
+# === QUOTES_INGESTION=daemon — котировки грузит core/ingestion_daemon.py, GUI только читает БД ===
+INGESTION_DAEMON = os.getenv("QUOTES_INGESTION", "gui") == "daemon"
+
+# === STORAGE_BACKEND=duckdb|sqlite — графики читают и пишут встраиваемое хранилище (storage/) вместо Postgres ===
+EMBEDDED_STORAGE = STORAGE_BACKEND != "postgres"
+
+
+def mark_active(symbols, timeframe: str = "*", source: str = "chart"):
+    """Поднимает приоритет серий в планировщике автообновления (графики, портфель)"""
+    try:
+        with engine.begin() as conn:
+            mark_priority(conn, symbols, timeframe, source)
+    except Exception as e:
+        print(f"[chart_service] Не удалось отметить приоритет: {e}")
+
 
 def fetch_candles(symbol: str, timeframe: str):
     """Возвращает свечи (datetime, open, high, low, close, volume) с проверкой и автодогрузкой"""
+    now = datetime.utcnow()
+    if EMBEDDED_STORAGE:
+        # Без Postgres нет агрегатов, приоритетов и демона — грузим нативную серию FXOpen
+        _refresh_series(symbol, timeframe, now)
+        return read_candles(symbol, timeframe)
+
+    aggregated = uses_aggregates(timeframe)
+    mark_active([symbol], timeframe)
+    if aggregated:
+        mark_active([symbol], AGGREGATE_SOURCE)
+    if INGESTION_DAEMON:
+        # Приоритет уже отмечен — демон догрузит серию и пришлёт NOTIFY quotes_updated
+        return read_candles(symbol, timeframe)
+
+    if aggregated:
+        # === D1/W1/MN1 сворачиваются в БД из источника; нативная серия FXOpen — только старая история ===
+        _refresh_series(symbol, source_timeframe(AGGREGATE_SOURCE), now)
+        _refresh_series(symbol, timeframe, now, initial_only=True)
+    else:
+        # В режиме DERIVE_FROM_M1 из FXOpen грузится M1, а timeframe считается из него
+        src_tf = source_timeframe(timeframe)
+        _refresh_series(symbol, src_tf, now)
+        if src_tf != timeframe:
+            # Пока M1 не покрывает видимый диапазон, старые бары — из нативной истории ТФ
+            try:
+                load_native_history(symbol, timeframe)
+            except Exception as e:
+                print(f"[chart_service] Не удалось загрузить нативную историю {symbol} ({timeframe}): {e}")
+    return read_candles(symbol, timeframe)
+
+
+def _refresh_series(symbol: str, src_tf: str, now: datetime, initial_only: bool = False):
+    """Догружает серию из FXOpen: полностью, если её нет, иначе раз в REFRESH_PERIOD"""
+    # === Свежесть проверяем по водяному знаку серии — одна строка вместо всей истории ===
     try:
-        with engine.connect() as conn:
-            query = text("""
-                SELECT datetime, open, high, low, close, volume
-                FROM instrument_quotes
-                WHERE ticker = :symbol AND timeframe = :tf
-                ORDER BY datetime ASC
-            """)
-            df = pd.read_sql(query, conn, params={"symbol": symbol, "tf": timeframe})
+        if EMBEDDED_STORAGE:
+            last_dt = default_storage().last_bar(symbol, src_tf)
+        else:
+            last_dt = get_last_datetime(symbol, src_tf)
     except Exception as e:
         print(f"[chart_service] Ошибка при чтении из БД: {e}")
-        df = pd.DataFrame()
-
-    now = datetime.utcnow()
+        last_dt = None
 
     # === Если данных нет вообще — загружаем полную историю ===
-    if df.empty:
-        print(f"[chart_service] История отсутствует в БД для {symbol} ({timeframe}) → первичная загрузка...")
-        df_new = fetch_quote_history(symbol, timeframe)  # загрузим полные 1000 баров
-        if not df_new.empty:
-            save_to_db(df_new)
-            return _to_tuples(df_new)
-        else:
+    if last_dt is None:
+        print(f"[chart_service] История отсутствует в БД для {symbol} ({src_tf}) → первичная загрузка...")
+        df_new = fetch_quote_history(symbol, src_tf)  # загрузим полные 1000 баров
+        if df_new.empty:
             print(f"[chart_service] ❌ Не удалось получить историю для {symbol}")
-            return []
+            return
+        save_to_db(df_new)
 
     # === Проверяем, пора ли обновлять (каждые 15 минут) ===
-    last_dt = df["datetime"].max()
-    if now - last_dt >= REFRESH_PERIOD:
-        print(f"[chart_service] Обновляем {symbol} ({timeframe}) с {last_dt}")
-        df_new = fetch_quote_history(symbol, timeframe, since=last_dt)
+    elif not initial_only and now - last_dt >= REFRESH_PERIOD:
+        print(f"[chart_service] Обновляем {symbol} ({src_tf}) с {last_dt}")
+        df_new = fetch_quote_history(symbol, src_tf, since=last_dt)
         if not df_new.empty:
             save_to_db(df_new)
-            df = pd.concat([df, df_new]).drop_duplicates(subset="datetime").sort_values("datetime")
         else:
             print(f"[chart_service] ⚠️ FXOpen не вернул новых баров для {symbol}")
 
+
+def read_candles(symbol: str, timeframe: str):
+    """Читает серию: локальный кэш + из instrument_quotes только бары новее его водяного знака"""
+    if EMBEDDED_STORAGE:
+        try:
+            return _to_tuples(default_storage().read_quotes(symbol, timeframe))
+        except Exception as e:
+            print(f"[chart_service] Ошибка при чтении из хранилища {STORAGE_BACKEND}: {e}")
+            return []
+
+    if uses_aggregates(timeframe):
+        # Несколько тысяч строк quote_aggregates — кэш на диске не нужен
+        try:
+            with engine.connect() as conn:
+                df = read_aggregated(conn, symbol, timeframe)
+                # Заархивированные месяцы нативной серии — всё, что старше склеенной
+                end = df["datetime"].iloc[0] if not df.empty else None
+                archived = read_archived(conn, timeframe, [symbol], end=end).drop(columns="ticker")
+                return _to_tuples(merge_tiers(archived, df, keys=("datetime",)))
+        except Exception as e:
+            print(f"[chart_service] Ошибка при чтении агрегатов: {e}")
+            return []
+
+    cache = get_candle_cache()
+    if cache is not None:
+        try:
+            return to_tuples(*cache.sync(symbol, timeframe))
+        except Exception as e:
+            print(f"[chart_service] Кэш свечей недоступен, читаем из БД: {e}")
+
+    try:
+        with engine.connect() as conn:
+            df = read_quotes_tiered(conn, symbol, timeframe)
+    except Exception as e:
+        print(f"[chart_service] Ошибка при чтении из БД: {e}")
+        df = pd.DataFrame()
+
+    if df.empty:
+        return []
     return _to_tuples(df)
 
 
@@ -72,32 +147,20 @@ def _to_tuples(df: pd.DataFrame):
 
 
 def save_to_db(df: pd.DataFrame):
-    """Сохраняет новые бары в instrument_quotes без дубликатов"""
+    """Сохраняет новые бары в instrument_quotes без дубликатов (COPY через staging)"""
     if df.empty:
         return
 
-    with engine.begin() as conn:
-        for ticker, tf in df[['ticker', 'timeframe']].drop_duplicates().itertuples(index=False):
-            # Получаем уже существующие даты для этого тикера и ТФ
-            existing_dates = pd.read_sql(
-                text("""
-                    SELECT datetime FROM instrument_quotes
-                    WHERE ticker = :ticker AND timeframe = :tf
-                """),
-                conn,
-                params={"ticker": ticker, "tf": tf}
-            )['datetime'].astype('datetime64[ns]')
-
-            # Фильтруем только новые строки
-            df_filtered = df[
-                (df['ticker'] == ticker) &
-                (df['timeframe'] == tf) &
-                (~df['datetime'].isin(existing_dates))
-            ]
-
-            # Записываем только уникальные
-            if not df_filtered.empty:
-                df_filtered.to_sql("instrument_quotes", conn, if_exists="append", index=False)
-                print(f"[chart_service] Добавлено {len(df_filtered)} новых баров для {ticker} ({tf})")
-            else:
-                print(f"[chart_service] Нет новых баров для {ticker} ({tf}) — пропускаем.")
+    ticker, tf = df["ticker"].iloc[0], df["timeframe"].iloc[0]
+    if EMBEDDED_STORAGE:
+        written = default_storage().write_quotes(df)
+    else:
+        with engine.begin() as conn:
+            written = copy_quotes(conn, df)
+            if DERIVE_FROM_M1 and tf == BASE_TIMEFRAME:
+                derive_tail(conn, ticker, df["datetime"].min())
+
+    if written:
+        print(f"[chart_service] Добавлено {written} новых баров для {ticker} ({tf})")
+    else:
+        print(f"[chart_service] Нет новых баров для {ticker} ({tf}) — пропускаем.")
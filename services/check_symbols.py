@@ -1,18 +1,14 @@
 import os
 import sys
 import pandas as pd
-import psycopg2
 from dotenv import load_dotenv
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from core.database import raw_connection
+
 # Настройки
 load_dotenv()
-PG_HOST = os.getenv("PG_HOST", "localhost")
-PG_PORT = os.getenv("PG_PORT", "5432")
-PG_DB = os.getenv("PG_DB", "delta_portfolio")
-PG_USER = os.getenv("PG_USER", "postgres")
-PG_PASSWORD = os.getenv("PG_PASSWORD", "1234")
 
 CSV_PATH = "data/US stocks.csv"
 
@@ -31,18 +27,9 @@ def load_csv_tickers(path: str):
 # Загрузка тикеров из базы данных
 
 def load_db_tickers():
-    conn = psycopg2.connect(
-        host=PG_HOST,
-        port=PG_PORT,
-        dbname=PG_DB,
-        user=PG_USER,
-        password=PG_PASSWORD
-    )
-    cur = conn.cursor()
-    cur.execute("SELECT ticker FROM instruments;")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    with raw_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT ticker FROM instruments;")
+        rows = cur.fetchall()
     tickers = [r[0].strip() for r in rows if r[0]]
     print(f"🗄 Найдено {len(tickers)} тикеров в таблице instruments")
     return tickers
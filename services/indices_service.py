@@ -1,42 +1,23 @@
-import os
-import hmac
-import json
-import base64
 import time
-import hashlib
 import asyncio
-import websockets
 import datetime
 from typing import Dict, List, Tuple
-from dotenv import load_dotenv
-
-# --- загрузим .env ---
-load_dotenv()
-
-FXOPEN_API_ID     = os.getenv("FXOPEN_API_ID")
-FXOPEN_API_KEY    = os.getenv("FXOPEN_API_KEY")
-FXOPEN_API_SECRET = os.getenv("FXOPEN_API_SECRET")
-FXOPEN_AUTH_TYPE  = os.getenv("FXOPEN_AUTH_TYPE", "HMAC")
-
-WS_URL = "wss://marginalttlivewebapi.fxopen.net/feed"
+from data_providers.fxopen_async import AsyncFXOpenClient
+from core import async_db
 
 INDEX_SYMBOLS = [
     "#UK100", "#J225", "#SPXm",
     "#ESX50", "#AUS200", "#HSI"
 ]
 
+# Серия M30 в БД считается свежей, если её последний бар открыт не раньше часа назад
+DB_FRESHNESS = datetime.timedelta(minutes=60)
+
 # Кэш для предотвращения лишних запросов
 _cache = {}
 _cache_time = 0
 
 
-def create_signature(timestamp: int, api_id: str, api_key: str, secret: str) -> str:
-    """Создаёт HMAC подпись (Base64 HMAC_SHA256)"""
-    raw = f"{timestamp}{api_id}{api_key}".encode("utf-8")
-    digest = hmac.new(secret.encode("utf-8"), raw, hashlib.sha256).digest()
-    return base64.b64encode(digest).decode("utf-8")
-
-
 def utc_start_of_day() -> int:
     """Возвращает таймстамп начала дня UTC в мс"""
     now = datetime.datetime.utcnow()
@@ -44,67 +25,61 @@ def utc_start_of_day() -> int:
     return int(start.timestamp() * 1000)
 
 
-async def _fetch_all_symbols() -> Dict[str, List[Tuple[str, float]]]:
-    """Единое соединение: логин + запросы для всех тикеров"""
+def _bars_to_points(bars) -> List[Tuple[str, float]]:
+    times, closes = [], []
+    for bar in bars:
+        ts_ms = bar.get("Timestamp")
+        close = bar.get("Close")
+        dt = datetime.datetime.utcfromtimestamp(ts_ms / 1000.0)
+        times.append(dt.strftime("%H:%M"))
+        closes.append(close)
+    return list(zip(times, closes))
+
+
+async def _load_from_db(start: datetime.datetime) -> Dict[str, List[Tuple[str, float]]]:
+    """Индексы, чьи серии M30 в БД свежие: водяные знаки и свечи читаются параллельно через пул asyncpg"""
     results = {}
+    try:
+        marks = await async_db.get_last_datetimes(INDEX_SYMBOLS, "M30")
+        now = datetime.datetime.utcnow()
+        fresh = [sym for sym, last in marks.items() if last is not None and now - last <= DB_FRESHNESS]
+        candles = await asyncio.gather(*(async_db.fetch_candles(sym, "M30", since=start) for sym in fresh))
+        for sym, rows in zip(fresh, candles):
+            if rows:
+                results[sym] = [(dt.strftime("%H:%M"), close) for dt, _, _, _, close in rows]
+                print(f"[indices_service] Loaded {sym} from DB: {len(rows)} bars")
+    except Exception as e:
+        print(f"[indices_service] DB read skipped: {e}")
+    finally:
+        await async_db.close_pool()
+    return results
+
+
+async def _fetch_all_symbols() -> Dict[str, List[Tuple[str, float]]]:
+    """Свежие серии — из БД; остальные — через единое соединение: все запросы сразу, ответы по Id"""
+    start_ts = utc_start_of_day()
+    results = await _load_from_db(datetime.datetime.utcfromtimestamp(start_ts / 1000))
+    symbols = [sym for sym in INDEX_SYMBOLS if sym not in results]
+    if not symbols:
+        return results
 
     try:
-        async with websockets.connect(WS_URL, ping_interval=None) as ws:
-            # 1️⃣ Авторизация один раз
-            ts = int(time.time() * 1000)
-            signature = create_signature(ts, FXOPEN_API_ID, FXOPEN_API_KEY, FXOPEN_API_SECRET)
-
-            login_req = {
-                "Id": "LOGIN",
-                "Request": "Login",
-                "Params": {
-                    "AuthType": FXOPEN_AUTH_TYPE,
-                    "WebApiId": FXOPEN_API_ID,
-                    "WebApiKey": FXOPEN_API_KEY,
-                    "Timestamp": ts,
-                    "Signature": signature,
-                    "DeviceId": "DELTA-TERMINAL",
-                    "AppSessionId": "DELTA-PORTFOLIO"
-                }
-            }
-
-            await ws.send(json.dumps(login_req))
-            auth_resp = json.loads(await ws.recv())
-            if "Result" not in auth_resp and "Error" in auth_resp:
-                raise Exception(f"Auth failed: {auth_resp}")
-
-            # 2️⃣ Цикл по символам
-            start_ts = utc_start_of_day()
-            for sym in INDEX_SYMBOLS:
-                req = {
-                    "Id": f"HISTORY-{sym}",
-                    "Request": "QuoteHistoryBars",
-                    "Params": {
-                        "Symbol": sym,
-                        "Periodicity": "M30",
-                        "PriceType": "bid",
-                        "Timestamp": start_ts,
-                        "Count": 48
-                    }
-                }
-                await ws.send(json.dumps(req))
-                resp = json.loads(await ws.recv())
-
-                bars = resp.get("Result", {}).get("Bars", [])
-                if not bars:
-                    print(f"[indices_service] No data for {sym}")
-                    continue
-
-                times, closes = [], []
-                for bar in bars:
-                    ts_ms = bar.get("Timestamp")
-                    close = bar.get("Close")
-                    dt = datetime.datetime.utcfromtimestamp(ts_ms / 1000.0)
-                    times.append(dt.strftime("%H:%M"))
-                    closes.append(close)
-
-                results[sym] = list(zip(times, closes))
-                print(f"[indices_service] Loaded {sym}: {len(closes)} bars")
+        async with AsyncFXOpenClient(device_id="DELTA-TERMINAL", app_session_id="DELTA-PORTFOLIO") as client:
+            responses = await asyncio.gather(*[
+                client.quote_history_bars(sym, "M30", Timestamp=start_ts, Count=48)
+                for sym in symbols
+            ], return_exceptions=True)
+
+        for sym, bars in zip(symbols, responses):
+            if isinstance(bars, Exception):
+                print(f"[indices_service] Request error for {sym}: {bars}")
+                continue
+            if not bars:
+                print(f"[indices_service] No data for {sym}")
+                continue
+
+            results[sym] = _bars_to_points(bars)
+            print(f"[indices_service] Loaded {sym}: {len(bars)} bars")
 
     except Exception as e:
         print(f"[indices_service] WebSocket error: {e}")
@@ -11,6 +11,9 @@ from typing import Any, Dict, Optional, List
 from dotenv import load_dotenv
 
 from core.db_manager import DatabaseManager
+from core.async_db import load_db_tickers, close_pool
+from core.metrics import (REQUEST_SECONDS, REQUEST_RETRIES, INGEST_ERRORS,
+                          DB_WRITE_SECONDS, DB_ROWS_WRITTEN, start_exporters)
 
 
 # ────────────────────────────────────────────────
@@ -26,6 +29,7 @@ CONCURRENCY = 1
 REQUEST_TIMEOUT = 20
 MAX_RETRIES = 5
 RETRY_BACKOFF = 1.6
+SKIP_EXISTING = os.getenv("INSTRUMENTS_SKIP_EXISTING", "0") == "1"   # грузить только тикеры, которых нет в instruments
 
 POLY_TICKER_URL = "https://api.polygon.io/v3/reference/tickers/{ticker}?apiKey={api_key}"
 
@@ -75,35 +79,43 @@ def _parse_date(s: Optional[str]) -> Optional[str]:
 
 # Сетевые функции
 
-async def fetch_json(session: aiohttp.ClientSession, url: str) -> Optional[Dict]:
+async def fetch_json(session: aiohttp.ClientSession, url: str, ticker: str = "") -> Optional[Dict]:
     for attempt in range(1, MAX_RETRIES + 1):
+        if attempt > 1:
+            REQUEST_RETRIES.inc(provider="polygon", ticker=ticker)
         try:
-            async with async_timeout.timeout(REQUEST_TIMEOUT):
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        return await resp.json()
-                    if resp.status in (429, 500, 502, 503, 504):
-                        await asyncio.sleep(RETRY_BACKOFF ** (attempt - 1))
-                        continue
-                    return None
+            with REQUEST_SECONDS.time(provider="polygon", request="ticker_details"):
+                async with async_timeout.timeout(REQUEST_TIMEOUT):
+                    async with session.get(url) as resp:
+                        if resp.status == 200:
+                            return await resp.json()
+                        status = resp.status
+            if status in (429, 500, 502, 503, 504):
+                await asyncio.sleep(RETRY_BACKOFF ** (attempt - 1))
+                continue
+            return None
         except (asyncio.TimeoutError, aiohttp.ClientError):
             await asyncio.sleep(RETRY_BACKOFF ** (attempt - 1))
     return None
 
 
-async def fetch_bytes(session: aiohttp.ClientSession, url: str) -> Optional[bytes]:
+async def fetch_bytes(session: aiohttp.ClientSession, url: str, ticker: str = "") -> Optional[bytes]:
     if not url:
         return None
     for attempt in range(1, MAX_RETRIES + 1):
+        if attempt > 1:
+            REQUEST_RETRIES.inc(provider="polygon", ticker=ticker)
         try:
-            async with async_timeout.timeout(REQUEST_TIMEOUT):
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        return await resp.read()
-                    if resp.status in (429, 500, 502, 503, 504):
-                        await asyncio.sleep(RETRY_BACKOFF ** (attempt - 1))
-                        continue
-                    return None
+            with REQUEST_SECONDS.time(provider="polygon", request="logo"):
+                async with async_timeout.timeout(REQUEST_TIMEOUT):
+                    async with session.get(url) as resp:
+                        if resp.status == 200:
+                            return await resp.read()
+                        status = resp.status
+            if status in (429, 500, 502, 503, 504):
+                await asyncio.sleep(RETRY_BACKOFF ** (attempt - 1))
+                continue
+            return None
         except (asyncio.TimeoutError, aiohttp.ClientError):
             await asyncio.sleep(RETRY_BACKOFF ** (attempt - 1))
     return None
@@ -151,8 +163,9 @@ async def process_ticker(semaphore: asyncio.Semaphore,
                          ticker: str) -> Optional[Dict[str, Any]]:
     url = POLY_TICKER_URL.format(ticker=ticker, api_key=POLYGON_API_KEY)
     async with semaphore:
-        meta = await fetch_json(session, url)
+        meta = await fetch_json(session, url, ticker)
         if not meta or meta.get("status") != "OK":
+            INGEST_ERRORS.inc(source="polygon", ticker=ticker)
             print(f"⚠️ Skip {ticker}")
             return None
 
@@ -165,9 +178,9 @@ async def process_ticker(semaphore: asyncio.Semaphore,
         logo_url = add_key(_safe_get(meta, ["results", "branding", "logo_url"]))
         icon_url = add_key(_safe_get(meta, ["results", "branding", "icon_url"]))
 
-        logo_bytes = await fetch_bytes(session, logo_url)
+        logo_bytes = await fetch_bytes(session, logo_url, ticker)
         if not logo_bytes and icon_url:
-            logo_bytes = await fetch_bytes(session, icon_url)
+            logo_bytes = await fetch_bytes(session, icon_url, ticker)
 
         return map_polygon_to_db(meta, logo_bytes)
 
@@ -184,19 +197,34 @@ async def run_loader(tickers: List[str]):
     try:
         db.create_table()
 
+        if SKIP_EXISTING:
+            # instruments читается через asyncpg — event loop загрузчика не блокируется
+            try:
+                existing = set(await load_db_tickers())
+            finally:
+                await close_pool()
+            tickers = [t for t in tickers if t.strip() not in existing]
+            print(f"⏭ Already in DB: {len(existing)} | To load: {len(tickers)}")
+
         timeout = aiohttp.ClientTimeout(total=None, connect=REQUEST_TIMEOUT, sock_read=REQUEST_TIMEOUT)
         connector = aiohttp.TCPConnector(limit=None)
         semaphore = asyncio.Semaphore(CONCURRENCY)
 
         async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
-            tasks = [process_ticker(semaphore, session, t.strip()) for t in tickers if t.strip()]
+            async def fetch(ticker: str):
+                return ticker, await process_ticker(semaphore, session, ticker)
+
+            tasks = [fetch(t.strip()) for t in tickers if t.strip()]
             total = len(tasks)
             completed = 0
-            results: List[Optional[Dict[str, Any]]] = []
+            results: List[Dict[str, Any]] = []
 
             for coro in asyncio.as_completed(tasks):
-                res = await coro
-                results.append(res)
+                ticker, res = await coro
+                if res:
+                    results.append(res)
+                else:
+                    failed_tickers.append(ticker)
                 completed += 1
                 percent = (completed / total) * 100
                 print(f"⏳ Progress: {completed}/{total} ({percent:.1f}%)")
@@ -204,17 +232,13 @@ async def run_loader(tickers: List[str]):
                 if completed % 3 == 0:
                     await asyncio.sleep(2)
 
-        inserted = 0
-        for item, ticker in zip(results, tickers):
-            if not item:
-                failed_tickers.append(ticker)
-                continue
-            try:
-                db.insert_instrument(item)
-                inserted += 1
-            except Exception as e:
-                failed_tickers.append(ticker)
-                print(f"❗ DB insert error for {ticker}: {e}")
+        # Пакетная запись: один многострочный UPSERT и commit на пакет вместо запроса на тикер
+        with DB_WRITE_SECONDS.time(table="instruments"):
+            inserted, db_failed = db.upsert_instruments(results)
+        DB_ROWS_WRITTEN.inc(inserted, table="instruments")
+        for ticker in db_failed:
+            INGEST_ERRORS.inc(source="db", ticker=ticker)
+        failed_tickers.extend(db_failed)
 
         skipped = len(failed_tickers)
         print(f"✅ Done. Inserted/Updated: {inserted} | Skipped: {skipped} | Total: {len(tickers)}")
@@ -244,6 +268,7 @@ if __name__ == "__main__":
     try:
         tickers = load_tickers_from_csv(CSV_PATH)
         print(f"📄 Loaded {len(tickers)} tickers from {CSV_PATH}")
+        start_exporters()
         asyncio.run(run_loader(tickers))
     except Exception as e:
         print(f"❗ Loader failed: {e}")
@@ -0,0 +1,155 @@
+import os
+import threading
+import pandas as pd
+from abc import ABC, abstractmethod
+from dotenv import load_dotenv
+
+# Конфигурация
+
+load_dotenv()
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres")      # postgres | duckdb | sqlite
+STORAGE_PATH = os.getenv("STORAGE_PATH", os.path.join("data", "delta_portfolio.db"))
+
+QUOTE_COLUMNS = ["ticker", "timeframe", "datetime", "open", "high", "low", "close", "volume"]
+VALUE_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+INSTRUMENT_COLUMNS = [
+    "ticker", "name", "market", "locale", "primary_exchange",
+    "currency_name", "composite_figi", "share_class_figi",
+    "market_cap", "phone_number", "address1", "city", "state",
+    "postal_code", "description", "sic_description",
+    "homepage_url", "total_employees", "list_date",
+    "share_class_shares_outstanding", "weighted_shares_outstanding",
+    "round_lot", "logo_data",
+]
+
+FUNDAMENTAL_COLUMNS = [
+    "symbol", "report_date", "pe_ratio", "pb_ratio", "ev_ebitda", "fcf_yield",
+    "dividend_yield", "eps", "roe", "roa", "gross_margin", "operating_margin",
+    "net_margin", "raw_json",
+]
+
+
+# Интерфейс хранилища
+#
+# Котировки, инструменты и фундаментальные данные за одним набором операций.
+# Реализации: PostgresBackend (основная БД приложения) и встраиваемые DuckDBBackend /
+# SQLiteBackend — файл на диске без сервера, для исследований и бэктестов.
+# Соглашения, общие для всех реализаций (их проверяет storage/conformance.py):
+#   - datetime — наивное UTC, в DataFrame — datetime64[ns];
+#   - диапазоны [start, end): start включительно, end — нет;
+#   - write_quotes обновляет существующие бары и возвращает число новых;
+#   - серии и сканы отсортированы по (ticker, datetime).
+
+class StorageBackend(ABC):
+    name = "base"
+
+    @abstractmethod
+    def ensure_schema(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    # Котировки
+
+    @abstractmethod
+    def write_quotes(self, df: pd.DataFrame) -> int:
+        """Upsert баров (QUOTE_COLUMNS) по ключу (ticker, timeframe, datetime); число новых."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def read_quotes(self, ticker: str, timeframe: str, start=None, end=None) -> pd.DataFrame:
+        """Серия: datetime + VALUE_COLUMNS."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def scan_quotes(self, timeframe: str, tickers=None, start=None, end=None) -> pd.DataFrame:
+        """Все серии таймфрейма одним запросом: QUOTE_COLUMNS без timeframe."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def last_bar(self, ticker: str, timeframe: str):
+        raise NotImplementedError
+
+    # Инструменты
+
+    @abstractmethod
+    def upsert_instruments(self, rows) -> int:
+        """rows — словари с ключами из INSTRUMENT_COLUMNS; отсутствующие поля — NULL."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_instrument(self, ticker: str) -> dict | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_tickers(self) -> list:
+        raise NotImplementedError
+
+    # Фундаментальные данные
+
+    @abstractmethod
+    def write_fundamentals(self, df: pd.DataFrame) -> int:
+        """UPSERT снимков (FUNDAMENTAL_COLUMNS) по (symbol, report_date)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def latest_fundamentals(self, symbol: str) -> dict | None:
+        """Снимок за последний отчётный период (report_date)."""
+        raise NotImplementedError
+
+    # Служебное
+
+    @abstractmethod
+    def purge(self, tickers) -> None:
+        """Удаляет все данные тикеров (тесты соответствия и бенчмарки)."""
+        raise NotImplementedError
+
+
+def _quote_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Приводит бары к QUOTE_COLUMNS с datetime64[ns] без часового пояса."""
+    df = df[QUOTE_COLUMNS].copy()
+    dt = pd.to_datetime(df["datetime"])
+    if dt.dt.tz is not None:
+        dt = dt.dt.tz_convert("UTC").dt.tz_localize(None)
+    df["datetime"] = dt.astype("datetime64[ns]")
+    df[VALUE_COLUMNS] = df[VALUE_COLUMNS].astype(float)
+    return df
+
+
+def _last_per_ticker(rows) -> list:
+    """Строки инструментов без повторов тикера (побеждает последняя): в одном
+    INSERT ... ON CONFLICT DO UPDATE строка может обновиться только раз."""
+    return list({row.get("ticker"): row for row in rows}.values())
+
+
+def get_storage(backend: str = STORAGE_BACKEND, path: str = STORAGE_PATH) -> StorageBackend:
+    """Хранилище, выбранное в .env (STORAGE_BACKEND, STORAGE_PATH)."""
+    if backend == "postgres":
+        from storage.postgres_backend import PostgresBackend
+        storage = PostgresBackend()
+    elif backend == "duckdb":
+        from storage.embedded_backend import DuckDBBackend
+        storage = DuckDBBackend(path)
+    elif backend == "sqlite":
+        from storage.embedded_backend import SQLiteBackend
+        storage = SQLiteBackend(path)
+    else:
+        raise ValueError(f"Неизвестное хранилище: {backend}")
+    storage.ensure_schema()
+    return storage
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_storage() -> StorageBackend:
+    """Общее для процесса хранилище из .env (создаётся при первом обращении)."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = get_storage()
+        return _default
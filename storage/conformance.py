@@ -0,0 +1,248 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import traceback
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage.base import get_storage, QUOTE_COLUMNS, VALUE_COLUMNS
+
+# Набор проверок соответствия хранилищ
+#
+# Каждая проверка — функция check_*(storage), которая бросает AssertionError.
+# Все реализации StorageBackend должны проходить один и тот же набор:
+#   python storage/conformance.py sqlite duckdb postgres
+# Данные пишутся под служебными тикерами и удаляются после прогона (purge).
+
+TICKERS = ["__CONF_A__", "__CONF_B__"]
+BENCH_TICKER_PREFIX = "__BENCH_"
+
+
+def _bars(ticker: str, timeframe: str, start: str, n: int, freq: str = "30min", price: float = 100.0):
+    dts = pd.date_range(start, periods=n, freq=freq)
+    close = price + np.arange(n, dtype=float)
+    return pd.DataFrame({
+        "ticker": ticker, "timeframe": timeframe, "datetime": dts,
+        "open": close - 0.5, "high": close + 1, "low": close - 1, "close": close,
+        "volume": np.arange(n, dtype=float) * 10,
+    })
+
+
+# Котировки
+
+def check_quotes_roundtrip(storage):
+    df = _bars(TICKERS[0], "M30", "2024-01-01", 48)
+    assert storage.write_quotes(df) == 48
+    got = storage.read_quotes(TICKERS[0], "M30")
+    assert list(got.columns) == ["datetime"] + VALUE_COLUMNS, list(got.columns)
+    assert len(got) == 48
+    assert (got["datetime"].to_numpy() == df["datetime"].to_numpy()).all()
+    np.testing.assert_allclose(got[VALUE_COLUMNS].to_numpy(float), df[VALUE_COLUMNS].to_numpy(float))
+
+
+def check_quotes_upsert(storage):
+    df = _bars(TICKERS[0], "M30", "2024-01-01", 48)
+    storage.write_quotes(df)
+    # Перекрывающая страница: 8 баров уже есть (последний изменился), 8 новых
+    page = _bars(TICKERS[0], "M30", "2024-01-01 20:00", 16, price=500.0)
+    assert storage.write_quotes(page) == 8
+    got = storage.read_quotes(TICKERS[0], "M30")
+    assert len(got) == 56
+    assert got["close"].iloc[40] == 500.0, "существующие бары должны обновляться"
+    assert got["datetime"].is_monotonic_increasing
+
+
+def check_quotes_duplicates_in_batch(storage):
+    df = _bars(TICKERS[0], "H1", "2024-01-01", 5, freq="h")
+    assert storage.write_quotes(pd.concat([df, df], ignore_index=True)) == 5
+    assert len(storage.read_quotes(TICKERS[0], "H1")) == 5
+
+
+def check_quotes_range(storage):
+    storage.write_quotes(_bars(TICKERS[0], "M30", "2024-01-01", 48))
+    got = storage.read_quotes(TICKERS[0], "M30", start=datetime(2024, 1, 1, 1), end=datetime(2024, 1, 1, 3))
+    assert list(got["datetime"]) == list(pd.date_range("2024-01-01 01:00", periods=4, freq="30min"))
+
+
+def check_quotes_isolation(storage):
+    storage.write_quotes(_bars(TICKERS[0], "M30", "2024-01-01", 10))
+    storage.write_quotes(_bars(TICKERS[0], "H1", "2024-01-01", 3, freq="h"))
+    storage.write_quotes(_bars(TICKERS[1], "M30", "2024-01-01", 7))
+    assert len(storage.read_quotes(TICKERS[0], "M30")) == 10
+    assert len(storage.read_quotes(TICKERS[1], "M30")) == 7
+    assert storage.read_quotes(TICKERS[1], "H1").empty
+
+
+def check_scan(storage):
+    storage.write_quotes(_bars(TICKERS[1], "M30", "2024-01-01", 7))
+    storage.write_quotes(_bars(TICKERS[0], "M30", "2024-01-01", 10))
+    got = storage.scan_quotes("M30", tickers=TICKERS)
+    assert list(got.columns) == [c for c in QUOTE_COLUMNS if c != "timeframe"], list(got.columns)
+    assert list(got["ticker"]) == [TICKERS[0]] * 10 + [TICKERS[1]] * 7
+    ranged = storage.scan_quotes("M30", tickers=TICKERS, start=datetime(2024, 1, 1, 3))
+    assert len(ranged) == 4 + 1
+    assert storage.scan_quotes("M30", tickers=[]).empty
+
+
+def check_last_bar(storage):
+    assert storage.last_bar(TICKERS[1], "D1") is None
+    storage.write_quotes(_bars(TICKERS[1], "D1", "2024-01-01", 3, freq="D"))
+    assert pd.Timestamp(storage.last_bar(TICKERS[1], "D1")) == pd.Timestamp("2024-01-03")
+
+
+def check_timezone_aware_input(storage):
+    df = _bars(TICKERS[1], "M5", "2024-06-01 12:00", 2, freq="5min")
+    df["datetime"] = df["datetime"].dt.tz_localize("UTC").dt.tz_convert("Europe/Moscow")
+    storage.write_quotes(df)
+    got = storage.read_quotes(TICKERS[1], "M5")
+    assert got["datetime"].iloc[0] == pd.Timestamp("2024-06-01 12:00"), "время хранится в наивном UTC"
+
+
+# Инструменты
+
+def check_instruments(storage):
+    logo = bytes(range(256))
+    storage.upsert_instruments([
+        {"ticker": TICKERS[0], "name": "Conformance A", "market": "stocks", "market_cap": 1.5e9,
+         "total_employees": 120, "list_date": "2001-02-03", "logo_data": logo},
+        {"ticker": TICKERS[1], "name": "Conformance B"},
+    ])
+    a = storage.get_instrument(TICKERS[0])
+    assert a["name"] == "Conformance A" and a["market_cap"] == 1.5e9 and a["total_employees"] == 120
+    assert str(a["list_date"])[:10] == "2001-02-03"
+    assert a["logo_data"] == logo
+    assert storage.get_instrument(TICKERS[1])["market"] is None
+    assert storage.get_instrument("__CONF_MISSING__") is None
+
+    storage.upsert_instruments([{"ticker": TICKERS[1], "name": "Renamed", "market": "otc"}])
+    assert storage.get_instrument(TICKERS[1])["name"] == "Renamed"
+    tickers = storage.list_tickers()
+    assert [t for t in tickers if t in TICKERS] == TICKERS
+    assert tickers == sorted(tickers)
+
+
+# Фундаментальные данные
+
+def check_instruments_duplicates_in_batch(storage):
+    storage.upsert_instruments([
+        {"ticker": TICKERS[0], "name": "First"},
+        {"ticker": TICKERS[0], "name": "Second"},
+    ])
+    assert storage.get_instrument(TICKERS[0])["name"] == "Second"
+
+
+def check_fundamentals(storage):
+    assert storage.latest_fundamentals(TICKERS[0]) is None
+    rows = pd.DataFrame([
+        {"symbol": TICKERS[0], "report_date": datetime(2024, 1, 1), "pe_ratio": 10.0,
+         "raw_json": '{"Symbol": "A", "PERatio": "10"}'},
+        {"symbol": TICKERS[0], "report_date": datetime(2024, 4, 1), "pe_ratio": 12.5,
+         "raw_json": '{"Symbol": "A", "PERatio": "12.5"}'},
+    ])
+    for col in ("pb_ratio", "ev_ebitda", "fcf_yield", "dividend_yield", "eps", "roe", "roa",
+                "gross_margin", "operating_margin", "net_margin"):
+        rows[col] = 0.0
+    assert storage.write_fundamentals(rows) == 2
+    latest = storage.latest_fundamentals(TICKERS[0])
+    assert latest["pe_ratio"] == 12.5
+    assert pd.Timestamp(latest["report_date"]) == pd.Timestamp("2024-04-01")
+    assert latest["raw_json"] == {"Symbol": "A", "PERatio": "12.5"}
+
+
+def check_fundamentals_upsert(storage):
+    def snapshot(period, pe):
+        row = {"symbol": TICKERS[1], "report_date": period, "pe_ratio": pe, "raw_json": {"PERatio": str(pe)}}
+        row.update({col: 0.0 for col in ("pb_ratio", "ev_ebitda", "fcf_yield", "dividend_yield", "eps", "roe",
+                                         "roa", "gross_margin", "operating_margin", "net_margin")})
+        return pd.DataFrame([row])
+
+    storage.write_fundamentals(snapshot(datetime(2024, 6, 30), 20.0))
+    # Повторная загрузка того же периода заменяет снимок, а не добавляет второй
+    storage.write_fundamentals(snapshot(datetime(2024, 6, 30), 21.0))
+    assert storage.latest_fundamentals(TICKERS[1])["pe_ratio"] == 21.0
+    # Более старый период не вытесняет последний
+    storage.write_fundamentals(snapshot(datetime(2024, 3, 31), 18.0))
+    latest = storage.latest_fundamentals(TICKERS[1])
+    assert latest["pe_ratio"] == 21.0 and latest["raw_json"] == {"PERatio": "21.0"}
+
+
+CHECKS = [value for name, value in list(globals().items()) if name.startswith("check_")]
+
+
+def run_conformance(storage) -> bool:
+    """Прогоняет все проверки на чистых данных; True, если хранилище соответствует интерфейсу."""
+    failed = 0
+    for check in CHECKS:
+        storage.purge(TICKERS)
+        try:
+            check(storage)
+            print(f"  ✅ {check.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"  ❌ {check.__name__}: {e!r}")
+            traceback.print_exc(limit=2)
+    storage.purge(TICKERS)
+    print(f"{'✅' if not failed else '❌'} {storage.name}: {len(CHECKS) - failed}/{len(CHECKS)} проверок")
+    return not failed
+
+
+# Бенчмарк сканов
+
+def benchmark_scan(storage, n_tickers: int = 50, n_bars: int = 20_000, repeat: int = 3):
+    """Пишет синтетическую вселенную M1 и замеряет скан всего таймфрейма и чтение одной серии."""
+    tickers = [f"{BENCH_TICKER_PREFIX}{i:03d}__" for i in range(n_tickers)]
+    storage.purge(tickers)
+    started = time.perf_counter()
+    for ticker in tickers:
+        storage.write_quotes(_bars(ticker, "M1", "2020-01-01", n_bars, freq="min"))
+    write = time.perf_counter() - started
+    total = n_tickers * n_bars
+
+    def best(fn):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    scan = best(lambda: storage.scan_quotes("M1", tickers=tickers))
+    window = best(lambda: storage.scan_quotes("M1", tickers=tickers, start=datetime(2020, 1, 10),
+                                              end=datetime(2020, 1, 11)))
+    series = best(lambda: storage.read_quotes(tickers[0], "M1"))
+    storage.purge(tickers)
+    print(f"⏱ {storage.name:>8}: запись {total / write:>10,.0f} баров/с | "
+          f"скан {total:,} баров {scan * 1000:8.1f} мс ({total / scan:,.0f} баров/с) | "
+          f"окно суток {window * 1000:7.1f} мс | серия {series * 1000:7.1f} мс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Проверки соответствия и бенчмарк хранилищ")
+    parser.add_argument("backends", nargs="*", default=["sqlite", "duckdb"],
+                        help="postgres | duckdb | sqlite")
+    parser.add_argument("--bench", action="store_true", help="после проверок — бенчмарк сканов")
+    parser.add_argument("--tickers", type=int, default=50)
+    parser.add_argument("--bars", type=int, default=20_000)
+    args = parser.parse_args()
+
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in args.backends:
+            try:
+                storage = get_storage(backend, os.path.join(tmp, f"conformance.{backend}"))
+            except Exception as e:
+                print(f"⚠️ {backend}: хранилище недоступно — {e}")
+                ok = False
+                continue
+            try:
+                ok &= run_conformance(storage)
+                if args.bench:
+                    benchmark_scan(storage, args.tickers, args.bars)
+            finally:
+                storage.close()
+    sys.exit(0 if ok else 1)
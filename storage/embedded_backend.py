@@ -0,0 +1,299 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import date
+import numpy as np
+import pandas as pd
+
+from storage.base import (StorageBackend, QUOTE_COLUMNS, VALUE_COLUMNS, INSTRUMENT_COLUMNS,
+                          FUNDAMENTAL_COLUMNS, _quote_frame, _last_per_ticker)
+
+try:
+    import duckdb
+except ImportError:   # duckdb не установлен — доступен только SQLiteBackend
+    duckdb = None
+
+
+# Встраиваемое хранилище
+#
+# Один файл, без сервера. datetime и report_date хранятся как BIGINT (нс UTC):
+# сравнение диапазонов — целочисленное, а скан превращается в datetime64 без разбора строк.
+# DuckDB хранит таблицы по столбцам и выгружает результат сразу в NumPy,
+# поэтому сканы вселенной для исследований и бэктестов идут на порядок быстрее, чем через сервер.
+
+_INSTRUMENT_TYPES = {
+    "market_cap": "DOUBLE",
+    "total_employees": "BIGINT",
+    "share_class_shares_outstanding": "BIGINT",
+    "weighted_shares_outstanding": "BIGINT",
+    "round_lot": "BIGINT",
+    "logo_data": "BLOB",
+}
+
+
+def _to_ns(values) -> np.ndarray:
+    return pd.to_datetime(values).to_numpy(dtype="datetime64[ns]").astype(np.int64)
+
+
+def _ns_param(value) -> int:
+    return pd.Timestamp(value).value
+
+
+class SQLiteBackend(StorageBackend):
+    name = "sqlite"
+    _quotes_table_options = " WITHOUT ROWID"   # строки лежат в B-tree первичного ключа
+
+    def __init__(self, path: str):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self.conn = self._connect()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def close(self):
+        self.conn.close()
+
+    # Выполнение запросов
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params)
+
+    def _frame(self, sql: str, params=()) -> pd.DataFrame:
+        with self._lock:
+            return pd.read_sql_query(sql, self.conn, params=params)
+
+    def _transaction(self, fn):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                result = fn()
+                self.conn.execute("COMMIT")
+                return result
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _stage(self, df: pd.DataFrame):
+        """Загружает бары во временную таблицу quotes_staging."""
+        self.conn.execute("DROP TABLE IF EXISTS temp.quotes_staging")
+        self.conn.execute("CREATE TEMP TABLE quotes_staging AS SELECT * FROM instrument_quotes WHERE 0")
+        self.conn.executemany(
+            f"INSERT INTO quotes_staging VALUES ({', '.join('?' * len(QUOTE_COLUMNS))})",
+            df.itertuples(index=False, name=None),
+        )
+
+    # Схема
+
+    def ensure_schema(self):
+        instrument_cols = ", ".join(
+            f"{col} {_INSTRUMENT_TYPES.get(col, 'TEXT')}" + (" PRIMARY KEY" if col == "ticker" else "")
+            for col in INSTRUMENT_COLUMNS
+        )
+        fundamental_cols = ", ".join(
+            f"{col} {'TEXT' if col in ('symbol', 'raw_json') else 'BIGINT' if col == 'report_date' else 'DOUBLE'}"
+            for col in FUNDAMENTAL_COLUMNS
+        )
+        for ddl in (
+            f"""
+            CREATE TABLE IF NOT EXISTS instrument_quotes (
+                ticker TEXT NOT NULL,
+                timeframe TEXT NOT NULL,
+                datetime BIGINT NOT NULL,
+                open DOUBLE, high DOUBLE, low DOUBLE, close DOUBLE, volume DOUBLE,
+                PRIMARY KEY (ticker, timeframe, datetime)
+            ){self._quotes_table_options}
+            """,
+            f"CREATE TABLE IF NOT EXISTS instruments ({instrument_cols})",
+            f"CREATE TABLE IF NOT EXISTS fundamental_data ({fundamental_cols})",
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_fundamental_data_symbol_period ON fundamental_data (symbol, report_date)",
+        ):
+            self._execute(ddl)
+
+    # Котировки
+
+    def write_quotes(self, df: pd.DataFrame) -> int:
+        if df.empty:
+            return 0
+        df = _quote_frame(df).drop_duplicates(["ticker", "timeframe", "datetime"], keep="last")
+        df["datetime"] = df["datetime"].astype(np.int64)
+        update_set = ", ".join(f"{c} = excluded.{c}" for c in VALUE_COLUMNS)
+
+        def write():
+            self._stage(df)
+            inserted = self.conn.execute("""
+                SELECT COUNT(*) FROM quotes_staging s
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM instrument_quotes q
+                    WHERE q.ticker = s.ticker AND q.timeframe = s.timeframe AND q.datetime = s.datetime
+                )
+            """).fetchone()[0]
+            self.conn.execute(f"""
+                INSERT INTO instrument_quotes SELECT * FROM quotes_staging WHERE true
+                ON CONFLICT (ticker, timeframe, datetime) DO UPDATE SET {update_set}
+            """)
+            self.conn.execute("DROP TABLE quotes_staging")
+            return inserted
+
+        return self._transaction(write)
+
+    def _range(self, sql: str, params: list, start, end) -> str:
+        if start is not None:
+            sql += " AND datetime >= ?"
+            params.append(_ns_param(start))
+        if end is not None:
+            sql += " AND datetime < ?"
+            params.append(_ns_param(end))
+        return sql
+
+    def read_quotes(self, ticker: str, timeframe: str, start=None, end=None) -> pd.DataFrame:
+        params = [ticker, timeframe]
+        sql = self._range(f"""
+            SELECT datetime, {", ".join(VALUE_COLUMNS)} FROM instrument_quotes
+            WHERE ticker = ? AND timeframe = ?
+        """, params, start, end)
+        df = self._frame(sql + " ORDER BY datetime", params)
+        df["datetime"] = df["datetime"].astype(np.int64).astype("datetime64[ns]")
+        return df
+
+    def scan_quotes(self, timeframe: str, tickers=None, start=None, end=None) -> pd.DataFrame:
+        columns = [c for c in QUOTE_COLUMNS if c != "timeframe"]
+        params = [timeframe]
+        sql = f"SELECT {', '.join(columns)} FROM instrument_quotes WHERE timeframe = ?"
+        if tickers is not None:
+            tickers = list(tickers)
+            if not tickers:
+                return pd.DataFrame(columns=columns)
+            sql += f" AND ticker IN ({', '.join('?' * len(tickers))})"
+            params += tickers
+        sql = self._range(sql, params, start, end)
+        df = self._frame(sql + " ORDER BY ticker, datetime", params)
+        df["datetime"] = df["datetime"].astype(np.int64).astype("datetime64[ns]")
+        return df
+
+    def last_bar(self, ticker: str, timeframe: str):
+        ns = self._execute(
+            "SELECT MAX(datetime) FROM instrument_quotes WHERE ticker = ? AND timeframe = ?",
+            (ticker, timeframe),
+        ).fetchone()[0]
+        return None if ns is None else pd.Timestamp(ns).to_pydatetime()
+
+    # Инструменты
+
+    def upsert_instruments(self, rows) -> int:
+        values = [tuple(_instrument_value(row.get(col)) for col in INSTRUMENT_COLUMNS)
+                  for row in _last_per_ticker(rows)]
+        if not values:
+            return 0
+        update_set = ", ".join(f"{col} = excluded.{col}" for col in INSTRUMENT_COLUMNS if col != "ticker")
+        sql = f"""
+            INSERT INTO instruments ({", ".join(INSTRUMENT_COLUMNS)})
+            VALUES ({", ".join("?" * len(INSTRUMENT_COLUMNS))})
+            ON CONFLICT (ticker) DO UPDATE SET {update_set}
+        """
+        self._transaction(lambda: self.conn.executemany(sql, values))
+        return len(values)
+
+    def get_instrument(self, ticker: str) -> dict | None:
+        row = self._execute(
+            f"SELECT {', '.join(INSTRUMENT_COLUMNS)} FROM instruments WHERE ticker = ?", (ticker,)
+        ).fetchone()
+        if row is None:
+            return None
+        record = dict(zip(INSTRUMENT_COLUMNS, row))
+        if record["logo_data"] is not None:
+            record["logo_data"] = bytes(record["logo_data"])
+        return record
+
+    def list_tickers(self) -> list:
+        return [r[0] for r in self._execute("SELECT ticker FROM instruments ORDER BY ticker").fetchall()]
+
+    # Фундаментальные данные
+
+    def write_fundamentals(self, df: pd.DataFrame) -> int:
+        if df.empty:
+            return 0
+        df = df[FUNDAMENTAL_COLUMNS].copy()
+        df["report_date"] = _to_ns(df["report_date"])
+        df["raw_json"] = [v if v is None or isinstance(v, str) else json.dumps(v) for v in df["raw_json"]]
+        rows = [tuple(_instrument_value(v) for v in row) for row in df.itertuples(index=False, name=None)]
+        update_set = ", ".join(f"{c} = excluded.{c}" for c in FUNDAMENTAL_COLUMNS[2:])
+        sql = f"""
+            INSERT INTO fundamental_data VALUES ({', '.join('?' * len(FUNDAMENTAL_COLUMNS))})
+            ON CONFLICT (symbol, report_date) DO UPDATE SET {update_set}
+        """
+        self._transaction(lambda: self.conn.executemany(sql, rows))
+        return len(rows)
+
+    def latest_fundamentals(self, symbol: str) -> dict | None:
+        row = self._execute(f"""
+            SELECT {", ".join(FUNDAMENTAL_COLUMNS)} FROM fundamental_data
+            WHERE symbol = ? ORDER BY report_date DESC LIMIT 1
+        """, (symbol,)).fetchone()
+        if row is None:
+            return None
+        record = dict(zip(FUNDAMENTAL_COLUMNS, row))
+        record["report_date"] = pd.Timestamp(record["report_date"]).to_pydatetime()
+        if record["raw_json"] is not None:
+            record["raw_json"] = json.loads(record["raw_json"])
+        return record
+
+    # Служебное
+
+    def purge(self, tickers) -> None:
+        tickers = list(tickers)
+        marks = ", ".join("?" * len(tickers))
+
+        def purge():
+            for table, column in (("instrument_quotes", "ticker"), ("instruments", "ticker"),
+                                  ("fundamental_data", "symbol")):
+                self.conn.execute(f"DELETE FROM {table} WHERE {column} IN ({marks})", tickers)
+
+        if tickers:
+            self._transaction(purge)
+
+
+class DuckDBBackend(SQLiteBackend):
+    """Колоночный движок DuckDB; SQL общий с SQLiteBackend, отличаются загрузка и выгрузка данных."""
+    name = "duckdb"
+    _quotes_table_options = ""
+
+    def __init__(self, path: str):
+        if duckdb is None:
+            raise RuntimeError("Для STORAGE_BACKEND=duckdb установите пакет duckdb")
+        super().__init__(path)
+
+    def _connect(self):
+        return duckdb.connect(self.path)
+
+    def _frame(self, sql: str, params=()) -> pd.DataFrame:
+        with self._lock:
+            return self.conn.execute(sql, list(params)).df()
+
+    def _stage(self, df: pd.DataFrame):
+        # DataFrame читается DuckDB напрямую, без построчной вставки
+        self.conn.register("quotes_frame", df)
+        try:
+            self.conn.execute("CREATE OR REPLACE TEMP TABLE quotes_staging AS SELECT * FROM quotes_frame")
+        finally:
+            self.conn.unregister("quotes_frame")
+
+
+def _instrument_value(value):
+    """NaN pandas → NULL, numpy-скаляры → Python, даты → YYYY-MM-DD."""
+    if value is None:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if isinstance(value, date):
+        return value.isoformat()[:10]
+    return value
@@ -0,0 +1,140 @@
+import pandas as pd
+from psycopg2.extras import execute_values
+from sqlalchemy import text
+
+from core.database import engine, raw_connection, ensure_quotes_schema, FundamentalData
+from core.db_manager import DatabaseManager, _instrument_row, _upsert_sql
+from core.logo_store import store_logos
+from core.fundamentals_store import ensure_fundamentals_schema, upsert_fundamentals
+from core.quotes_writer import copy_quotes, read_watermark
+from core.tiering import read_archived, read_quotes_tiered, merge_tiers
+from storage.base import (StorageBackend, QUOTE_COLUMNS, INSTRUMENT_COLUMNS,
+                          FUNDAMENTAL_COLUMNS, _quote_frame, _last_per_ticker)
+
+
+class PostgresBackend(StorageBackend):
+    """Основная БД приложения: COPY-запись котировок, секционированная instrument_quotes."""
+    name = "postgres"
+
+    def ensure_schema(self):
+        ensure_quotes_schema()
+        db = DatabaseManager()
+        try:
+            db.create_table()
+        finally:
+            db.close()
+        FundamentalData.__table__.create(engine, checkfirst=True)
+        with engine.begin() as conn:
+            ensure_fundamentals_schema(conn)
+
+    # Котировки
+
+    def write_quotes(self, df: pd.DataFrame) -> int:
+        if df.empty:
+            return 0
+        with engine.begin() as conn:
+            return copy_quotes(conn, _quote_frame(df))
+
+    def _range(self, query: str, params: dict, start, end) -> str:
+        if start is not None:
+            query += " AND datetime >= :start"
+            params["start"] = pd.Timestamp(start).to_pydatetime()
+        if end is not None:
+            query += " AND datetime < :end"
+            params["end"] = pd.Timestamp(end).to_pydatetime()
+        return query
+
+    def read_quotes(self, ticker: str, timeframe: str, start=None, end=None) -> pd.DataFrame:
+        with engine.connect() as conn:
+            return read_quotes_tiered(conn, ticker, timeframe, start, end)
+
+    def scan_quotes(self, timeframe: str, tickers=None, start=None, end=None) -> pd.DataFrame:
+        params = {"tf": timeframe}
+        columns = [c for c in QUOTE_COLUMNS if c != "timeframe"]
+        query = f"SELECT {', '.join(columns)} FROM instrument_quotes WHERE timeframe = :tf"
+        if tickers is not None:
+            query += " AND ticker = ANY(:tickers)"
+            params["tickers"] = list(tickers)
+        query = self._range(query, params, start, end)
+        with engine.connect() as conn:
+            hot = pd.read_sql(text(query + " ORDER BY ticker, datetime"), conn, params=params)
+            return merge_tiers(read_archived(conn, timeframe, tickers, start, end), hot)
+
+    def last_bar(self, ticker: str, timeframe: str):
+        with engine.connect() as conn:
+            return read_watermark(conn, ticker, timeframe)
+
+    # Инструменты
+
+    def upsert_instruments(self, rows) -> int:
+        rows = _last_per_ticker(rows)
+        if not rows:
+            return 0
+        # Тот же многострочный UPSERT, что и DatabaseManager.upsert_instruments (логотипы — в logo_blobs)
+        with raw_connection() as conn, conn.cursor() as cur:
+            digests = store_logos(cur, [row.get("logo_data") for row in rows])
+            values = [_instrument_row(row, digest) for row, digest in zip(rows, digests)]
+            execute_values(cur, _upsert_sql("VALUES %s"), values, page_size=len(values))
+        return len(values)
+
+    def get_instrument(self, ticker: str) -> dict | None:
+        with raw_connection() as conn, conn.cursor() as cur:
+            columns = ", ".join("b.data" if col == "logo_data" else f"i.{col}" for col in INSTRUMENT_COLUMNS)
+            cur.execute(f"""
+                SELECT {columns} FROM instruments i
+                LEFT JOIN logo_blobs b ON b.sha256 = i.logo_sha256
+                WHERE i.ticker = %s
+            """, (ticker,))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        record = dict(zip(INSTRUMENT_COLUMNS, row))
+        if record["logo_data"] is not None:
+            record["logo_data"] = bytes(record["logo_data"])
+        return record
+
+    def list_tickers(self) -> list:
+        with raw_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT ticker FROM instruments ORDER BY ticker")
+            return [r[0] for r in cur.fetchall()]
+
+    # Фундаментальные данные
+
+    def write_fundamentals(self, df: pd.DataFrame) -> int:
+        if df.empty:
+            return 0
+        with engine.begin() as conn:
+            return upsert_fundamentals(conn, df[FUNDAMENTAL_COLUMNS])
+
+    def latest_fundamentals(self, symbol: str) -> dict | None:
+        with engine.connect() as conn:
+            row = conn.execute(text(f"""
+                SELECT {", ".join(FUNDAMENTAL_COLUMNS)} FROM fundamental_latest
+                WHERE symbol = :symbol
+            """), {"symbol": symbol}).mappings().first()
+        return dict(row) if row else None
+
+    # Служебное
+
+    def purge(self, tickers) -> None:
+        tickers = list(tickers)
+        with engine.begin() as conn:
+            # Логотипы тикеров, на которые больше никто не ссылается (миниатюры — каскадом)
+            logos = [r[0] for r in conn.execute(text("""
+                SELECT DISTINCT logo_sha256 FROM instruments
+                WHERE ticker = ANY(:tickers) AND logo_sha256 IS NOT NULL
+            """), {"tickers": tickers})]
+            for table, column in (("instrument_quotes", "ticker"), ("quote_watermarks", "ticker"),
+                                  ("quote_priorities", "ticker"), ("backfill_windows", "ticker"),
+                                  ("quote_aggregates", "ticker"), ("instruments", "ticker"),
+                                  ("fundamental_data", "symbol"), ("fundamental_latest", "symbol")):
+                # quote_aggregates и др. создаются по мере включения возможностей — могут отсутствовать
+                if conn.execute(text("SELECT to_regclass(:t) IS NOT NULL"), {"t": table}).scalar():
+                    conn.execute(text(f"DELETE FROM {table} WHERE {column} = ANY(:tickers)"),
+                                 {"tickers": tickers})
+            if logos:
+                conn.execute(text("""
+                    DELETE FROM logo_blobs b
+                    WHERE b.sha256 = ANY(:logos)
+                      AND NOT EXISTS (SELECT 1 FROM instruments i WHERE i.logo_sha256 = b.sha256)
+                """), {"logos": logos})
@@ -0,0 +1,53 @@
+import os
+from PyQt6.QtCore import QObject, pyqtSignal
+from dotenv import load_dotenv
+from core.live_bars import get_live_feed
+from services.chart_service import INGESTION_DAEMON
+
+load_dotenv()
+LIVE_QUOTES_ENABLED = os.getenv("LIVE_QUOTES", "1") == "1"
+
+
+class LiveBarsBridge(QObject):
+    """Переносит текущие бары live-фида в GUI-поток через сигнал Qt."""
+    bar_updated = pyqtSignal(str, str, object)  # symbol, timeframe, (dt, o, h, l, c, v)
+
+    def __init__(self):
+        super().__init__()
+        # При QUOTES_INGESTION=daemon закрытые бары пишет демон ингестии — GUI их только показывает
+        self.feed = get_live_feed(persist=not INGESTION_DAEMON)
+        self.feed.add_listener(self.bar_updated.emit)
+
+    def watch(self, symbols):
+        self.feed.subscribe(symbols)
+
+
+def apply_live_bar(data: list, bar) -> bool:
+    """
+    Применяет текущий бар live-фида к свечам графика [(dt, o, h, l, c)].
+    Бар с тем же временем, что и последняя свеча из БД, сливается с ней: первый бар фида
+    неполный (начат с первого тика после подключения), поэтому open остаётся от истории,
+    high/low — экстремумы обоих, close — из фида. False — бар старше последней свечи.
+    """
+    dt, o, h, l, c, _ = bar
+    if data and data[-1][0] == dt:
+        _, old_o, old_h, old_l, _ = data[-1]
+        data[-1] = (dt, old_o, max(old_h, h), min(old_l, l), c)
+    elif not data or dt > data[-1][0]:
+        data.append((dt, o, h, l, c))
+    else:
+        return False
+    return True
+
+
+_bridge = None
+
+
+def get_live_bridge():
+    """Общий мост live-котировок; None, если LIVE_QUOTES=0."""
+    global _bridge
+    if not LIVE_QUOTES_ENABLED:
+        return None
+    if _bridge is None:
+        _bridge = LiveBarsBridge()
+    return _bridge
@@ -0,0 +1,68 @@
+import os
+from collections import OrderedDict
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QPixmap
+from dotenv import load_dotenv
+from core.database import raw_connection
+from core.logo_store import load_logo, render_thumbnail, save_thumbnails
+
+load_dotenv()
+LOGO_PIXMAP_CACHE = int(os.getenv("LOGO_PIXMAP_CACHE", "256"))   # логотипов в памяти GUI
+
+
+class LogoPixmapCache:
+    """
+    LRU готовых QPixmap по (sha256, размер): логотип читается и декодируется один раз за сессию.
+    Логотипы разных тикеров с одинаковым содержимым делят одну запись.
+    """
+
+    def __init__(self, capacity: int = LOGO_PIXMAP_CACHE):
+        self.capacity = capacity
+        self._pixmaps = OrderedDict()
+
+    def get(self, sha256: str | None, size: int) -> QPixmap | None:
+        if not sha256:
+            return None
+        key = (sha256, size)
+        if key in self._pixmaps:
+            self._pixmaps.move_to_end(key)
+            return self._pixmaps[key]
+
+        pixmap = self._load(sha256, size)
+        self._pixmaps[key] = pixmap
+        while len(self._pixmaps) > self.capacity:
+            self._pixmaps.popitem(last=False)
+        return pixmap
+
+    def _load(self, sha256: str, size: int) -> QPixmap | None:
+        with raw_connection() as conn, conn.cursor() as cur:
+            data, is_thumbnail = load_logo(cur, sha256, size)
+            if data and not is_thumbnail:
+                # Миниатюры этого размера ещё нет (не отрисовалась при загрузке) — сохраняем её
+                thumbnail = render_thumbnail(data, size)
+                if thumbnail:
+                    save_thumbnails(cur, sha256, {size: thumbnail})
+                    data = thumbnail
+        if not data:
+            return None
+        pixmap = QPixmap()
+        if not pixmap.loadFromData(data):
+            return None
+        if pixmap.width() > size or pixmap.height() > size:
+            pixmap = pixmap.scaled(size, size, Qt.AspectRatioMode.KeepAspectRatio,
+                                   Qt.TransformationMode.SmoothTransformation)
+        return pixmap
+
+    def clear(self):
+        self._pixmaps.clear()
+
+
+_cache = None
+
+
+def get_logo_cache() -> LogoPixmapCache:
+    """Общий кэш логотипов GUI-процесса."""
+    global _cache
+    if _cache is None:
+        _cache = LogoPixmapCache()
+    return _cache
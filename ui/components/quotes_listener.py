@@ -0,0 +1,82 @@
+import os
+import json
+import select
+from datetime import datetime
+from PyQt6.QtCore import QCoreApplication, QThread, pyqtSignal
+from dotenv import load_dotenv
+from core.database import connect_direct
+from core.quotes_writer import QUOTES_CHANNEL
+
+load_dotenv()
+QUOTES_LISTEN_ENABLED = os.getenv("QUOTES_LISTEN", "1") == "1"
+RECONNECT_SECONDS = float(os.getenv("QUOTES_LISTEN_RECONNECT_SECONDS", "5"))
+
+
+class QuotesListener(QThread):
+    """
+    LISTEN quotes_updated в фоновом потоке.
+    Каждое уведомление ингестора превращается в сигнал Qt (ticker, timeframe, last_bar),
+    который доставляется в GUI-поток — виджеты перечитывают только свою серию.
+    """
+    quotes_updated = pyqtSignal(str, str, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._running = True
+
+    def _connect(self):
+        # LISTEN держит сессию постоянно, поэтому соединение берётся вне пула
+        conn = connect_direct()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {QUOTES_CHANNEL}")
+        return conn
+
+    def run(self):
+        while self._running:
+            conn = None
+            try:
+                conn = self._connect()
+                print(f"📡 Подписка на уведомления {QUOTES_CHANNEL}")
+                while self._running:
+                    # Ждём уведомления не дольше секунды, чтобы поток можно было остановить
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            self._emit(conn.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"[quotes_listener] Соединение потеряно: {e}")
+                self.msleep(int(RECONNECT_SECONDS * 1000))
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _emit(self, payload: str):
+        try:
+            data = json.loads(payload)
+            last_bar = datetime.fromisoformat(data["last_bar"]) if data.get("last_bar") else None
+            self.quotes_updated.emit(data["ticker"], data["timeframe"], last_bar)
+        except (ValueError, KeyError) as e:
+            print(f"[quotes_listener] Некорректное уведомление {payload!r}: {e}")
+
+    def stop(self):
+        self._running = False
+        self.wait()
+
+
+_listener = None
+
+
+def get_quotes_listener():
+    """Общий слушатель уведомлений ингестора; None, если QUOTES_LISTEN=0."""
+    global _listener
+    if not QUOTES_LISTEN_ENABLED:
+        return None
+    if _listener is None:
+        _listener = QuotesListener()
+        app = QCoreApplication.instance()
+        if app is not None:
+            # Поток держит соединение LISTEN — останавливаем его до разрушения объектов Qt
+            app.aboutToQuit.connect(_listener.stop)
+        _listener.start()
+    return _listener
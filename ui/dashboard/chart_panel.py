@@ -1,7 +1,9 @@
 from PyQt6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QPushButton
 from PyQt6.QtCore import Qt, QTimer, QPointF
 from PyQt6.QtGui import QPainter, QColor, QPen, QFont, QPainterPath
-from services.chart_service import fetch_candles
+from services.chart_service import fetch_candles, read_candles, INGESTION_DAEMON
+from ui.components.live_bridge import get_live_bridge, apply_live_bar
+from ui.components.quotes_listener import get_quotes_listener
 
 
 class CandleChart(QWidget):
@@ -31,10 +33,21 @@ class CandleChart(QWidget):
 
         self.font = QFont("Helvetica Neue", 9)
 
-        # --- автообновление каждые 30 мин ---
+        # --- live-котировки ---
+        self.live = get_live_bridge()
+        if self.live:
+            self.live.bar_updated.connect(self.on_live_bar)
+
+        # --- уведомления ингестора ---
+        self.quotes = get_quotes_listener()
+        if self.quotes:
+            self.quotes.quotes_updated.connect(self.on_quotes_updated)
+
+        # --- автообновление каждые 30 мин (с демоном ингестии не нужно) ---
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_data)
-        self.timer.start(1800000)
+        if not (self.quotes and INGESTION_DAEMON):
+            self.timer.start(1800000)
         self.update_data()
 
     # ---------- загрузка данных ----------
@@ -44,9 +57,26 @@ class CandleChart(QWidget):
         except Exception as e:
             print(f"[Chart] Error loading data: {e}")
             self.data = []
+        if self.live:
+            self.live.watch([self.symbol])
         self.scroll_offset = 0
         self.update()
 
+    def on_live_bar(self, symbol, timeframe, bar):
+        if symbol == self.symbol and timeframe == self.timeframe and apply_live_bar(self.data, bar):
+            self.update()
+
+    def on_quotes_updated(self, ticker, timeframe, last_bar):
+        """NOTIFY от ингестора: перечитываем серию из БД, без запросов к FXOpen."""
+        if ticker != self.symbol or timeframe != self.timeframe:
+            return
+        try:
+            self.data = read_candles(self.symbol, self.timeframe)
+        except Exception as e:
+            print(f"[Chart] Error loading data: {e}")
+            return
+        self.update()
+
     # ---------- масштабирование колесом ----------
     def wheelEvent(self, event):
         if not self.data:
@@ -2,22 +2,10 @@ from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem,
     QLabel, QTextEdit, QFrame, QLineEdit, QScrollArea, QGridLayout
 )
-from PyQt6.QtGui import QPixmap
 from PyQt6.QtCore import Qt
-import psycopg2
-import os
-from dotenv import load_dotenv
-
-
-# ────────────────────────────────────────────────
-# Настройки подключения к БД
-# ────────────────────────────────────────────────
-load_dotenv()
-PG_HOST = os.getenv("PG_HOST", "localhost")
-PG_PORT = os.getenv("PG_PORT", "5432")
-PG_DB = os.getenv("PG_DB", "delta_portfolio")
-PG_USER = os.getenv("PG_USER", "postgres")
-PG_PASSWORD = os.getenv("PG_PASSWORD", "1234")
+from core.database import raw_connection
+from core.logo_store import adopt_inline_logo
+from ui.components.logo_cache import get_logo_cache
 
 
 # ────────────────────────────────────────────────
@@ -245,14 +233,9 @@ class InstrumentsPage(QWidget):
 
     def load_tickers(self):
         try:
-            conn = psycopg2.connect(
-                host=PG_HOST, port=PG_PORT, dbname=PG_DB,
-                user=PG_USER, password=PG_PASSWORD
-            )
-            cur = conn.cursor()
-            cur.execute("SELECT ticker, name FROM instruments ORDER BY ticker ASC;")
-            rows = cur.fetchall()
-            conn.close()
+            with raw_connection() as conn, conn.cursor() as cur:
+                cur.execute("SELECT ticker, name FROM instruments ORDER BY ticker ASC;")
+                rows = cur.fetchall()
             self.all_tickers = rows
             self.display_tickers(rows)
         except Exception as e:
@@ -292,12 +275,8 @@ class InstrumentsPage(QWidget):
                 return "-"
 
         try:
-            conn = psycopg2.connect(
-                host=PG_HOST, port=PG_PORT, dbname=PG_DB,
-                user=PG_USER, password=PG_PASSWORD
-            )
-            cur = conn.cursor()
-            cur.execute("""
+            with raw_connection() as conn, conn.cursor() as cur:
+                cur.execute("""
                 SELECT
                     name, ticker, market, locale, primary_exchange, currency_name,
                     market_cap, total_employees, phone_number,
@@ -305,12 +284,11 @@ class InstrumentsPage(QWidget):
                     sic_description, list_date,
                     share_class_shares_outstanding, round_lot,
                     composite_figi, share_class_figi,
-                    homepage_url, description, logo_data
+                    homepage_url, description, logo_sha256
                 FROM instruments
                 WHERE ticker = %s;
-            """, (ticker,))
-            data = cur.fetchone()
-            conn.close()
+                """, (ticker,))
+                data = cur.fetchone()
 
             if not data:
                 self.description_box.setPlainText("No data for this ticker.")
@@ -319,18 +297,24 @@ class InstrumentsPage(QWidget):
             (name, ticker, market, locale, exch, currency,
              cap, employees, phone, address1, city, state, postal,
              sic_desc, list_date, shares, round_lot,
-             composite_figi, share_class_figi, homepage, desc, logo_data) = data
+             composite_figi, share_class_figi, homepage, desc, logo_sha256) = data
 
             # HEADER
             self.company_name.setText(name or "-")
             self.ticker_exchange.setText(f"{ticker} • {exch}" if exch else ticker)
 
-            # Логотип
-            if logo_data:
-                pixmap = QPixmap()
-                pixmap.loadFromData(logo_data)
-                scaled = pixmap.scaled(60, 60, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-                self.logo_label.setPixmap(scaled)
+            # Строки, которых ещё не коснулся перенос логотипов, — переносим по месту
+            if logo_sha256 is None:
+                try:
+                    with raw_connection() as conn, conn.cursor() as cur:
+                        logo_sha256 = adopt_inline_logo(cur, ticker)
+                except Exception as e:
+                    print(f"Ошибка переноса логотипа {ticker}: {e}")
+
+            # Логотип (миниатюра 60 px из кэша, декодируется один раз за сессию)
+            pixmap = get_logo_cache().get(logo_sha256, 60)
+            if pixmap is not None:
+                self.logo_label.setPixmap(pixmap)
             else:
                 self.logo_label.clear()
 
@@ -2,6 +2,9 @@ from PyQt6.QtWidgets import QWidget, QVBoxLayout, QLabel, QComboBox, QHBoxLayout
 from PyQt6.QtGui import QFont, QColor, QPainter, QPen, QPainterPath
 from PyQt6.QtCore import Qt, QSize
 import random
+import threading
+from services.chart_service import mark_active
+from ui.components.live_bridge import get_live_bridge
 
 
 class MiniChart(QWidget):
@@ -63,6 +66,7 @@ class AssetCard(QFrame):
 
         price_lbl = QLabel(f"{price:.2f}")
         price_lbl.setFont(QFont("Helvetica Neue", 12))
+        self.price_lbl = price_lbl
 
         day_lbl = QLabel(f"{day_change:+.2f}%")
         day_lbl.setFont(QFont("Helvetica Neue", 12))
@@ -82,6 +86,9 @@ class AssetCard(QFrame):
 
         self.setFixedHeight(56)
 
+    def set_price(self, price):
+        self.price_lbl.setText(f"{price:.2f}")
+
 
 class PortfolioPanel(QWidget):
     """Панель портфеля — поднятая шапка и увеличенные карточки"""
@@ -130,5 +137,28 @@ class PortfolioPanel(QWidget):
             ("MSFT", 395.10, +0.38, +15.40),
         ]
 
+        self.cards = {}
         for t, p, d, tot in assets_data:
-            main_layout.addWidget(AssetCard(t, p, d, tot))
+            self.cards[t] = AssetCard(t, p, d, tot)
+            main_layout.addWidget(self.cards[t])
+
+        # Цены позиций обновляются из live-фида
+        self.live = get_live_bridge()
+        if self.live:
+            self.live.bar_updated.connect(self.on_live_bar)
+            self.live.watch(list(self.cards))
+
+        # Позиции портфеля обновляются планировщиком в первую очередь.
+        # Запись в БД — в фоновом потоке, чтобы не задерживать построение окна
+        threading.Thread(
+            target=mark_active,
+            args=([t for t, *_ in assets_data],),
+            kwargs={"source": "portfolio"},
+            name="portfolio-priority",
+            daemon=True,
+        ).start()
+
+    def on_live_bar(self, symbol, timeframe, bar):
+        card = self.cards.get(symbol)
+        if card and timeframe == "M1":
+            card.set_price(bar[4])